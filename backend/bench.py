@@ -0,0 +1,388 @@
+# Load-test and latency benchmark for the API: runs the app in-process against libvirt's test
+# driver seeded with synthetic domains, drives a dashboard-like request mix and reports
+# per-endpoint latency percentiles, throughput and libvirt call counts as JSON.
+#
+#   python bench.py --domains 300 --pollers 50 --duration 30 -o bench-$(git rev-parse --short HEAD).json
+#   python bench.py --compare bench-old.json bench-new.json
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+# Requests are attributed to the endpoint label set here; libvirt calls made outside any
+# request (inventory resyncs, metrics sampling, job workers) count as "background".
+_endpoint: contextvars.ContextVar[str] = contextvars.ContextVar("bench_endpoint", default="background")
+
+
+def _configure_environment(args) -> str:
+    """Point the backend at the test driver and throwaway state before config is imported."""
+    workdir = tempfile.mkdtemp(prefix="vm-bench-")
+    os.environ.setdefault("LIBVIRT_URI", args.uri)
+    os.environ.setdefault("VM_IMAGE_DIR", os.path.join(workdir, "images"))
+    os.environ.setdefault("JOBS_DB_PATH", os.path.join(workdir, "jobs.sqlite3"))
+    # Hundreds of synthetic domains would not fit this machine's real limits.
+    os.environ.setdefault("CPU_OVERCOMMIT_RATIO", "1000")
+    os.environ.setdefault("MEMORY_OVERCOMMIT_RATIO", "1000")
+    os.makedirs(os.environ["VM_IMAGE_DIR"], exist_ok=True)
+    return workdir
+
+
+class LibvirtCallCounter:
+    """
+    Count libvirt API calls per endpoint label by wrapping the public methods of the
+    binding's connection, domain and storage-pool classes. Against a remote daemon each of
+    these is one RPC; with the test driver they are in-process, but the counts are the same.
+    """
+
+    _CLASSES = ("virConnect", "virDomain", "virStoragePool")
+
+    def __init__(self, libvirt_module):
+        self.libvirt = libvirt_module
+        self.counts: dict[str, int] = defaultdict(int)
+        self.methods: dict[str, dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self._saved: list[tuple[type, str, object]] = []
+
+    def _wrap(self, cls_name: str, name: str, fn):
+        counts, methods = self.counts, self.methods
+        qualified = f"{cls_name}.{name}"
+
+        def counted(*args, **kwargs):
+            label = _endpoint.get()
+            counts[label] += 1
+            methods[label][qualified] += 1
+            return fn(*args, **kwargs)
+
+        return counted
+
+    def install(self) -> None:
+        for cls_name in self._CLASSES:
+            cls = getattr(self.libvirt, cls_name, None)
+            if cls is None:
+                continue
+            for name, fn in list(vars(cls).items()):
+                if name.startswith("_") or not callable(fn):
+                    continue
+                self._saved.append((cls, name, fn))
+                setattr(cls, name, self._wrap(cls_name, name, fn))
+
+    def uninstall(self) -> None:
+        for cls, name, fn in self._saved:
+            setattr(cls, name, fn)
+        self._saved.clear()
+
+
+def _seed_domains(libvirt, uri: str, count: int, running: float):
+    """
+    Define `count` bench-NNNN domains and start a `running` fraction of them. The returned
+    connection must stay open: the test driver frees its state when the last one closes.
+    """
+    conn = libvirt.open(uri)
+    rng = random.Random(0)
+    for i in range(count):
+        name = f"bench-{i:04d}"
+        memory = rng.choice((256, 512, 1024, 2048))
+        xml = (
+            f"<domain type='test'><name>{name}</name><memory unit='MiB'>{memory}</memory>"
+            f"<vcpu>{rng.choice((1, 2, 4))}</vcpu><os><type>hvm</type></os>"
+            "<devices><graphics type='spice' autoport='yes'/></devices></domain>"
+        )
+        domain = conn.defineXML(xml)
+        if rng.random() < running:
+            domain.create()
+    return conn
+
+
+def _percentile(ordered: list[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return 0.0
+    rank = max(0, min(len(ordered) - 1, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+class Recorder:
+    """Latency samples and status codes per endpoint label."""
+
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.statuses: dict[str, dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        self.failures: dict[str, int] = defaultdict(int)
+
+    async def request(self, client, label: str, method: str, path: str, **kwargs):
+        token = _endpoint.set(label)
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, path, **kwargs)
+        except Exception:
+            self.failures[label] += 1
+            return None
+        finally:
+            _endpoint.reset(token)
+            self.latencies[label].append(time.perf_counter() - started)
+        self.statuses[label][response.status_code] += 1
+        return response
+
+    def report(self, elapsed: float, calls: LibvirtCallCounter) -> dict:
+        endpoints = {}
+        for label in sorted(self.latencies):
+            samples = sorted(self.latencies[label])
+            n = len(samples)
+            errors = self.failures[label] + sum(c for s, c in self.statuses[label].items() if s >= 400)
+            endpoints[label] = {
+                "requests": n,
+                "errors": errors,
+                "status": {str(s): c for s, c in sorted(self.statuses[label].items())},
+                "throughput_rps": round(n / elapsed, 2),
+                "latency_ms": {
+                    "mean": round(1000 * sum(samples) / n, 3),
+                    "p50": round(1000 * _percentile(samples, 50), 3),
+                    "p95": round(1000 * _percentile(samples, 95), 3),
+                    "p99": round(1000 * _percentile(samples, 99), 3),
+                    "max": round(1000 * samples[-1], 3),
+                },
+                "libvirt_calls": calls.counts.get(label, 0),
+                "libvirt_calls_per_request": round(calls.counts.get(label, 0) / n, 2),
+                "libvirt_methods": dict(sorted(calls.methods[label].items())),
+            }
+        total = sum(e["requests"] for e in endpoints.values())
+        return {
+            "endpoints": endpoints,
+            "background": {
+                "libvirt_calls": calls.counts.get("background", 0),
+                "libvirt_methods": dict(sorted(calls.methods["background"].items())),
+            },
+            "totals": {
+                "requests": total,
+                "errors": sum(e["errors"] for e in endpoints.values()),
+                "throughput_rps": round(total / elapsed, 2),
+                "libvirt_calls": sum(calls.counts.values()),
+            },
+        }
+
+
+async def _until(deadline: float, interval: float, offset: float, step) -> None:
+    """Call `step()` every `interval` seconds (first after `offset`) until `deadline`."""
+    await asyncio.sleep(offset)
+    next_at = time.monotonic()
+    while time.monotonic() < deadline:
+        await step()
+        next_at += interval
+        await asyncio.sleep(max(0.0, min(next_at, deadline) - time.monotonic()))
+
+
+async def _poller(client, rec: Recorder, args, deadline: float, index: int) -> None:
+    # A dashboard tab: the VM list every second (revalidated with its ETag, as browsers
+    # do), host info and metrics every fifth tick.
+    etag = None
+    tick = 0
+
+    async def step():
+        nonlocal etag, tick
+        headers = {"If-None-Match": etag} if etag else {}
+        response = await rec.request(client, "GET /vms/", "GET", "/vms/", headers=headers)
+        if response is not None and response.status_code == 200:
+            etag = response.headers.get("etag")
+        if tick % 5 == 0:
+            await rec.request(client, "GET /sys/", "GET", "/sys/")
+            await rec.request(client, "GET /vms/metrics", "GET", "/vms/metrics")
+        tick += 1
+
+    await _until(deadline, args.poll_interval, index * args.poll_interval / max(1, args.pollers), step)
+
+
+async def _lifecycle(client, rec: Recorder, args, deadline: float, names: list[str]) -> None:
+    # Bursts of start/stop requests, as when someone selects a row of VMs and clicks.
+    rng = random.Random(1)
+
+    async def step():
+        calls = []
+        for name in rng.sample(names, min(args.burst_size, len(names))):
+            action = rng.choice(("start", "stop"))
+            calls.append(rec.request(client, f"POST /vms/{action}/{{name}}", "POST", f"/vms/{action}/{name}"))
+        await asyncio.gather(*calls)
+
+    await _until(deadline, args.burst_interval, args.burst_interval / 2, step)
+
+
+async def _editor(client, rec: Recorder, args, deadline: float, names: list[str]) -> None:
+    rng = random.Random(2)
+
+    async def step():
+        name = rng.choice(names)
+        body = {"memory_mb": rng.choice((256, 512, 768, 1024))}
+        await rec.request(client, "POST /vms/edit/{name}", "POST", f"/vms/edit/{name}", json=body)
+
+    await _until(deadline, args.edit_interval, args.edit_interval / 3, step)
+
+
+async def _creator(client, rec: Recorder, args, deadline: float) -> None:
+    counter = 0
+
+    async def step():
+        nonlocal counter
+        body = {"name": f"bench-new-{counter:04d}", "memory_mb": 256, "vcpus": 1, "disk_gb": 1}
+        counter += 1
+        await rec.request(client, "POST /vms/create", "POST", "/vms/create", json=body)
+
+    await _until(deadline, args.create_interval, args.create_interval / 4, step)
+
+
+async def _run(args) -> dict:
+    import httpx
+    import libvirt
+
+    calls = LibvirtCallCounter(libvirt)
+    seed_conn = _seed_domains(libvirt, args.uri, args.domains, args.running)
+    names = [f"bench-{i:04d}" for i in range(args.domains)]
+
+    import main
+
+    rec = Recorder()
+    calls.install()
+    try:
+        async with main.app.router.lifespan_context(main.app):
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+                # Wait for the initial inventory sync so startup is not part of the numbers.
+                for _ in range(100):
+                    response = await client.get("/vms/")
+                    if response.status_code == 200:
+                        break
+                    await asyncio.sleep(0.1)
+                calls.counts.clear()
+                calls.methods.clear()
+
+                started = time.monotonic()
+                deadline = started + args.duration
+                workers = [_poller(client, rec, args, deadline, i) for i in range(args.pollers)]
+                if args.burst_size:
+                    workers.append(_lifecycle(client, rec, args, deadline, names))
+                if args.edit_interval:
+                    workers.append(_editor(client, rec, args, deadline, names))
+                if args.create_interval:
+                    workers.append(_creator(client, rec, args, deadline))
+                await asyncio.gather(*workers)
+                elapsed = time.monotonic() - started
+    finally:
+        calls.uninstall()
+        seed_conn.close()
+
+    report = rec.report(elapsed, calls)
+    report["meta"] = {
+        "commit": _git_commit(),
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "libvirt_uri": args.uri,
+        "elapsed": round(elapsed, 3),
+        "config": {
+            k: getattr(args, k)
+            for k in (
+                "domains", "running", "duration", "pollers", "poll_interval", "burst_size",
+                "burst_interval", "edit_interval", "create_interval",
+            )
+        },
+    }
+    return report
+
+
+def _git_commit() -> str | None:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, timeout=5,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return out.stdout.strip() or None
+
+
+def _print_summary(report: dict, out=sys.stderr) -> None:
+    print(f"{'endpoint':<28} {'reqs':>7} {'err':>5} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'lv/req':>7}", file=out)
+    for label, e in report["endpoints"].items():
+        lat = e["latency_ms"]
+        print(
+            f"{label:<28} {e['requests']:>7} {e['errors']:>5} {e['throughput_rps']:>8.1f} "
+            f"{lat['p50']:>8.2f} {lat['p95']:>8.2f} {lat['p99']:>8.2f} {e['libvirt_calls_per_request']:>7.2f}",
+            file=out,
+        )
+    print(f"background libvirt calls: {report['background']['libvirt_calls']}", file=out)
+
+
+def compare(old: dict, new: dict, threshold: float, out=sys.stdout) -> bool:
+    """Print p95/p99 and libvirt-call changes per endpoint; True if any p95 grew by more than `threshold` %."""
+    regressed = False
+    print(f"{'endpoint':<28} {'p95 old':>9} {'p95 new':>9} {'change':>8} {'p99 new':>9} {'lv/req':>13}", file=out)
+    for label in sorted(set(old["endpoints"]) | set(new["endpoints"])):
+        a, b = old["endpoints"].get(label), new["endpoints"].get(label)
+        if a is None or b is None:
+            print(f"{label:<28} {'only in ' + ('new' if a is None else 'old'):>9}", file=out)
+            continue
+        before, after = a["latency_ms"]["p95"], b["latency_ms"]["p95"]
+        change = 100 * (after - before) / before if before else 0.0
+        flag = ""
+        if change > threshold:
+            regressed = True
+            flag = "  REGRESSED"
+        calls = f"{a['libvirt_calls_per_request']:g} -> {b['libvirt_calls_per_request']:g}"
+        print(
+            f"{label:<28} {before:>9.2f} {after:>9.2f} {change:>+7.1f}% {b['latency_ms']['p99']:>9.2f} {calls:>13}{flag}",
+            file=out,
+        )
+    return regressed
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the API in-process against the libvirt test driver.")
+    parser.add_argument("--uri", default="test:///default", help="libvirt URI to seed and benchmark against")
+    parser.add_argument("--domains", type=int, default=300, help="synthetic domains to define")
+    parser.add_argument("--running", type=float, default=0.5, help="fraction of them to start")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of load")
+    parser.add_argument("--pollers", type=int, default=50, help="dashboard clients polling /vms/")
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    parser.add_argument("--burst-size", type=int, default=20, help="lifecycle POSTs per burst (0 disables)")
+    parser.add_argument("--burst-interval", type=float, default=5.0)
+    parser.add_argument("--edit-interval", type=float, default=1.0, help="seconds between edits (0 disables)")
+    parser.add_argument("--create-interval", type=float, default=10.0, help="seconds between creates (0 disables)")
+    parser.add_argument("-o", "--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary image and jobs directory")
+    parser.add_argument(
+        "--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two saved reports instead of running"
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=10.0, help="with --compare, exit 1 if a p95 grows by more than this %%"
+    )
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f_old, open(args.compare[1]) as f_new:
+            return 1 if compare(json.load(f_old), json.load(f_new), args.threshold) else 0
+
+    workdir = _configure_environment(args)
+    try:
+        report = asyncio.run(_run(args))
+    finally:
+        if args.keep:
+            print(f"kept {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    _print_summary(report)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
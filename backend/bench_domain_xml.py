@@ -0,0 +1,159 @@
+# Micro-benchmark for domain_xml.py: the streaming extractor and the memoized lookup against
+# the full ElementTree parse the inventory used before, on a typical running QEMU domain.
+#
+#   python bench_domain_xml.py [--number 5000]
+import argparse
+import timeit
+import xml.etree.ElementTree as ET
+
+from domain_xml import MEMORY_UNITS, extract, summarize_xml
+
+# `virsh dumpxml` of a running q35 guest with two disks, SPICE graphics and the usual devices.
+SAMPLE = """<domain type='kvm' id='7'>
+  <name>web-01</name>
+  <uuid>8f1c9a3e-3d2b-4c55-9a0e-5f1e2b7c9d10</uuid>
+  <metadata>
+    <libosinfo:libosinfo xmlns:libosinfo="http://libosinfo.org/xmlns/libvirt/domain/1.0">
+      <libosinfo:os id="http://debian.org/debian/12"/>
+    </libosinfo:libosinfo>
+  </metadata>
+  <memory unit='KiB'>4194304</memory>
+  <currentMemory unit='KiB'>4194304</currentMemory>
+  <vcpu placement='static'>4</vcpu>
+  <resource><partition>/machine</partition></resource>
+  <os>
+    <type arch='x86_64' machine='pc-q35-8.2'>hvm</type>
+    <boot dev='hd'/>
+  </os>
+  <features><acpi/><apic/><vmport state='off'/></features>
+  <cpu mode='host-passthrough' check='none' migratable='on'/>
+  <clock offset='utc'>
+    <timer name='rtc' tickpolicy='catchup'/>
+    <timer name='pit' tickpolicy='delay'/>
+    <timer name='hpet' present='no'/>
+  </clock>
+  <on_poweroff>destroy</on_poweroff>
+  <on_reboot>restart</on_reboot>
+  <on_crash>destroy</on_crash>
+  <pm><suspend-to-mem enabled='no'/><suspend-to-disk enabled='no'/></pm>
+  <devices>
+    <emulator>/usr/bin/qemu-system-x86_64</emulator>
+    <disk type='file' device='disk'>
+      <driver name='qemu' type='qcow2' discard='unmap'/>
+      <source file='/var/lib/libvirt/images/web-01.qcow2' index='2'/>
+      <backingStore/>
+      <target dev='vda' bus='virtio'/>
+      <alias name='virtio-disk0'/>
+      <address type='pci' domain='0x0000' bus='0x04' slot='0x00' function='0x0'/>
+    </disk>
+    <disk type='file' device='cdrom'>
+      <driver name='qemu' type='raw'/>
+      <source file='/var/lib/libvirt/iso/debian-12.iso' index='1'/>
+      <target dev='sda' bus='sata'/>
+      <readonly/>
+      <alias name='sata0-0-0'/>
+      <address type='drive' controller='0' bus='0' target='0' unit='0'/>
+    </disk>
+    <controller type='usb' index='0' model='qemu-xhci' ports='15'>
+      <alias name='usb'/>
+      <address type='pci' domain='0x0000' bus='0x02' slot='0x00' function='0x0'/>
+    </controller>
+    <controller type='pci' index='0' model='pcie-root'><alias name='pcie.0'/></controller>
+    <controller type='pci' index='1' model='pcie-root-port'>
+      <model name='pcie-root-port'/><target chassis='1' port='0x10'/><alias name='pci.1'/>
+      <address type='pci' domain='0x0000' bus='0x00' slot='0x02' function='0x0' multifunction='on'/>
+    </controller>
+    <controller type='pci' index='2' model='pcie-root-port'>
+      <model name='pcie-root-port'/><target chassis='2' port='0x11'/><alias name='pci.2'/>
+      <address type='pci' domain='0x0000' bus='0x00' slot='0x02' function='0x1'/>
+    </controller>
+    <controller type='sata' index='0'><alias name='ide'/></controller>
+    <controller type='virtio-serial' index='0'><alias name='virtio-serial0'/></controller>
+    <interface type='network'>
+      <mac address='52:54:00:6b:3c:58'/>
+      <source network='default' portid='2b1c' bridge='virbr0'/>
+      <target dev='vnet6'/>
+      <model type='virtio'/>
+      <alias name='net0'/>
+      <address type='pci' domain='0x0000' bus='0x01' slot='0x00' function='0x0'/>
+    </interface>
+    <serial type='pty'><source path='/dev/pts/3'/><target type='isa-serial' port='0'><model name='isa-serial'/></target><alias name='serial0'/></serial>
+    <console type='pty' tty='/dev/pts/3'><source path='/dev/pts/3'/><target type='serial' port='0'/><alias name='serial0'/></console>
+    <channel type='spicevmc'><target type='virtio' name='com.redhat.spice.0' state='connected'/><alias name='channel0'/></channel>
+    <input type='tablet' bus='usb'><alias name='input0'/></input>
+    <input type='mouse' bus='ps2'><alias name='input1'/></input>
+    <input type='keyboard' bus='ps2'><alias name='input2'/></input>
+    <graphics type='spice' port='5907' autoport='yes' listen='127.0.0.1'>
+      <listen type='address' address='127.0.0.1'/>
+      <image compression='off'/>
+    </graphics>
+    <sound model='ich9'><alias name='sound0'/></sound>
+    <audio id='1' type='spice'/>
+    <video><model type='qxl' ram='65536' vram='65536' vgamem='16384' heads='1' primary='yes'/><alias name='video0'/></video>
+    <redirdev bus='usb' type='spicevmc'><alias name='redir0'/></redirdev>
+    <memballoon model='virtio'><alias name='balloon0'/></memballoon>
+    <rng model='virtio'><backend model='random'>/dev/urandom</backend><alias name='rng0'/></rng>
+  </devices>
+  <seclabel type='dynamic' model='apparmor' relabel='yes'><label>libvirt-8f1c</label><imagelabel>libvirt-8f1c</imagelabel></seclabel>
+  <seclabel type='dynamic' model='dac' relabel='yes'><label>+64055:+994</label><imagelabel>+64055:+994</imagelabel></seclabel>
+</domain>"""
+
+
+def elementtree_summary(xml: str) -> dict:
+    """The previous inventory parse: full tree, then find() the fields."""
+    info = {"port": None, "memory_mb": None, "vcpus": None, "disks": []}
+    root = ET.fromstring(xml)
+    graphics = root.find(".//graphics[@type='spice']")
+    if graphics is not None:
+        port = graphics.get("port")
+        if port and port != "-1":
+            info["port"] = int(port)
+    mem_elem = root.find("memory")
+    if mem_elem is not None:
+        mem = int(mem_elem.text)
+        unit = mem_elem.get("unit", "KiB")
+        if unit == "KiB":
+            mem //= 1024
+        elif unit == "GiB":
+            mem *= 1024
+        info["memory_mb"] = mem
+    vcpu_elem = root.find("vcpu")
+    if vcpu_elem is not None:
+        info["vcpus"] = int(vcpu_elem.text)
+    for source in root.findall("./devices/disk/source[@file]"):
+        info["disks"].append(source.get("file"))
+    return info
+
+
+def _check() -> None:
+    summary = extract(SAMPLE).as_dict()
+    assert summary.pop("cpu_pinning") is None
+    assert summary == elementtree_summary(SAMPLE)
+    # 4 GiB in every unit libvirt accepts.
+    for unit, scale in MEMORY_UNITS.items():
+        if 4 * 1024 ** 3 % scale == 0:
+            xml = SAMPLE.replace("<memory unit='KiB'>4194304</memory>", f"<memory unit='{unit}'>{4 * 1024 ** 3 // scale}</memory>")
+            assert extract(xml).memory_mb == 4096, unit
+    assert extract(SAMPLE.replace("<memory unit='KiB'>4194304", "<memory unit='MB'>4000")).memory_mb == 3814
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare domain XML summary parsers.")
+    parser.add_argument("--number", type=int, default=5000, help="calls per timing run")
+    args = parser.parse_args()
+    _check()
+    summarize_xml(SAMPLE)  # warm the cache
+    cases = {
+        "ElementTree full parse": lambda: elementtree_summary(SAMPLE),
+        "streaming extract": lambda: extract(SAMPLE),
+        "memoized (cache hit)": lambda: summarize_xml(SAMPLE),
+    }
+    baseline = None
+    for label, fn in cases.items():
+        best = min(timeit.repeat(fn, number=args.number, repeat=5)) / args.number
+        baseline = baseline or best
+        print(f"{label:<24} {best * 1e6:9.2f} us/call  {baseline / best:6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+# Benchmark for spice_decode.py: CPU per frame for decoding SPICE LZ images in the browser
+# (src/lz.js, run under node) against decoding them in the backend and drawing the
+# pre-decoded RGBA, on synthetic desktop frames. Also checks that both paths give the same
+# pixels.
+#
+#   python bench_spice_decode.py [--number 20] [--node node]
+import argparse
+import json
+import os
+import random
+import struct
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from spice_decode import (
+    LZ_HEADER,
+    LZ_IMAGE_TYPE_RGB32,
+    LZ_IMAGE_TYPE_RGBA,
+    SPICE_IMAGE_TYPE_LZ_RGB,
+    decode_lz_rgb,
+    rewrite_draw_copy,
+)
+
+SRC = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# Times convert_spice_lz_to_web (client path) and the copy spicetype.js makes of a
+# pre-decoded image (server path) per frame; putImageData, common to both, is left out.
+NODE_HARNESS = """
+import { readFileSync, writeFileSync } from 'fs';
+import { convert_spice_lz_to_web } from '%(lz)s';
+const [manifest, number] = [JSON.parse(readFileSync(process.argv[2])), Number(process.argv[3])];
+const ctx = { createImageData: (w, h) => ({ width: w, height: h, data: new Uint8ClampedArray(w * h * 4) }) };
+function cpu(fn) {
+    const start = process.cpuUsage();
+    for (let i = 0; i < number; i++) fn();
+    const used = process.cpuUsage(start);
+    return (used.user + used.system) / 1000 / number;
+}
+const results = manifest.map(f => {
+    const lz = readFileSync(f.lz);
+    const image = { type: f.type, width: f.width, height: f.height, top_down: f.top_down,
+                    data: lz.buffer.slice(lz.byteOffset, lz.byteOffset + lz.byteLength) };
+    const out = convert_spice_lz_to_web(ctx, image);
+    writeFileSync(f.out, out.data);
+    const rgba = readFileSync(f.rgba);
+    const message = rgba.buffer.slice(rgba.byteOffset, rgba.byteOffset + rgba.byteLength);
+    return {
+        client_ms: cpu(() => convert_spice_lz_to_web(ctx, image)),
+        server_ms: cpu(() => new Uint8ClampedArray(message.slice(0))),
+    };
+});
+console.log(JSON.stringify(results));
+"""
+
+
+def _match(units: bytes, at: int, ref: int, bpp: int, limit: int) -> int:
+    """Number of pixels (up to `limit`) at `at` equal to those at `ref`, compared in growing blocks."""
+    n, step = 0, 8
+    while n < limit:
+        k = min(step, limit - n)
+        if units[(at + n) * bpp:(at + n + k) * bpp] == units[(ref + n) * bpp:(ref + n + k) * bpp]:
+            n += k
+            step *= 2
+        elif step > 1:
+            step = 1
+        else:
+            break
+    return n
+
+
+def lz_encode(units: bytes, bpp: int, width: int, alpha: bool) -> bytes:
+    """
+    A greedy SPICE LZ encoder for test frames: repeats of the previous pixel or of the row
+    above, literals otherwise. Output decodes with src/lz.js; it is not lz.c's encoder.
+    """
+    out = bytearray()
+    count = len(units) // bpp
+    extra = 3 if alpha else 1
+    i = literal = 0
+
+    def flush(end):
+        nonlocal literal
+        while literal < end:
+            run = min(32, end - literal)
+            out.append(run - 1)
+            out.extend(units[literal * bpp:(literal + run) * bpp])
+            literal += run
+
+    while i < count:
+        best, distance = 0, 0
+        for d in (1, width):
+            if i >= d:
+                n = _match(units, i, i - d, bpp, count - i)
+                if n > best:
+                    best, distance = n, d
+        if best < extra + 1:
+            i += 1
+            continue
+        flush(i)
+        field = best - extra + 1
+        s = distance - 1
+        head = (min(field, 7) << 5) | (min(s >> 8, 31) if s < 8191 else 31)
+        out.append(head)
+        if field >= 7:
+            rest = field - 7
+            while rest >= 255:
+                out.append(255)
+                rest -= 255
+            out.append(rest)
+        if s < 8191:
+            out.append(s & 255)
+        else:
+            out += bytes((255, (s - 8191) >> 8, (s - 8191) & 255))
+        i += best
+        literal = i
+    flush(count)
+    return bytes(out)
+
+
+def desktop_frame(width: int, height: int, seed: int) -> bytes:
+    """BGR pixels of a synthetic desktop: flat panels, a text area and a photo-like region."""
+    rng = random.Random(seed)
+    rows = []
+    for y in range(height):
+        row = bytearray(bytes((0xE8, 0xE2, 0xDE)) * width)
+        if y < 28:
+            row[:] = bytes((0x50, 0x38, 0x30)) * width
+        elif y % 18 < 12:
+            # "Text": sparse dark glyph pixels on the panel.
+            for x in range(width // 8, width // 2):
+                if rng.random() < 0.18:
+                    row[x * 3:x * 3 + 3] = b"\x20\x20\x20"
+        for x in range(width * 5 // 8, width - 16):
+            if height // 4 < y < height * 3 // 4:
+                v = (x * 3 + y * 2 + rng.randrange(24)) & 255
+                row[x * 3:x * 3 + 3] = bytes((v, (v + y) & 255, (255 - v) & 255))
+        rows.append(bytes(row))
+    return b"".join(rows)
+
+
+def draw_copy_body(width: int, height: int, lz_type: int, top_down: bool, lz: bytes) -> bytes:
+    """A SpiceMsgDisplayDrawCopy body with the LZ image after the fixed fields."""
+    fixed = struct.calcsize("<I4iB") + struct.calcsize("<I4iHBB2iI")
+    header = LZ_HEADER.pack(b"LZ  ", 0x00010001, lz_type, width, height, width * 4, int(top_down))
+    return b"".join((
+        struct.pack("<I4iB", 0, 0, 0, height, width, 0),
+        struct.pack("<I4iHBB2iI", fixed, 0, 0, height, width, 8, 0, 0, 0, 0, 0),
+        struct.pack("<QBBII", 42, SPICE_IMAGE_TYPE_LZ_RGB, 0, width, height),
+        struct.pack("<I", LZ_HEADER.size + len(lz)),
+        header,
+        lz,
+    ))
+
+
+def _frames() -> list[dict]:
+    frames = []
+    for label, width, height, lz_type, top_down in (
+        ("icon 64x64 RGBA", 64, 64, LZ_IMAGE_TYPE_RGBA, True),
+        ("window 640x480", 640, 480, LZ_IMAGE_TYPE_RGB32, True),
+        ("screen 1280x720 bottom-up", 1280, 720, LZ_IMAGE_TYPE_RGB32, False),
+    ):
+        bgr = desktop_frame(width, height, width)
+        lz = lz_encode(bgr, 3, width, False)
+        if lz_type == LZ_IMAGE_TYPE_RGBA:
+            alpha = bytes(255 if (x - 32) ** 2 + (y - 32) ** 2 < 900 else 0 for y in range(height) for x in range(width))
+            lz += lz_encode(alpha, 1, width, True)
+        frames.append({
+            "label": label, "width": width, "height": height, "type": lz_type, "top_down": top_down,
+            "lz": lz, "body": draw_copy_body(width, height, lz_type, top_down, lz),
+        })
+    return frames
+
+
+def _cpu_ms(fn, number: int) -> float:
+    started = time.process_time()
+    for _ in range(number):
+        fn()
+    return (time.process_time() - started) / number * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare client-side and server-side SPICE LZ decoding.")
+    parser.add_argument("--number", type=int, default=20, help="decodes per frame and path")
+    parser.add_argument("--node", default="node", help="node binary used to run src/lz.js")
+    args = parser.parse_args()
+    frames = _frames()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        manifest = []
+        for i, f in enumerate(frames):
+            pixels, _ = decode_lz_rgb(f["type"], f["width"], f["height"], f["top_down"], f["lz"])
+            f["rgba"] = pixels
+            entry = {k: f[k] for k in ("width", "height", "type", "top_down")}
+            entry.update({k: os.path.join(tmp, f"{i}.{k}") for k in ("lz", "out", "rgba")})
+            with open(entry["lz"], "wb") as fh:
+                fh.write(f["lz"])
+            with open(entry["rgba"], "wb") as fh:
+                fh.write(pixels)
+            manifest.append(entry)
+        with open(os.path.join(tmp, "manifest.json"), "w") as fh:
+            json.dump(manifest, fh)
+        harness = os.path.join(tmp, "harness.mjs")
+        with open(harness, "w") as fh:
+            fh.write(NODE_HARNESS % {"lz": "file://" + os.path.join(SRC, "lz.js")})
+        result = subprocess.run(
+            [args.node, harness, os.path.join(tmp, "manifest.json"), str(args.number)],
+            check=True, capture_output=True, text=True,
+        )
+        browser = json.loads(result.stdout)
+        for f, entry in zip(frames, manifest):
+            with open(entry["out"], "rb") as fh:
+                assert fh.read() == f["rgba"], f"{f['label']}: server decode differs from src/lz.js"
+
+    with ProcessPoolExecutor(1) as pool:
+        pool.submit(rewrite_draw_copy, frames[0]["body"]).result()  # start the worker
+        print(f"{'frame':<27}{'LZ bytes':>10}{'RGBA bytes':>12}  {'client: browser':>16}  "
+              f"{'server: backend':>16}{'  (pool wall)':>14}  {'server: browser':>16}")
+        for f, b in zip(frames, browser):
+            server_cpu = _cpu_ms(lambda: rewrite_draw_copy(f["body"]), args.number)
+            started = time.perf_counter()
+            for _ in range(args.number):
+                pool.submit(rewrite_draw_copy, f["body"]).result()
+            pool_ms = (time.perf_counter() - started) / args.number * 1000
+            print(f"{f['label']:<27}{len(f['lz']):>10}{len(f['rgba']) + 1:>12}  {b['client_ms']:>13.3f} ms  "
+                  f"{server_cpu:>13.3f} ms{pool_ms:>11.3f} ms  {b['server_ms']:>13.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+# Capacity ledger: running totals of vCPUs and memory committed to domains, checked against
+# each host's size times configurable overcommit ratios before VMs are created or grown.
+import threading
+from urllib.parse import urlparse
+
+from config import (
+    CPU_OVERCOMMIT_RATIO,
+    MEMORY_OVERCOMMIT_RATIO,
+    HOST_MEMORY_RESERVE_MB,
+    CAPACITY_COUNT_STOPPED,
+    DEFAULT_HOST,
+    LIBVIRT_HOSTS,
+)
+from host_telemetry import host_telemetry
+from inventory import inventory
+
+# Domains in these states hold no host CPU or memory.
+_INACTIVE_STATUSES = ("Shut off", "Crashed")
+
+
+class CapacityError(Exception):
+    """Raised when a request would commit more vCPUs or memory than the host allows."""
+
+
+class CapacityLedger:
+    """
+    Committed vCPUs and memory per host, kept as running totals.
+
+    The ledger follows inventory change events, adjusting the totals by the difference for
+    each added, updated or removed domain, so admission checks never enumerate domains.
+    API requests take a reservation with `admit()` before they touch libvirt; a reservation
+    replaces the domain's current allocation in the totals until it is committed (the
+    operation succeeded) or released (it failed), so concurrent requests cannot together
+    overshoot the limits.
+
+    By default stopped domains count too, since starting them must not overcommit the host;
+    set CAPACITY_COUNT_STOPPED=0 to count running domains only.
+    """
+
+    def __init__(self, count_stopped: bool = CAPACITY_COUNT_STOPPED):
+        self.count_stopped = count_stopped
+        # name -> (vcpus, memory_mb, active, host)
+        self._domains: dict[str, tuple[int, int, bool, str]] = {}
+        # name -> (vcpus, memory_mb, host)
+        self._reserved: dict[str, tuple[int, int, str]] = {}
+        # host -> [vcpus, memory_mb]
+        self._totals: dict[str, list[int]] = {host: [0, 0] for host in LIBVIRT_HOSTS}
+        self._changed = threading.Condition()
+
+    def start(self) -> None:
+        inventory.subscribe(self._on_changes)
+        # Anything published before we subscribed.
+        self._on_changes([{"op": "add", "vm": vm} for vm in inventory.listing()])
+
+    def stop(self) -> None:
+        inventory.unsubscribe(self._on_changes)
+
+    # -- bookkeeping (caller holds self._changed) -------------------------------------------
+
+    def _effective(self, name: str) -> tuple[int, int, str | None]:
+        reserved = self._reserved.get(name)
+        if reserved is not None:
+            return reserved
+        domain = self._domains.get(name)
+        if domain is None or not (domain[2] or self.count_stopped):
+            return 0, 0, None
+        return domain[0], domain[1], domain[3]
+
+    def _replace(self, name: str, change) -> None:
+        """Apply `change()` to the per-domain state and move the host totals by the difference."""
+        old_vcpus, old_mem, old_host = self._effective(name)
+        change()
+        new_vcpus, new_mem, new_host = self._effective(name)
+        if old_host is not None:
+            totals = self._totals.setdefault(old_host, [0, 0])
+            totals[0] -= old_vcpus
+            totals[1] -= old_mem
+        if new_host is not None:
+            totals = self._totals.setdefault(new_host, [0, 0])
+            totals[0] += new_vcpus
+            totals[1] += new_mem
+        self._changed.notify_all()
+
+    def _on_changes(self, changes: list[dict]) -> None:
+        with self._changed:
+            for change in changes:
+                if change["op"] == "remove":
+                    self._replace(change["name"], lambda n=change["name"]: self._domains.pop(n, None))
+                    continue
+                vm = change["vm"] if change["op"] == "add" else inventory.get(change["name"])
+                if vm is None:
+                    continue
+                record = (
+                    int(vm.get("vcpus") or 0),
+                    int(vm.get("memory_mb") or 0),
+                    vm.get("status") not in _INACTIVE_STATUSES,
+                    vm.get("host") or DEFAULT_HOST,
+                )
+                self._replace(vm["name"], lambda n=vm["name"], r=record: self._domains.__setitem__(n, r))
+
+    # -- limits -----------------------------------------------------------------------------
+
+    def host_size(self, host: str) -> tuple[int, int]:
+        """
+        (logical CPUs, memory MiB) of `host`. The machine this backend runs on is measured
+        by host telemetry; remote hosts report their size to the inventory.
+        """
+        if urlparse(LIBVIRT_HOSTS.get(host, "")).hostname is None and host_telemetry.memory_kb:
+            return host_telemetry.vcpus, host_telemetry.memory_kb // 1024
+        return inventory.host_size(host) or (0, 0)
+
+    def limits(self, host: str = DEFAULT_HOST) -> tuple[int, int]:
+        """(vCPU limit, memory limit in MB) of `host` from its size and the overcommit ratios."""
+        cpus, memory_mb = self.host_size(host)
+        vcpus = int(cpus * CPU_OVERCOMMIT_RATIO)
+        memory = int((memory_mb - HOST_MEMORY_RESERVE_MB) * MEMORY_OVERCOMMIT_RATIO)
+        return vcpus, max(0, memory)
+
+    def headroom(self, host: str) -> tuple[int, int]:
+        """(vCPUs, memory MB) still available on `host`, including pending reservations."""
+        with self._changed:
+            vcpu_limit, mem_limit = self.limits(host)
+            committed = self._totals.get(host, [0, 0])
+            return vcpu_limit - committed[0], mem_limit - committed[1]
+
+    def _check(self, name: str, host: str, vcpus: int, memory_mb: int) -> None:
+        old_vcpus, old_mem, old_host = self._effective(name)
+        if old_host != host:
+            # Moving to another host: nothing is freed on the target.
+            old_vcpus = old_mem = 0
+        committed = self._totals.get(host, [0, 0])
+        vcpu_limit, mem_limit = self.limits(host)
+        new_vcpus = committed[0] - old_vcpus + vcpus
+        new_mem = committed[1] - old_mem + memory_mb
+        # Shrinking is always allowed, even on a host that is already over its limits.
+        if vcpus > old_vcpus and new_vcpus > vcpu_limit:
+            raise CapacityError(
+                f"Not enough vCPU capacity on {host}: {new_vcpus} would be committed, limit is "
+                f"{vcpu_limit} ({self.host_size(host)[0]} host CPUs x {CPU_OVERCOMMIT_RATIO:g})"
+            )
+        if memory_mb > old_mem and new_mem > mem_limit:
+            raise CapacityError(
+                f"Not enough memory capacity on {host}: {new_mem} MB would be committed, "
+                f"limit is {mem_limit} MB"
+            )
+
+    def check(self, name: str, vcpus: int, memory_mb: int, host: str = DEFAULT_HOST) -> None:
+        """Raise CapacityError if admit() would, without reserving anything."""
+        with self._changed:
+            self._check(name, host, vcpus, memory_mb)
+
+    # -- reservations -----------------------------------------------------------------------
+
+    def admit(
+        self, name: str, vcpus: int | None = None, memory_mb: int | None = None, host: str | None = None
+    ) -> None:
+        """
+        Reserve `vcpus`/`memory_mb` as the new allocation of domain `name` on `host` (None
+        keeps the current value / owning host), or raise CapacityError. Calling it again
+        for the same domain replaces the previous reservation.
+        """
+        with self._changed:
+            if name in self._reserved:
+                current = self._reserved[name]
+            else:
+                domain = self._domains.get(name)
+                current = (domain[0], domain[1], domain[3]) if domain else (0, 0, DEFAULT_HOST)
+            wanted = (
+                current[0] if vcpus is None else vcpus,
+                current[1] if memory_mb is None else memory_mb,
+                host or current[2],
+            )
+            self._check(name, wanted[2], wanted[0], wanted[1])
+            self._replace(name, lambda: self._reserved.__setitem__(name, wanted))
+
+    def wait_admit(self, name: str, vcpus: int, memory_mb: int, should_stop, host: str | None = None) -> None:
+        """Like admit(), but wait for capacity to free up until `should_stop()` returns True."""
+        with self._changed:
+            while True:
+                try:
+                    self.admit(name, vcpus, memory_mb, host)
+                    return
+                except CapacityError:
+                    if should_stop():
+                        raise
+                    self._changed.wait(1.0)
+
+    def commit(self, name: str, active: bool | None = None) -> None:
+        """The reserved operation succeeded: its values become the domain's allocation."""
+        with self._changed:
+            reserved = self._reserved.get(name)
+            if reserved is None:
+                return
+            previous = self._domains.get(name)
+            state = (previous[2] if previous else True) if active is None else active
+
+            def change():
+                del self._reserved[name]
+                self._domains[name] = (reserved[0], reserved[1], state, reserved[2])
+
+            self._replace(name, change)
+
+    def release(self, name: str) -> None:
+        """The reserved operation failed or was cancelled: drop the reservation."""
+        with self._changed:
+            if name in self._reserved:
+                self._replace(name, lambda: self._reserved.pop(name, None))
+
+    def snapshot(self) -> dict:
+        with self._changed:
+            hosts = {}
+            for host in LIBVIRT_HOSTS:
+                cpus, memory_mb = self.host_size(host)
+                vcpu_limit, mem_limit = self.limits(host)
+                committed = self._totals.get(host, [0, 0])
+                hosts[host] = {
+                    "host": {"vcpus": cpus, "memory_mb": memory_mb},
+                    "committed": {"vcpus": committed[0], "memory_mb": committed[1]},
+                    "limits": {"vcpus": vcpu_limit, "memory_mb": mem_limit},
+                    "available": {"vcpus": vcpu_limit - committed[0], "memory_mb": mem_limit - committed[1]},
+                }
+            return {
+                **hosts[DEFAULT_HOST],
+                "ratios": {"cpu": CPU_OVERCOMMIT_RATIO, "memory": MEMORY_OVERCOMMIT_RATIO},
+                "host_memory_reserve_mb": HOST_MEMORY_RESERVE_MB,
+                "count_stopped": self.count_stopped,
+                "reservations": {
+                    name: {"vcpus": v, "memory_mb": m, "host": h}
+                    for name, (v, m, h) in sorted(self._reserved.items())
+                },
+                "domains": len(self._domains),
+                "hosts": hosts,
+            }
+
+
+capacity = CapacityLedger()
@@ -1,4 +1,190 @@
-VM_IMAGE_DIR = "/home/eli/virtual_machine_images/"
+import os
+from urllib.parse import urlparse
+
+VM_IMAGE_DIR = os.environ.get("VM_IMAGE_DIR", "/home/eli/virtual_machine_images/")
+
+# Hypervisor connection. Override LIBVIRT_URI (e.g. "test:///default") to run the API
+# against libvirt's built-in test driver instead of the local QEMU/KVM daemon.
+LIBVIRT_URI = os.environ.get("LIBVIRT_URI", "qemu:///system")
+
+
+def _parse_hosts(spec: str) -> dict[str, str]:
+    """Parse "name=uri,uri,..." into {name: uri}; unnamed URIs are named after their host part."""
+    hosts = {}
+    for i, item in enumerate(part.strip() for part in spec.split(",")):
+        if not item:
+            continue
+        name, sep, uri = item.partition("=")
+        if not sep or "://" in name:
+            # No name given (an "=" after the scheme belongs to the URI's query string).
+            uri = item
+            name = urlparse(uri).hostname or ("local" if i == 0 else f"host{i}")
+        hosts[name] = uri
+    return hosts
+
+
+# Cluster mode: LIBVIRT_URIS lists every hypervisor this backend manages, e.g.
+# "node1=qemu+ssh://node1/system,node2=qemu+ssh://node2/system". Without it the backend
+# manages LIBVIRT_URI alone, as host "local". The first host is the default for new VMs.
+LIBVIRT_HOSTS = _parse_hosts(os.environ.get("LIBVIRT_URIS", "")) or {"local": LIBVIRT_URI}
+DEFAULT_HOST = next(iter(LIBVIRT_HOSTS))
+# Set VM_SHARED_STORAGE=1 when VM_IMAGE_DIR is the same shared filesystem (NFS, CephFS...)
+# on this machine and every remote host. Otherwise disks of VMs placed on a remote host are
+# created through that host's libvirt storage pool at VM_IMAGE_DIR, and template clones
+# (whose golden images live on this machine) are only placed on local hosts.
+VM_SHARED_STORAGE = os.environ.get("VM_SHARED_STORAGE", "0") == "1"
+
+# Blocking libvirt calls run on two dedicated worker pools (see libvirt_executor.py): one for
+# reads and one for mutations, each with its own per-call timeout in seconds.
+LIBVIRT_READ_WORKERS = int(os.environ.get("LIBVIRT_READ_WORKERS", "4"))
+LIBVIRT_MUTATE_WORKERS = int(os.environ.get("LIBVIRT_MUTATE_WORKERS", "4"))
+# Bulk lifecycle operations (POST /vms/bulk) run on a third lane of this many workers; a
+# request's `parallelism` is capped at this value.
+LIBVIRT_BULK_WORKERS = int(os.environ.get("LIBVIRT_BULK_WORKERS", "8"))
+BULK_DEFAULT_PARALLELISM = int(os.environ.get("BULK_DEFAULT_PARALLELISM", "8"))
+LIBVIRT_READ_TIMEOUT = float(os.environ.get("LIBVIRT_READ_TIMEOUT", "10"))
+LIBVIRT_MUTATE_TIMEOUT = float(os.environ.get("LIBVIRT_MUTATE_TIMEOUT", "60"))
+
+# Connection pool sizing (per host): at most LIBVIRT_POOL_SIZE connections are kept open, and a request
+# waits up to LIBVIRT_POOL_TIMEOUT seconds for one to be returned before failing with 503.
+# Idle connections older than LIBVIRT_POOL_PING_INTERVAL seconds are pinged before reuse.
+# The default leaves one connection per executor worker plus two for background services.
+LIBVIRT_POOL_SIZE = int(
+    os.environ.get(
+        "LIBVIRT_POOL_SIZE",
+        str(LIBVIRT_READ_WORKERS + LIBVIRT_MUTATE_WORKERS + LIBVIRT_BULK_WORKERS + 2),
+    )
+)
+LIBVIRT_POOL_TIMEOUT = float(os.environ.get("LIBVIRT_POOL_TIMEOUT", "30"))
+LIBVIRT_POOL_PING_INTERVAL = float(os.environ.get("LIBVIRT_POOL_PING_INTERVAL", "30"))
+
+# Seconds between full resyncs of the in-memory domain inventory. Domain events keep it current
+# in between; the resync only catches events missed while the event connection was down.
+INVENTORY_RESYNC_INTERVAL = float(os.environ.get("INVENTORY_RESYNC_INTERVAL", "60"))
+# Removed-domain records kept for GET /vms?since=...; older versions get a full listing.
+INVENTORY_TOMBSTONES = int(os.environ.get("INVENTORY_TOMBSTONES", "1024"))
+
+# /vms/events streaming: change batches buffered per client before it is told to resync,
+# seconds between heartbeats on an idle stream, and how long one WebSocket send may block.
+EVENTS_QUEUE_SIZE = int(os.environ.get("EVENTS_QUEUE_SIZE", "64"))
+EVENTS_HEARTBEAT_INTERVAL = float(os.environ.get("EVENTS_HEARTBEAT_INTERVAL", "15"))
+EVENTS_SEND_TIMEOUT = float(os.environ.get("EVENTS_SEND_TIMEOUT", "10"))
+
+# Background jobs (VM creation): concurrent workers, kept low so several large disk images
+# are not written at once, and the SQLite file holding job history across restarts.
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+JOBS_DB_PATH = os.environ.get(
+    "JOBS_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "jobs.sqlite3")
+)
+
+# Golden-image templates: registry file, directory of pre-created ("warm") overlays, and how
+# many warm overlays to keep per template unless the template sets its own count.
+TEMPLATE_REGISTRY_PATH = os.environ.get("TEMPLATE_REGISTRY_PATH", os.path.join(VM_IMAGE_DIR, "templates.json"))
+WARM_POOL_DIR = os.environ.get("WARM_POOL_DIR", os.path.join(VM_IMAGE_DIR, ".warm"))
+WARM_POOL_SIZE = int(os.environ.get("WARM_POOL_SIZE", "2"))
+
+# Image catalog: inotify keeps it current on local disks; a full rescan every this many
+# seconds picks up changes inotify cannot see (e.g. files written by other NFS clients).
+IMAGE_CATALOG_RESCAN_INTERVAL = float(os.environ.get("IMAGE_CATALOG_RESCAN_INTERVAL", "300"))
+
+# Per-VM metrics: seconds between bulk stats samples and samples of history kept per VM
+# (the defaults keep the last ten minutes).
+METRICS_INTERVAL = float(os.environ.get("METRICS_INTERVAL", "5"))
+METRICS_HISTORY = int(os.environ.get("METRICS_HISTORY", "120"))
+
+# Host telemetry behind GET /sys: seconds between /proc samples and samples kept (the
+# defaults keep the last hour).
+HOST_TELEMETRY_INTERVAL = float(os.environ.get("HOST_TELEMETRY_INTERVAL", "2"))
+HOST_TELEMETRY_HISTORY = int(os.environ.get("HOST_TELEMETRY_HISTORY", "1800"))
+
+# Admission control (capacity.py): vCPUs and memory committed to domains may not exceed the
+# host's CPUs x CPU_OVERCOMMIT_RATIO and (memory - HOST_MEMORY_RESERVE_MB) x
+# MEMORY_OVERCOMMIT_RATIO. Stopped domains count unless CAPACITY_COUNT_STOPPED is "0".
+CPU_OVERCOMMIT_RATIO = float(os.environ.get("CPU_OVERCOMMIT_RATIO", "4"))
+MEMORY_OVERCOMMIT_RATIO = float(os.environ.get("MEMORY_OVERCOMMIT_RATIO", "1"))
+HOST_MEMORY_RESERVE_MB = int(os.environ.get("HOST_MEMORY_RESERVE_MB", "1024"))
+CAPACITY_COUNT_STOPPED = os.environ.get("CAPACITY_COUNT_STOPPED", "1") != "0"
+
+# Placement of new VMs without an explicit host: "spread" favours the emptiest host,
+# "binpack" the fullest one that still fits. The last SCHEDULER_DECISIONS placements are kept.
+SCHEDULER_POLICY = os.environ.get("SCHEDULER_POLICY", "spread")
+SCHEDULER_DECISIONS = int(os.environ.get("SCHEDULER_DECISIONS", "200"))
+
+# Instrumentation exported at /metrics: latency histogram bucket bounds in seconds, whether
+# every libvirt API call is timed by method, and the most requests one profile may span.
+METRICS_LATENCY_BUCKETS = tuple(
+    float(b)
+    for b in os.environ.get(
+        "METRICS_LATENCY_BUCKETS", "0.0005,0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,30"
+    ).split(",")
+)
+LIBVIRT_CALL_METRICS = os.environ.get("LIBVIRT_CALL_METRICS", "1") != "0"
+PROFILE_MAX_REQUESTS = int(os.environ.get("PROFILE_MAX_REQUESTS", "1000"))
+
+# Parsed domain XML summaries kept by hash (domain_xml.py); unchanged definitions are not reparsed.
+DOMAIN_XML_CACHE_SIZE = int(os.environ.get("DOMAIN_XML_CACHE_SIZE", "4096"))
+
+# Defaults for new VM definitions (domain_builder.py): hardware profile ("server", "desktop"
+# or "minimal"), machine type and libvirt network. VM_HUGEPAGES is "auto" (back guest memory
+# with huge pages when enough are free on a local host), "always" or "never".
+# VM_DOMAIN_SCHEMA is libvirt's domain.rng, used for validation when lxml is installed.
+VM_DEFAULT_PROFILE = os.environ.get("VM_DEFAULT_PROFILE", "desktop")
+VM_MACHINE_TYPE = os.environ.get("VM_MACHINE_TYPE", "q35")
+VM_NETWORK = os.environ.get("VM_NETWORK", "default")
+VM_HUGEPAGES = os.environ.get("VM_HUGEPAGES", "auto")
+VM_DOMAIN_SCHEMA = os.environ.get("VM_DOMAIN_SCHEMA", "/usr/share/libvirt/schemas/domain.rng")
+
+# vCPU pinning (topology.py): host CPUs never handed to guest vCPUs by automatic pinning,
+# in kernel CPU-list syntax ("0", "0-1,8-9"). Pinned VMs' emulator threads run on them.
+PINNING_RESERVED_CPUS = os.environ.get("PINNING_RESERVED_CPUS", "0")
+
+# SPICE console relay (console_proxy.py, /vms/{name}/console): address of the SPICE servers
+# of VMs on a local libvirt URI (remote hosts use the URI's host name), TCP connect timeout,
+# per-session read buffer and the socket send/receive buffer sizes.
+CONSOLE_SPICE_HOST = os.environ.get("CONSOLE_SPICE_HOST", "127.0.0.1")
+CONSOLE_CONNECT_TIMEOUT = float(os.environ.get("CONSOLE_CONNECT_TIMEOUT", "5"))
+CONSOLE_READ_BUFFER = int(os.environ.get("CONSOLE_READ_BUFFER", str(256 * 1024)))
+CONSOLE_SOCKET_BUFFER = int(os.environ.get("CONSOLE_SOCKET_BUFFER", str(1024 * 1024)))
+
+# Console session manager (console_sessions.py): server-to-browser bandwidth caps in bytes/sec
+# per session and across all sessions (0 = unlimited), token bucket depth, seconds without
+# traffic before a session is closed (0 = never), throughput sampling interval, and how long
+# one chunk may take to reach a browser before it is disconnected as too slow.
+CONSOLE_SESSION_RATE = float(os.environ.get("CONSOLE_SESSION_RATE", "0"))
+CONSOLE_GLOBAL_RATE = float(os.environ.get("CONSOLE_GLOBAL_RATE", "0"))
+CONSOLE_BURST = int(os.environ.get("CONSOLE_BURST", str(512 * 1024)))
+CONSOLE_IDLE_TIMEOUT = float(os.environ.get("CONSOLE_IDLE_TIMEOUT", "1800"))
+CONSOLE_RATE_INTERVAL = float(os.environ.get("CONSOLE_RATE_INTERVAL", "1"))
+CONSOLE_SEND_TIMEOUT = float(os.environ.get("CONSOLE_SEND_TIMEOUT", "30"))
+
+# Server-side SPICE image decoding (spice_decode.py): worker processes decoding LZ images for
+# console sessions in "server" mode (0 disables it), the mode of sessions that do not ask for
+# one ("client" or "server"), and the largest image in pixels sent to a worker.
+SPICE_DECODE_WORKERS = int(os.environ.get("SPICE_DECODE_WORKERS", str(min(4, os.cpu_count() or 1))))
+SPICE_DECODE_DEFAULT = os.environ.get("SPICE_DECODE_DEFAULT", "client")
+SPICE_DECODE_MAX_PIXELS = int(os.environ.get("SPICE_DECODE_MAX_PIXELS", str(3840 * 2160)))
+
+# Console traffic capture (console_capture.py, /vms/{name}/console?capture=1). Captures hold
+# everything typed into the console, so ?capture=1 is ignored unless CONSOLE_CAPTURE_ENABLED=1.
+# Also: directory of the capture files replay_console.py plays back, the size at which one
+# capture stops recording, and quotas for the directory: total bytes, number of files
+# (finished and recording), and hours after which captures are deleted (0 keeps them).
+CONSOLE_CAPTURE_ENABLED = os.environ.get("CONSOLE_CAPTURE_ENABLED", "0") == "1"
+CONSOLE_CAPTURE_DIR = os.environ.get(
+    "CONSOLE_CAPTURE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "captures")
+)
+CONSOLE_CAPTURE_MAX_BYTES = int(os.environ.get("CONSOLE_CAPTURE_MAX_BYTES", str(1024 ** 3)))
+CONSOLE_CAPTURE_MAX_TOTAL_BYTES = int(os.environ.get("CONSOLE_CAPTURE_MAX_TOTAL_BYTES", str(4 * 1024 ** 3)))
+CONSOLE_CAPTURE_MAX_FILES = int(os.environ.get("CONSOLE_CAPTURE_MAX_FILES", "20"))
+CONSOLE_CAPTURE_RETENTION_HOURS = float(os.environ.get("CONSOLE_CAPTURE_RETENTION_HOURS", "168"))
+
+# Frontend assets served by the API (static_assets.py): the directory holding the pages (the
+# project root by default), whether src/main.js is served as one bundle of the whole SPICE
+# client, and the brotli quality / gzip level used when precompressing at startup.
+STATIC_DIR = os.environ.get("STATIC_DIR", os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+STATIC_BUNDLE = os.environ.get("STATIC_BUNDLE", "1") != "0"
+STATIC_BROTLI_QUALITY = int(os.environ.get("STATIC_BROTLI_QUALITY", "11"))
+STATIC_GZIP_LEVEL = int(os.environ.get("STATIC_GZIP_LEVEL", "9"))
 
 STATE_NAMES = {
     0: "No State",
@@ -0,0 +1,251 @@
+# Console traffic capture: the raw SPICE byte stream of a relayed session, both directions,
+# with timestamps, written into a memory-mapped file for replay_console.py to play back.
+#
+# File layout (little-endian):
+#   header  "VMUICAP1", f64 wall-clock start, u32 metadata length, metadata JSON
+#   records u8 direction (0 browser -> server, 1 server -> browser), u64 ns since start,
+#           u32 payload length (never 0), payload
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+
+from config import (
+    CONSOLE_CAPTURE_ENABLED,
+    CONSOLE_CAPTURE_DIR,
+    CONSOLE_CAPTURE_MAX_BYTES,
+    CONSOLE_CAPTURE_MAX_TOTAL_BYTES,
+    CONSOLE_CAPTURE_MAX_FILES,
+    CONSOLE_CAPTURE_RETENTION_HOURS,
+)
+
+MAGIC = b"VMUICAP1"
+SUFFIX = ".spicecap"
+UP, DOWN = 0, 1
+
+_HEADER = struct.Struct("<8sdI")
+_RECORD = struct.Struct("<BQI")
+# The mapping grows by doubling from here, so a capture costs a handful of remaps.
+_INITIAL_SIZE = 1024 * 1024
+
+# Writers still recording, each counted against the directory quota at its full limit.
+_active: set["CaptureWriter"] = set()
+_active_lock = threading.Lock()
+
+
+class CaptureRefused(Exception):
+    """Raised when capture is disabled or a new capture would exceed the directory quotas."""
+
+
+class CaptureWriter:
+    """
+    Appends records to a capture file through a shared memory mapping: a record is a memcpy
+    into the page cache, with no write() call per relayed chunk. Recording stops (and
+    `truncated` is set) once the file would exceed `limit` bytes. Used from the event loop
+    only.
+    """
+
+    def __init__(self, path: str, meta: dict, limit: int = CONSOLE_CAPTURE_MAX_BYTES):
+        self.path = path
+        self.limit = limit
+        self.records = 0
+        self.truncated = False
+        self._started = time.monotonic_ns()
+        meta_bytes = json.dumps(meta).encode()
+        self._file = open(path, "w+b")
+        self._size = max(_INITIAL_SIZE, _HEADER.size + len(meta_bytes))
+        self._file.truncate(self._size)
+        self._map = mmap.mmap(self._file.fileno(), self._size)
+        _HEADER.pack_into(self._map, 0, MAGIC, time.time(), len(meta_bytes))
+        self._at = _HEADER.size + len(meta_bytes)
+        self._map[_HEADER.size:self._at] = meta_bytes
+
+    @property
+    def size(self) -> int:
+        return self._at
+
+    def record(self, direction: int, data) -> None:
+        if self._map is None or self.truncated or not data:
+            return
+        end = self._at + _RECORD.size + len(data)
+        if end > self.limit:
+            self.truncated = True
+            return
+        if end > self._size:
+            self._size = max(end, self._size * 2)
+            self._map.resize(self._size)
+        _RECORD.pack_into(self._map, self._at, direction, time.monotonic_ns() - self._started, len(data))
+        self._map[self._at + _RECORD.size:end] = data
+        self._at = end
+        self.records += 1
+
+    def close(self) -> None:
+        if self._map is None:
+            return
+        self._map.close()
+        self._map = None
+        self._file.truncate(self._at)
+        self._file.close()
+        with _active_lock:
+            _active.discard(self)
+
+    def as_dict(self) -> dict:
+        return {
+            "file": os.path.basename(self.path),
+            "records": self.records,
+            "bytes": self._at,
+            "truncated": self.truncated,
+        }
+
+
+class CaptureReader:
+    """
+    Reads a capture file through a read-only mapping. Iterating yields
+    (direction, seconds since start, payload) with payloads as memoryviews into the mapping,
+    valid until close().
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._view = None
+        self._map = None
+        self._file = open(path, "rb")
+        try:
+            if os.fstat(self._file.fileno()).st_size < _HEADER.size:
+                raise ValueError(f"{path} is not a console capture")
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, self.started, meta_length = _HEADER.unpack_from(self._map, 0)
+            if magic != MAGIC or _HEADER.size + meta_length > len(self._map):
+                raise ValueError(f"{path} is not a console capture")
+            self.meta = json.loads(self._map[_HEADER.size:_HEADER.size + meta_length])
+        except BaseException:
+            self.close()
+            raise
+        self._records_at = _HEADER.size + meta_length
+        self._view = memoryview(self._map)
+
+    def __iter__(self):
+        at, end = self._records_at, len(self._map)
+        while at + _RECORD.size <= end:
+            direction, ns, length = _RECORD.unpack_from(self._map, at)
+            if not length or direction not in (UP, DOWN) or at + _RECORD.size + length > end:
+                # Zeroed tail of a file whose writer never closed it (records are never empty),
+                # or a corrupt or cut-off record: nothing after it can be trusted.
+                return
+            at += _RECORD.size
+            yield direction, ns / 1e9, self._view[at:at + length]
+            at += length
+
+    def summary(self) -> dict:
+        records = [0, 0]
+        sizes = [0, 0]
+        last = 0.0
+        for direction, t, payload in self:
+            records[direction] += 1
+            sizes[direction] += len(payload)
+            last = t
+        return {
+            "file": os.path.basename(self.path),
+            "started": self.started,
+            "meta": self.meta,
+            "duration": round(last, 3),
+            "records_up": records[UP],
+            "records_down": records[DOWN],
+            "bytes_up": sizes[UP],
+            "bytes_down": sizes[DOWN],
+        }
+
+    def close(self) -> None:
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _finished_captures() -> dict[str, os.stat_result]:
+    """Path -> stat of the capture files no writer is recording into."""
+    with _active_lock:
+        recording = {writer.path for writer in _active}
+    out = {}
+    for name in os.listdir(CONSOLE_CAPTURE_DIR):
+        path = os.path.join(CONSOLE_CAPTURE_DIR, name)
+        if name.endswith(SUFFIX) and path not in recording:
+            try:
+                out[path] = os.stat(path)
+            except OSError:
+                continue
+    return out
+
+
+def open_capture(vm: str, session_id: int, meta: dict) -> CaptureWriter:
+    """
+    A new capture file in CONSOLE_CAPTURE_DIR for one session. Captures past
+    CONSOLE_CAPTURE_RETENTION_HOURS are deleted first; raises CaptureRefused if capture is
+    disabled or the directory is at its file count or byte quota. The new capture's limit
+    is whatever is left of the byte quota, up to CONSOLE_CAPTURE_MAX_BYTES.
+    """
+    if not CONSOLE_CAPTURE_ENABLED:
+        raise CaptureRefused("console capture is disabled (CONSOLE_CAPTURE_ENABLED)")
+    os.makedirs(CONSOLE_CAPTURE_DIR, exist_ok=True)
+    finished = _finished_captures()
+    if CONSOLE_CAPTURE_RETENTION_HOURS > 0:
+        expires = time.time() - CONSOLE_CAPTURE_RETENTION_HOURS * 3600
+        for path, st in list(finished.items()):
+            if st.st_mtime < expires:
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                del finished[path]
+    with _active_lock:
+        if len(finished) + len(_active) >= CONSOLE_CAPTURE_MAX_FILES:
+            raise CaptureRefused(f"capture directory holds {CONSOLE_CAPTURE_MAX_FILES} captures already")
+        left = (
+            CONSOLE_CAPTURE_MAX_TOTAL_BYTES
+            - sum(st.st_size for st in finished.values())
+            - sum(writer.limit for writer in _active)
+        )
+        if left < _INITIAL_SIZE:
+            raise CaptureRefused("capture directory is at its size quota")
+        name = f"{re.sub(r'[^A-Za-z0-9_.-]', '_', vm)}-{time.strftime('%Y%m%dT%H%M%S')}-{session_id}{SUFFIX}"
+        writer = CaptureWriter(os.path.join(CONSOLE_CAPTURE_DIR, name), meta, min(CONSOLE_CAPTURE_MAX_BYTES, left))
+        _active.add(writer)
+    return writer
+
+
+def capture_path(name: str) -> str | None:
+    """Path of an existing capture by file name; None for anything else (including paths)."""
+    if os.path.basename(name) != name or not name.endswith(SUFFIX):
+        return None
+    path = os.path.join(CONSOLE_CAPTURE_DIR, name)
+    return path if os.path.isfile(path) else None
+
+
+def list_captures() -> list[dict]:
+    if not os.path.isdir(CONSOLE_CAPTURE_DIR):
+        return []
+    out = []
+    for name in sorted(os.listdir(CONSOLE_CAPTURE_DIR)):
+        path = capture_path(name)
+        if path is None:
+            continue
+        try:
+            with CaptureReader(path) as reader:
+                entry = reader.summary()
+        except (OSError, ValueError, struct.error):
+            continue
+        entry["size"] = os.path.getsize(path)
+        out.append(entry)
+    return out
@@ -0,0 +1,364 @@
+# SPICE console relay: bridges a browser WebSocket to the VM's SPICE TCP port on the event
+# loop, replacing the separate websockify process. One TCP connection per WebSocket (the
+# SPICE client opens one per channel), routed by VM name through the inventory. Sessions are
+# registered with the session manager (console_sessions.py), which shapes and reaps them.
+# Display channels can have their LZ images decoded server-side (spice_decode.py), and any
+# session can be captured to a file for replay (console_capture.py).
+import asyncio
+import itertools
+import logging
+import socket
+import time
+from urllib.parse import urlparse
+
+from console_capture import DOWN, UP, CaptureRefused, CaptureWriter, open_capture
+from config import (
+    CONSOLE_CONNECT_TIMEOUT,
+    CONSOLE_READ_BUFFER,
+    CONSOLE_SOCKET_BUFFER,
+    CONSOLE_SEND_TIMEOUT,
+    CONSOLE_SPICE_HOST,
+    LIBVIRT_HOSTS,
+    SPICE_DECODE_DEFAULT,
+)
+from console_sessions import consoles
+from instrumentation import registry
+from inventory import inventory
+from spice_decode import DECODE_MODES, SPICE_CHANNEL_DISPLAY, DisplayStream, link_channel_type, spice_decoder
+
+logger = logging.getLogger(__name__)
+
+console_bytes = registry.counter(
+    "vmui_console_bytes_total", "Bytes relayed by console sessions.", ("direction",)
+)
+console_send_duration = registry.histogram(
+    "vmui_console_send_duration_seconds",
+    "Time to hand one relayed chunk to the other side (backpressure from the slower peer).",
+    ("direction",),
+)
+
+
+class ConsoleUnavailable(Exception):
+    """Raised when a VM has no reachable SPICE display (unknown, not running, or no port)."""
+
+
+def spice_address(vm_name: str) -> tuple[str, str, int]:
+    """(host name, address, port) of the VM's SPICE server, from the inventory."""
+    vm = inventory.get(vm_name)
+    if vm is None:
+        raise ConsoleUnavailable(f"VM '{vm_name}' not found")
+    if not vm.get("port"):
+        raise ConsoleUnavailable(f"VM '{vm_name}' has no SPICE display (is it running?)")
+    host = vm["host"]
+    # Remote hypervisors serve SPICE on their own address; local domains on CONSOLE_SPICE_HOST.
+    address = urlparse(LIBVIRT_HOSTS.get(host, "")).hostname or CONSOLE_SPICE_HOST
+    return host, address, int(vm["port"])
+
+
+class ConsoleSession:
+    """Counters for one relayed connection. Only touched from the event loop."""
+
+    __slots__ = (
+        "id", "vm", "user", "host", "target", "client", "started", "connect_seconds",
+        "bytes_up", "bytes_down", "frames_up", "frames_down",
+        "send_seconds_down", "send_seconds_down_max", "send_seconds_up", "send_seconds_up_max",
+        "last_activity", "throttled_seconds", "bucket", "pumps", "close_reason",
+        "rate_up", "rate_down", "sampled_at", "sampled_up", "sampled_down", "decode", "display",
+        "capture", "error",
+    )
+
+    def __init__(
+        self, session_id: int, vm: str, user: str, host: str, target: str, client: str | None, decode: str = "client"
+    ):
+        self.id = session_id
+        self.vm = vm
+        self.user = user
+        self.host = host
+        self.target = target
+        self.client = client
+        self.started = time.time()
+        self.connect_seconds = None
+        self.bytes_up = self.bytes_down = 0
+        self.frames_up = self.frames_down = 0
+        self.send_seconds_down = self.send_seconds_down_max = 0.0
+        self.send_seconds_up = self.send_seconds_up_max = 0.0
+        self.last_activity = time.monotonic()
+        # Maintained by the session manager.
+        self.throttled_seconds = 0.0
+        self.bucket = None
+        self.pumps: list[asyncio.Future] = []
+        self.close_reason = None
+        self.rate_up = self.rate_down = 0.0
+        self.sampled_at = self.last_activity
+        self.sampled_up = self.sampled_down = 0
+        # "client" or "server" image decoding; `display` frames the stream of display channels.
+        self.decode = decode
+        self.display: DisplayStream | None = None
+        self.capture: CaptureWriter | None = None
+        # Why a pump failed (connection reset, broken pipe...), if one did.
+        self.error: str | None = None
+
+    def as_dict(self) -> dict:
+        elapsed = max(time.time() - self.started, 1e-9)
+        return {
+            "id": self.id,
+            "vm": self.vm,
+            "user": self.user,
+            "host": self.host,
+            "target": self.target,
+            "client": self.client,
+            "started": self.started,
+            "connect_ms": None if self.connect_seconds is None else round(self.connect_seconds * 1000, 3),
+            # up: browser -> SPICE server (input), down: SPICE server -> browser (display).
+            "bytes_up": self.bytes_up,
+            "bytes_down": self.bytes_down,
+            "frames_up": self.frames_up,
+            "frames_down": self.frames_down,
+            "bytes_per_sec_up": round(self.rate_up, 1),
+            "bytes_per_sec_down": round(self.rate_down, 1),
+            "avg_bytes_per_sec_up": round(self.bytes_up / elapsed, 1),
+            "avg_bytes_per_sec_down": round(self.bytes_down / elapsed, 1),
+            "throttled_seconds": round(self.throttled_seconds, 3),
+            "send_ms_avg_down": round(self.send_seconds_down / self.frames_down * 1000, 3) if self.frames_down else None,
+            "send_ms_max_down": round(self.send_seconds_down_max * 1000, 3),
+            "send_ms_avg_up": round(self.send_seconds_up / self.frames_up * 1000, 3) if self.frames_up else None,
+            "send_ms_max_up": round(self.send_seconds_up_max * 1000, 3),
+            "idle_seconds": round(time.monotonic() - self.last_activity, 3),
+            "decode": self.decode,
+            "display": self.display.as_dict() if self.display is not None else None,
+            "capture": self.capture.as_dict() if self.capture is not None else None,
+            "error": self.error,
+        }
+
+
+def _collect_errors(session: ConsoleSession) -> None:
+    """
+    Retrieve the exceptions of the session's finished pumps (so asyncio does not report them
+    as never retrieved) and log the first once. Resets and broken pipes, from either peer,
+    are an ordinary end of a session.
+    """
+    for pump in session.pumps:
+        if pump.cancelled() or pump.exception() is None:
+            continue
+        error = pump.exception()
+        if session.error is not None:
+            continue
+        session.error = str(error) or type(error).__name__
+        if isinstance(error, OSError):
+            logger.info("Console session %s lost its connection: %s", session.id, session.error)
+        else:
+            logger.error("Console session %s failed", session.id, exc_info=error)
+
+
+def _tune(sock: socket.socket) -> None:
+    # SPICE input and cursor messages are small and latency-sensitive: no Nagle delay.
+    # Large buffers let a display update burst through without waiting on the peer.
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    for option in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, option, CONSOLE_SOCKET_BUFFER)
+        except OSError:
+            pass
+
+
+class ConsoleRelay:
+    """
+    Relays WebSocket <-> TCP for every open console on the event loop.
+
+    Each session is two pumps on the raw non-blocking socket. Server-to-browser reads go
+    into one preallocated buffer per session (sock_recv_into), so the only allocation per
+    chunk is the bytes object handed to the WebSocket; browser-to-server frames are written
+    to the socket as received. Each pump awaits its send before reading again, so a slow
+    peer slows the relay down instead of growing buffers: the SPICE server's TCP window
+    fills and it throttles itself. A browser that cannot take one chunk within
+    CONSOLE_SEND_TIMEOUT is disconnected.
+    """
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self.total_sessions = 0
+        self.failed_connects = 0
+
+    async def connect(self, address: str, port: int) -> socket.socket:
+        loop = asyncio.get_running_loop()
+        infos = await loop.getaddrinfo(address, port, type=socket.SOCK_STREAM)
+        last_error = None
+        for family, type_, proto, _, sockaddr in infos:
+            sock = socket.socket(family, type_, proto)
+            sock.setblocking(False)
+            try:
+                _tune(sock)
+                await asyncio.wait_for(loop.sock_connect(sock, sockaddr), CONSOLE_CONNECT_TIMEOUT)
+                return sock
+            except (OSError, asyncio.TimeoutError) as e:
+                sock.close()
+                last_error = e
+        raise ConnectionError(f"Cannot reach SPICE server at {address}:{port}: {last_error}")
+
+    async def serve(
+        self, websocket, vm_name: str, user: str | None = None, decode: str | None = None, capture: bool = False
+    ) -> None:
+        """
+        Accept `websocket` and relay it to the VM's SPICE port until either side closes or
+        the session manager closes the session. `user` labels the session (the client
+        address when omitted); `decode` picks client or server image decoding
+        (SPICE_DECODE_DEFAULT when omitted, always client without decode workers);
+        `capture` records the session's traffic to a capture file.
+        """
+        try:
+            host, address, port = spice_address(vm_name)
+        except ConsoleUnavailable as e:
+            await websocket.close(code=4404, reason=str(e))
+            return
+        await self.bridge(websocket, vm_name, host, address, port, user, decode, capture)
+
+    async def bridge(
+        self, websocket, vm_name: str, host: str, address: str, port: int,
+        user: str | None = None, decode: str | None = None, capture: bool = False,
+    ) -> ConsoleSession | None:
+        """
+        `serve` for a known SPICE address (replay_console.py points this at its own server).
+        Returns the finished session, or None if the SPICE server was unreachable.
+        """
+        # spice-html5 asks for the "binary" subprotocol, as websockify negotiates it.
+        requested = websocket.scope.get("subprotocols") or []
+        await websocket.accept(subprotocol="binary" if "binary" in requested else None)
+
+        client = websocket.client
+        if decode not in DECODE_MODES:
+            decode = SPICE_DECODE_DEFAULT
+        session = ConsoleSession(
+            next(self._ids), vm_name, user or (client.host if client else "unknown"), host,
+            f"{address}:{port}", f"{client.host}:{client.port}" if client else None,
+            decode if spice_decoder.available else "client",
+        )
+        started = time.perf_counter()
+        try:
+            sock = await self.connect(address, port)
+        except ConnectionError as e:
+            self.failed_connects += 1
+            await websocket.close(code=1011, reason=str(e)[:120])
+            return None
+        session.connect_seconds = time.perf_counter() - started
+        if capture:
+            try:
+                session.capture = open_capture(vm_name, session.id, {
+                    "vm": vm_name, "host": host, "target": session.target, "user": session.user,
+                    "session": session.id, "decode": session.decode,
+                })
+            except (OSError, CaptureRefused) as e:
+                # The session itself goes ahead, unrecorded.
+                logger.warning("Not capturing console session %s: %s", session.id, e)
+
+        self.total_sessions += 1
+        pumps = session.pumps = [
+            asyncio.ensure_future(self._browser_to_server(websocket, sock, session)),
+            asyncio.ensure_future(self._server_to_browser(websocket, sock, session)),
+        ]
+        consoles.register(session)
+        try:
+            await asyncio.wait(pumps, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for pump in pumps:
+                pump.cancel()
+            try:
+                # wait(), unlike gather(), never re-raises a pump's own CancelledError here.
+                await asyncio.wait(pumps)
+            finally:
+                sock.close()
+                consoles.unregister(session)
+                if session.capture is not None:
+                    session.capture.close()
+                _collect_errors(session)
+            try:
+                if session.close_reason:
+                    await websocket.close(code=4408, reason=session.close_reason)
+                elif session.error:
+                    await websocket.close(code=1011, reason=session.error[:120])
+                else:
+                    await websocket.close()
+            except RuntimeError:
+                pass
+        return session
+
+    async def _browser_to_server(self, websocket, sock: socket.socket, session: ConsoleSession) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            data = message.get("bytes")
+            if data is None:
+                data = (message.get("text") or "").encode()
+            if not session.frames_up and spice_decoder.available and link_channel_type(data) == SPICE_CHANNEL_DISPLAY:
+                # Set before the link message goes out, so before the server's reply is read.
+                session.display = DisplayStream(spice_decoder, session.decode)
+            if session.capture is not None:
+                session.capture.record(UP, data)
+            started = time.perf_counter()
+            await loop.sock_sendall(sock, data)
+            elapsed = time.perf_counter() - started
+            session.bytes_up += len(data)
+            session.frames_up += 1
+            session.send_seconds_up += elapsed
+            session.send_seconds_up_max = max(session.send_seconds_up_max, elapsed)
+            session.last_activity = time.monotonic()
+            console_bytes.inc("up", amount=len(data))
+            console_send_duration.observe(elapsed, "up")
+
+    async def _server_to_browser(self, websocket, sock: socket.socket, session: ConsoleSession) -> None:
+        loop = asyncio.get_running_loop()
+        buffer = bytearray(CONSOLE_READ_BUFFER)
+        view = memoryview(buffer)
+        while True:
+            n = await loop.sock_recv_into(sock, buffer)
+            if not n:
+                return
+            if session.capture is not None:
+                session.capture.record(DOWN, view[:n])
+            if session.display is not None:
+                data = await session.display.feed(view[:n])
+                if not data:
+                    # Part of an image held back for decoding.
+                    session.last_activity = time.monotonic()
+                    continue
+                n = len(data)
+            else:
+                data = bytes(view[:n])
+            await consoles.throttle(session, n)
+            started = time.perf_counter()
+            try:
+                await asyncio.wait_for(
+                    websocket.send({"type": "websocket.send", "bytes": data}), CONSOLE_SEND_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                session.close_reason = "client too slow"
+                return
+            elapsed = time.perf_counter() - started
+            session.bytes_down += n
+            session.frames_down += 1
+            session.send_seconds_down += elapsed
+            session.send_seconds_down_max = max(session.send_seconds_down_max, elapsed)
+            session.last_activity = time.monotonic()
+            console_bytes.inc("down", amount=n)
+            console_send_duration.observe(elapsed, "down")
+
+
+
+def _console_samples():
+    per_vm = consoles.by_vm()
+    return [
+        ("vmui_console_sessions", "gauge", "Open console sessions per VM.",
+         [({"vm": vm}, entry["sessions"]) for vm, entry in sorted(per_vm.items())]),
+        ("vmui_console_bytes_per_second", "gauge", "Relayed throughput per VM over the last sampling interval.",
+         [({"vm": vm, "direction": d}, entry[f"bytes_per_sec_{d}"]) for vm, entry in sorted(per_vm.items())
+          for d in ("down", "up")]),
+        ("vmui_console_idle_reaped_total", "counter", "Console sessions closed for inactivity.", [({}, consoles.reaped)]),
+        ("vmui_console_sessions_total", "counter", "Console sessions opened.", [({}, relay.total_sessions)]),
+        ("vmui_console_connect_failures_total", "counter", "Console sessions whose SPICE server was unreachable.",
+         [({}, relay.failed_connects)]),
+    ]
+
+
+relay = ConsoleRelay()
+registry.collector(_console_samples)
@@ -0,0 +1,153 @@
+# Console session manager: tracks the relay's sessions per VM and user, shapes server-to-browser
+# traffic with per-session and global token buckets, measures live throughput and reaps idle
+# sessions. Everything here runs on the event loop.
+import asyncio
+import logging
+import time
+
+from config import (
+    CONSOLE_BURST,
+    CONSOLE_GLOBAL_RATE,
+    CONSOLE_IDLE_TIMEOUT,
+    CONSOLE_RATE_INTERVAL,
+    CONSOLE_SESSION_RATE,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Token bucket in bytes that goes into debt: `reserve` always takes the tokens and
+    returns how long the caller must wait before sending. Later reservations queue behind
+    the debt of earlier ones, so waiters are served in arrival order, and since every
+    session has at most one chunk outstanding, a shared bucket is shared round-robin.
+    A rate of 0 means unlimited.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def reserve(self, amount: int) -> float:
+        """Take `amount` tokens; returns the seconds until they are paid for."""
+        if not self.rate:
+            return 0.0
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= amount
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class ConsoleManager:
+    """
+    The registry of open console sessions.
+
+    The relay registers each session once its SPICE connection is up and calls `throttle`
+    before every server-to-browser chunk, which charges the session's own bucket and the
+    global one. A background task samples per-session throughput every CONSOLE_RATE_INTERVAL
+    seconds and closes sessions that have carried no traffic in either direction for
+    CONSOLE_IDLE_TIMEOUT seconds.
+    """
+
+    def __init__(self):
+        self._sessions: dict[int, object] = {}
+        self.global_bucket = TokenBucket(CONSOLE_GLOBAL_RATE, CONSOLE_BURST)
+        self.reaped = 0
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        # Called from the app lifespan, i.e. on the server's event loop.
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for session in list(self._sessions.values()):
+            self.close(session.id, "server shutting down")
+
+    def register(self, session) -> None:
+        session.bucket = TokenBucket(CONSOLE_SESSION_RATE, CONSOLE_BURST)
+        self._sessions[session.id] = session
+
+    def unregister(self, session) -> None:
+        self._sessions.pop(session.id, None)
+
+    async def throttle(self, session, amount: int) -> None:
+        # Both buckets are charged up front and refill concurrently, so the wait is the
+        # longer of the two rather than their sum.
+        delay = max(session.bucket.reserve(amount), self.global_bucket.reserve(amount))
+        if delay:
+            session.throttled_seconds += delay
+            await asyncio.sleep(delay)
+
+    def close(self, session_id: int, reason: str) -> bool:
+        """Ask a session's pumps to stop; the relay then closes both ends. False if unknown."""
+        session = self._sessions.get(session_id)
+        if session is None:
+            return False
+        session.close_reason = reason
+        for pump in session.pumps:
+            pump.cancel()
+        return True
+
+    def set_decode(self, session_id: int, mode: str) -> bool:
+        """Switch a session between client and server image decoding. False if unknown."""
+        session = self._sessions.get(session_id)
+        if session is None:
+            return False
+        session.decode = mode
+        if session.display is not None:
+            session.display.mode = mode
+        return True
+
+    def sessions(self, vm: str | None = None, user: str | None = None) -> list[dict]:
+        return [
+            s.as_dict()
+            for s in list(self._sessions.values())
+            if (vm is None or s.vm == vm) and (user is None or s.user == user)
+        ]
+
+    def by_vm(self) -> dict[str, dict]:
+        """{vm: {"sessions": n, "users": {user: n}, "bytes_per_sec_down": ..., "bytes_per_sec_up": ...}}"""
+        out: dict[str, dict] = {}
+        for s in list(self._sessions.values()):
+            entry = out.setdefault(s.vm, {"sessions": 0, "users": {}, "bytes_per_sec_down": 0.0, "bytes_per_sec_up": 0.0})
+            entry["sessions"] += 1
+            entry["users"][s.user] = entry["users"].get(s.user, 0) + 1
+            entry["bytes_per_sec_down"] += s.rate_down
+            entry["bytes_per_sec_up"] += s.rate_up
+        return out
+
+    def limits(self) -> dict:
+        return {
+            "session_bytes_per_sec": CONSOLE_SESSION_RATE or None,
+            "global_bytes_per_sec": CONSOLE_GLOBAL_RATE or None,
+            "burst_bytes": CONSOLE_BURST,
+            "idle_timeout": CONSOLE_IDLE_TIMEOUT or None,
+        }
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(CONSOLE_RATE_INTERVAL)
+            now = time.monotonic()
+            for session in list(self._sessions.values()):
+                elapsed = now - session.sampled_at
+                if elapsed > 0:
+                    session.rate_down = (session.bytes_down - session.sampled_down) / elapsed
+                    session.rate_up = (session.bytes_up - session.sampled_up) / elapsed
+                session.sampled_at = now
+                session.sampled_down = session.bytes_down
+                session.sampled_up = session.bytes_up
+                if CONSOLE_IDLE_TIMEOUT and now - session.last_activity > CONSOLE_IDLE_TIMEOUT:
+                    logger.info("Closing idle console session %s (%s, %s)", session.id, session.vm, session.user)
+                    self.reaped += 1
+                    self.close(session.id, "idle timeout")
+
+
+consoles = ConsoleManager()
@@ -0,0 +1,232 @@
+# Domain XML extraction: the few fields the API needs (memory, vCPUs, SPICE port, disk files),
+# read with a streaming expat pass that stops at </devices> and memoized by a hash of the XML.
+import hashlib
+import threading
+from xml.parsers import expat
+from collections import OrderedDict
+
+from config import DOMAIN_XML_CACHE_SIZE
+
+# Bytes per unit for every unit libvirt accepts on <memory>/<currentMemory> (case-insensitive).
+# Without a unit attribute the value is in KiB.
+MEMORY_UNITS = {
+    "b": 1,
+    "bytes": 1,
+    "kb": 1000,
+    "k": 1024,
+    "kib": 1024,
+    "mb": 1000 ** 2,
+    "m": 1024 ** 2,
+    "mib": 1024 ** 2,
+    "gb": 1000 ** 3,
+    "g": 1024 ** 3,
+    "gib": 1024 ** 3,
+    "tb": 1000 ** 4,
+    "t": 1024 ** 4,
+    "tib": 1024 ** 4,
+    "pb": 1000 ** 5,
+    "p": 1024 ** 5,
+    "pib": 1024 ** 5,
+    "eb": 1000 ** 6,
+    "e": 1024 ** 6,
+    "eib": 1024 ** 6,
+}
+
+
+def memory_mib(value: str | int, unit: str | None = "KiB") -> int:
+    """Convert a libvirt memory value with its unit to whole MiB (rounded down)."""
+    try:
+        scale = MEMORY_UNITS[(unit or "KiB").lower()]
+    except KeyError:
+        raise ValueError(f"Unknown memory unit '{unit}'")
+    return int(value) * scale // 1024 ** 2
+
+
+class DomainSummary:
+    """The parts of a domain definition the API serves. Immutable once built; shared across threads."""
+
+    __slots__ = ("memory_mb", "vcpus", "port", "disks", "vcpu_pins", "emulator_pin", "numa_memory")
+
+    def __init__(
+        self,
+        memory_mb: int | None,
+        vcpus: int | None,
+        port: int | None,
+        disks: tuple[str, ...],
+        vcpu_pins: tuple[tuple[int, str], ...] = (),
+        emulator_pin: str | None = None,
+        numa_memory: tuple[str, str] | None = None,
+    ):
+        self.memory_mb = memory_mb
+        self.vcpus = vcpus
+        self.port = port
+        self.disks = disks
+        # <cputune> <vcpupin>/<emulatorpin> cpusets and <numatune><memory> (mode, nodeset).
+        self.vcpu_pins = vcpu_pins
+        self.emulator_pin = emulator_pin
+        self.numa_memory = numa_memory
+
+    def pinning(self) -> dict | None:
+        """The domain's CPU pinning and NUMA memory policy, or None if it has none."""
+        if not (self.vcpu_pins or self.emulator_pin or self.numa_memory):
+            return None
+        return {
+            "vcpus": {str(vcpu): cpuset for vcpu, cpuset in self.vcpu_pins},
+            "emulator": self.emulator_pin,
+            "numa_mode": self.numa_memory[0] if self.numa_memory else None,
+            "numa_nodes": self.numa_memory[1] if self.numa_memory else None,
+        }
+
+    def as_dict(self) -> dict:
+        return {
+            "port": self.port,
+            "memory_mb": self.memory_mb,
+            "vcpus": self.vcpus,
+            "disks": list(self.disks),
+            "cpu_pinning": self.pinning(),
+        }
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, DomainSummary) and all(
+            getattr(self, f) == getattr(other, f) for f in self.__slots__
+        )
+
+    def __repr__(self) -> str:
+        return "DomainSummary(" + ", ".join(f"{f}={getattr(self, f)!r}" for f in self.__slots__) + ")"
+
+
+class _Done(Exception):
+    """Raised from the expat handler to stop parsing once </devices> is reached."""
+
+
+def _int(text: str) -> int | None:
+    try:
+        return int(text.strip())
+    except ValueError:
+        return None
+
+
+def extract(xml: str | bytes) -> DomainSummary:
+    """
+    Parse `xml` without building a tree. Only top-level <memory> and <vcpu>, <cputune> pins,
+    the <numatune> memory policy, <graphics type='spice'> and file-backed
+    <disk><source file=...> are looked at, and parsing stops at </devices> since nothing
+    needed comes after it. Raises ValueError on malformed XML.
+    """
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    depth = 0
+    text: list[str] = []
+    current = None  # (tag, unit) of the top-level element whose text is being collected
+    section = None  # the top-level element being parsed
+    in_disk = False
+    memory_mb = vcpus = port = emulator_pin = numa_memory = None
+    disks: list[str] = []
+    vcpu_pins: list[tuple[int, str]] = []
+
+    def on_text(data: str) -> None:
+        text.append(data)
+
+    def on_start(name: str, attrs: dict) -> None:
+        nonlocal depth, current, port, in_disk, section, emulator_pin, numa_memory
+        depth += 1
+        if depth == 2:
+            section = name
+            if name == "memory" or name == "vcpu":
+                current = (name, attrs.get("unit"))
+                text.clear()
+                parser.CharacterDataHandler = on_text
+        elif depth == 3 and section == "cputune":
+            if name == "vcpupin" and "cpuset" in attrs:
+                vcpu = _int(attrs.get("vcpu", ""))
+                if vcpu is not None:
+                    vcpu_pins.append((vcpu, attrs["cpuset"]))
+            elif name == "emulatorpin":
+                emulator_pin = attrs.get("cpuset")
+        elif depth == 3 and section == "numatune":
+            if name == "memory":
+                numa_memory = (attrs.get("mode", "strict"), attrs.get("nodeset"))
+        elif depth == 3:
+            in_disk = name == "disk"
+            if name == "graphics" and port is None and attrs.get("type") == "spice":
+                value = attrs.get("port")
+                # Spice uses -1 when autoport is enabled and the domain is not running.
+                if value and value != "-1":
+                    port = _int(value)
+        elif depth == 4 and in_disk and name == "source" and "file" in attrs:
+            disks.append(attrs["file"])
+
+    def on_end(name: str) -> None:
+        nonlocal depth, current, memory_mb, vcpus
+        if depth == 2:
+            if current is not None:
+                value = _int("".join(text))
+                if current[0] == "memory":
+                    try:
+                        memory_mb = memory_mib(value, current[1]) if value is not None else None
+                    except ValueError:
+                        memory_mb = None
+                else:
+                    vcpus = value
+                current = None
+                parser.CharacterDataHandler = None
+            elif name == "devices":
+                raise _Done()
+        depth -= 1
+
+    parser.StartElementHandler = on_start
+    parser.EndElementHandler = on_end
+    try:
+        parser.Parse(xml, True)
+    except _Done:
+        pass
+    except expat.ExpatError as e:
+        raise ValueError(f"Malformed domain XML: {e}") from None
+    return DomainSummary(memory_mb, vcpus, port, tuple(disks), tuple(sorted(vcpu_pins)), emulator_pin, numa_memory)
+
+
+class _SummaryCache:
+    """Bounded LRU of DomainSummary by BLAKE2 digest of the XML text."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._entries: OrderedDict[bytes, DomainSummary] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, xml: str) -> DomainSummary:
+        data = xml.encode() if isinstance(xml, str) else xml
+        key = hashlib.blake2b(data, digest_size=16).digest()
+        with self._lock:
+            summary = self._entries.get(key)
+            if summary is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return summary
+            self.misses += 1
+        summary = extract(data)
+        with self._lock:
+            self._entries[key] = summary
+            if len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return summary
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "size": self.size, "hits": self.hits, "misses": self.misses}
+
+
+_cache = _SummaryCache(DOMAIN_XML_CACHE_SIZE)
+
+
+def summarize_xml(xml: str) -> DomainSummary:
+    """
+    DomainSummary for `xml`, memoized: unchanged domains (the common case on resyncs and
+    after events that do not touch the definition) cost one hash instead of a parse.
+    """
+    return _cache.get(xml)
+
+
+def cache_stats() -> dict:
+    return _cache.stats()
@@ -0,0 +1,72 @@
+# Fan-out of inventory changes to streaming clients (SSE and WebSocket on /vms/events).
+import asyncio
+import logging
+
+from config import EVENTS_QUEUE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Queued in place of pending deltas when a client falls too far behind: the stream then sends
+# a fresh snapshot instead of replaying every missed change.
+RESYNC = None
+
+
+class Subscription:
+    """One connected client: a bounded queue of change batches."""
+
+    def __init__(self, maxsize: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.overflows = 0
+
+    def offer(self, changes: list[dict]) -> None:
+        try:
+            self.queue.put_nowait(changes)
+        except asyncio.QueueFull:
+            # Slow consumer: drop what is queued and ask it to resync, so memory per client
+            # stays bounded no matter how far behind it is.
+            self.overflows += 1
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+
+class EventHub:
+    """
+    Broadcast inventory change batches to every subscribed client.
+
+    The inventory calls `publish_threadsafe` from its worker thread; the batch is handed to
+    the server's event loop and copied into each client's bounded queue there.
+    """
+
+    def __init__(self, queue_size: int = EVENTS_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._subscribers: set[Subscription] = set()
+
+    def attach(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+
+    def publish_threadsafe(self, changes: list[dict]) -> None:
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        loop.call_soon_threadsafe(self._publish, changes)
+
+    def _publish(self, changes: list[dict]) -> None:
+        for sub in self._subscribers:
+            sub.offer(changes)
+
+    def subscribe(self) -> Subscription:
+        sub = Subscription(self.queue_size)
+        self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        self._subscribers.discard(sub)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+
+hub = EventHub()
@@ -0,0 +1,260 @@
+# Golden-image templates: base images in VM_IMAGE_DIR that new VMs are cloned from as qcow2
+# copy-on-write overlays, plus a warm pool of pre-created overlays per template.
+import json
+import logging
+import os
+import re
+import subprocess
+import threading
+import time
+import uuid
+
+from config import VM_IMAGE_DIR, TEMPLATE_REGISTRY_PATH, WARM_POOL_DIR, WARM_POOL_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Template names become directory names under WARM_POOL_DIR.
+_NAME_RE = re.compile(r"^[A-Za-z0-9_-][A-Za-z0-9_.-]*$")
+
+
+class TemplateError(Exception):
+    """Raised for unknown templates or images that cannot be used as one."""
+
+
+class TemplateConflict(TemplateError):
+    """Raised when a template name is already registered for a different image."""
+
+
+def image_info(path: str) -> dict:
+    """Return `qemu-img info` for an image as a dict (format, virtual-size, ...)."""
+    out = subprocess.run(
+        ["qemu-img", "info", "--output=json", path], check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(out)
+
+
+def overlay_command(base_path: str, base_format: str, overlay_path: str, size_gb: int | None = None) -> list[str]:
+    """qemu-img command creating a qcow2 overlay backed by `base_path`, optionally grown to `size_gb`."""
+    cmd = ["qemu-img", "create", "-f", "qcow2", "-F", base_format, "-b", base_path, overlay_path]
+    if size_gb:
+        cmd.append(f"{size_gb}G")
+    return cmd
+
+
+class GoldenImages:
+    """
+    Registry of golden templates and their warm pools.
+
+    Templates are recorded in a small JSON registry next to the images. Registering an
+    image makes it read-only, since every overlay depends on it never changing. For each
+    template a background thread keeps up to `warm` overlays ready under WARM_POOL_DIR, so
+    provisioning a VM from a template is a rename rather than an image creation.
+    """
+
+    def __init__(self, registry_path: str = TEMPLATE_REGISTRY_PATH, pool_dir: str = WARM_POOL_DIR):
+        self.registry_path = registry_path
+        self.pool_dir = pool_dir
+        self._templates: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread: threading.Thread | None = None
+
+    # -- lifecycle --------------------------------------------------------------------------
+
+    def start(self) -> None:
+        self._load()
+        self._remove_partials()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._refill_loop, name="warm-pool", daemon=True)
+        self._thread.start()
+        self._wake.set()
+
+    def stop(self) -> None:
+        self._stopping = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    # -- registry ---------------------------------------------------------------------------
+
+    def _load(self) -> None:
+        try:
+            with open(self.registry_path, "r", encoding="utf-8") as f:
+                templates = json.load(f)
+        except FileNotFoundError:
+            templates = {}
+        except (OSError, ValueError):
+            logger.exception("Cannot read template registry %s", self.registry_path)
+            templates = {}
+        with self._lock:
+            self._templates = templates
+
+    def _save(self) -> None:
+        # Caller holds self._lock. Write-then-rename so a crash never leaves a torn registry.
+        tmp = self.registry_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._templates, f, indent=2)
+        os.replace(tmp, self.registry_path)
+
+    def list_templates(self) -> list[dict]:
+        with self._lock:
+            templates = [dict(t, name=name) for name, t in sorted(self._templates.items())]
+        for t in templates:
+            t["warm_ready"] = len(self._ready_overlays(t["name"]))
+        return templates
+
+    def get(self, name: str) -> dict:
+        with self._lock:
+            template = self._templates.get(name)
+        if template is None:
+            raise TemplateError(f"Template '{name}' not found")
+        return dict(template, name=name)
+
+    def register(self, name: str, image: str, warm: int | None = None) -> dict:
+        """
+        Register `image` (a file name inside VM_IMAGE_DIR) as template `name`. Registering an
+        existing name again only updates its settings, and only for the same image: its warm
+        overlays are backed by that image.
+        """
+        if not _NAME_RE.match(name):
+            raise TemplateError("Template names may only contain letters, digits, '.', '_' and '-'")
+        path = os.path.realpath(os.path.join(VM_IMAGE_DIR, image))
+        if os.path.dirname(path) != os.path.realpath(VM_IMAGE_DIR):
+            raise TemplateError("Template images must live directly in the image directory")
+        if not os.path.isfile(path):
+            raise TemplateError(f"Image not found: {path}")
+        try:
+            info = image_info(path)
+        except (OSError, subprocess.CalledProcessError, ValueError) as e:
+            raise TemplateError(f"Cannot inspect image {path}: {e}")
+        if info.get("backing-filename"):
+            raise TemplateError("Template images must not themselves be overlays")
+
+        template = {
+            "path": path,
+            "format": info.get("format", "qcow2"),
+            "virtual_size": int(info.get("virtual-size", 0)),
+            "warm": WARM_POOL_SIZE if warm is None else max(0, warm),
+            "registered_at": time.time(),
+        }
+        with self._lock:
+            existing = self._templates.get(name)
+            if existing is not None and existing["path"] != path:
+                raise TemplateConflict(
+                    f"Template '{name}' is already registered for {existing['path']}; unregister it first"
+                )
+            # Overlays break if their backing file changes, so protect it from writes.
+            os.chmod(path, 0o444)
+            self._templates[name] = template
+            self._save()
+        self._wake.set()
+        return dict(template, name=name)
+
+    def unregister(self, name: str) -> None:
+        """Forget a template and discard its warm overlays. The base image itself is kept."""
+        with self._lock:
+            if self._templates.pop(name, None) is None:
+                raise TemplateError(f"Template '{name}' not found")
+            self._save()
+        for path in self._ready_overlays(name):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    # -- provisioning -----------------------------------------------------------------------
+
+    def _template_pool_dir(self, name: str) -> str:
+        return os.path.join(self.pool_dir, name)
+
+    def _remove_partials(self) -> None:
+        """Delete overlays left half-built by a refill that was interrupted (e.g. by a restart)."""
+        try:
+            names = os.listdir(self.pool_dir)
+        except FileNotFoundError:
+            return
+        for name in names:
+            d = self._template_pool_dir(name)
+            if not os.path.isdir(d):
+                continue
+            for f in os.listdir(d):
+                if f.endswith(".partial"):
+                    try:
+                        os.remove(os.path.join(d, f))
+                    except OSError:
+                        pass
+
+    def _ready_overlays(self, name: str) -> list[str]:
+        d = self._template_pool_dir(name)
+        try:
+            return [os.path.join(d, f) for f in os.listdir(d) if f.endswith(".qcow2")]
+        except FileNotFoundError:
+            return []
+
+    def take_warm(self, name: str, dest_path: str) -> bool:
+        """Move a ready overlay of template `name` to `dest_path`; False if the pool is empty."""
+        for path in self._ready_overlays(name):
+            try:
+                os.rename(path, dest_path)
+            except FileNotFoundError:
+                # Another request took this one first.
+                continue
+            self._wake.set()
+            return True
+        self._wake.set()
+        return False
+
+    def provision(self, name: str, dest_path: str, size_gb: int | None, run) -> str:
+        """
+        Create `dest_path` as an overlay of template `name`, growing it to `size_gb` if that
+        is larger than the template. Uses a warm overlay when one is ready; otherwise runs
+        qemu-img through `run(cmd)`. Returns "warm" or "cold".
+        """
+        template = self.get(name)
+        grow = size_gb if size_gb and size_gb * 1024 ** 3 > template["virtual_size"] else None
+        if self.take_warm(name, dest_path):
+            if grow:
+                run(["qemu-img", "resize", dest_path, f"{grow}G"])
+            return "warm"
+        run(overlay_command(template["path"], template["format"], dest_path, grow))
+        return "cold"
+
+    def _refill_loop(self) -> None:
+        while not self._stopping:
+            self._wake.wait(60)
+            self._wake.clear()
+            with self._lock:
+                wanted = {name: (t["path"], t["format"], t["warm"]) for name, t in self._templates.items()}
+            for name, (base, fmt, count) in wanted.items():
+                if self._stopping:
+                    return
+                d = self._template_pool_dir(name)
+                tmp = None
+                try:
+                    os.makedirs(d, exist_ok=True)
+                    missing = count - len(self._ready_overlays(name))
+                    for _ in range(max(0, missing)):
+                        # Build under a temporary name so take_warm never sees a partial file.
+                        final = os.path.join(d, f"{uuid.uuid4().hex}.qcow2")
+                        tmp = final + ".partial"
+                        subprocess.run(overlay_command(base, fmt, tmp), check=True, capture_output=True)
+                        with self._lock:
+                            current = self._templates.get(name)
+                            if current is None or current["path"] != base:
+                                # Unregistered (and maybe re-registered) while building.
+                                os.remove(tmp)
+                                tmp = None
+                                break
+                            os.rename(tmp, final)
+                        tmp = None
+                except (OSError, subprocess.CalledProcessError):
+                    logger.exception("Failed to refill warm pool for template %s", name)
+                    if tmp is not None:
+                        try:
+                            os.remove(tmp)
+                        except OSError:
+                            pass
+
+
+golden_images = GoldenImages()
@@ -0,0 +1,277 @@
+# Host telemetry: a background sampler over /proc (CPU, memory, pressure stall information,
+# disk I/O) that keeps derived values in ring buffers for GET /sys.
+import logging
+import os
+import threading
+import time
+
+from config import HOST_TELEMETRY_INTERVAL, HOST_TELEMETRY_HISTORY, VM_IMAGE_DIR
+from metrics import RingBuffer
+
+logger = logging.getLogger(__name__)
+
+FIELDS = (
+    "cpu_percent",
+    "iowait_percent",
+    "steal_percent",
+    "memory_available_mb",
+    "memory_used_percent",
+    "swap_used_mb",
+    "psi_cpu_some",
+    "psi_memory_some",
+    "psi_memory_full",
+    "psi_io_some",
+    "psi_io_full",
+    "disk_read_bps",
+    "disk_write_bps",
+)
+
+_PSI_RESOURCES = ("cpu", "memory", "io")
+
+
+class ProcFile:
+    """
+    A /proc or /sys file kept open for repeated reads.
+
+    Each read seeks back to the start of the same descriptor instead of reopening the
+    path, which saves the path lookup and allocation on every sample. `read()` returns
+    None when the file does not exist on this kernel (e.g. /proc/pressure without PSI).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        try:
+            self.fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+        except OSError:
+            self.fd = None
+
+    def read(self) -> bytes | None:
+        if self.fd is None:
+            return None
+        try:
+            os.lseek(self.fd, 0, os.SEEK_SET)
+            chunks = []
+            while True:
+                chunk = os.read(self.fd, 65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        except OSError:
+            return None
+        return b"".join(chunks)
+
+    def close(self) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def parse_cpu_online(data: bytes) -> int:
+    """Count CPUs in a list like b'0-3,5'."""
+    count = 0
+    for part in data.decode().strip().split(","):
+        if "-" in part:
+            a, b = part.split("-")
+            count += int(b) - int(a) + 1
+        elif part:
+            count += 1
+    return count
+
+
+def parse_stat_cpu(data: bytes) -> tuple[int, ...]:
+    """Aggregate jiffies from the first line of /proc/stat: (total, idle, iowait, steal)."""
+    fields = [int(v) for v in data.split(b"\n", 1)[0].split()[1:]]
+    # user nice system idle iowait irq softirq steal [guest guest_nice, already in user/nice]
+    fields += [0] * (8 - len(fields))
+    total = sum(fields[:8])
+    return total, fields[3], fields[4], fields[7]
+
+
+def parse_meminfo(data: bytes) -> dict[str, int]:
+    """kB values from /proc/meminfo keyed by name."""
+    out = {}
+    for line in data.split(b"\n"):
+        name, _, rest = line.partition(b":")
+        parts = rest.split()
+        if parts:
+            out[name.decode()] = int(parts[0])
+    return out
+
+
+def parse_pressure(data: bytes) -> dict[str, int]:
+    """Cumulative stall time in microseconds from a /proc/pressure file: {"some": us, "full": us}."""
+    out = {}
+    for line in data.split(b"\n"):
+        parts = line.split()
+        if parts and parts[-1].startswith(b"total="):
+            out[parts[0].decode()] = int(parts[-1][6:])
+    return out
+
+
+def parse_diskstats(data: bytes, devices: frozenset[str]) -> tuple[int, int]:
+    """Total (sectors read, sectors written) over `devices` from /proc/diskstats."""
+    read = written = 0
+    for line in data.split(b"\n"):
+        parts = line.split()
+        if len(parts) >= 10 and parts[2].decode() in devices:
+            read += int(parts[5])
+            written += int(parts[9])
+    return read, written
+
+
+def _block_devices() -> frozenset[str]:
+    # Whole disks only: partitions are already counted in their parent device, and loop and
+    # ram devices would double-count the files they are backed by.
+    try:
+        names = os.listdir("/sys/block")
+    except OSError:
+        return frozenset()
+    return frozenset(n for n in names if not n.startswith(("loop", "ram", "zram")))
+
+
+class HostTelemetry:
+    """
+    Sample host counters every `interval` seconds into a ring buffer of `capacity` points.
+
+    CPU percentages come from /proc/stat jiffy deltas, PSI percentages from the deltas of
+    the cumulative `total=` stall counters (share of wall time some/all tasks stalled over
+    the interval), and disk throughput from /proc/diskstats sector deltas.
+    """
+
+    def __init__(self, interval: float = HOST_TELEMETRY_INTERVAL, capacity: int = HOST_TELEMETRY_HISTORY):
+        self.interval = interval
+        self.ring = RingBuffer(capacity, FIELDS)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._files: dict[str, ProcFile] = {}
+        self._previous: tuple | None = None
+        self._devices: frozenset[str] = frozenset()
+        self.vcpus = os.cpu_count() or 0
+        self.memory_kb = 0
+        # Free space under VM_IMAGE_DIR; refreshed less often since it may be on NFS.
+        self.image_dir_free_bytes: int | None = None
+
+    def start(self) -> None:
+        self._files = {
+            "stat": ProcFile("/proc/stat"),
+            "meminfo": ProcFile("/proc/meminfo"),
+            "diskstats": ProcFile("/proc/diskstats"),
+            "cpu_online": ProcFile("/sys/devices/system/cpu/online"),
+            **{f"psi_{r}": ProcFile(f"/proc/pressure/{r}") for r in _PSI_RESOURCES},
+        }
+        self._devices = _block_devices()
+        self._sample_storage()
+        self.sample()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="host-telemetry", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        for f in self._files.values():
+            f.close()
+
+    def _run(self) -> None:
+        samples = 0
+        while not self._stop.wait(self.interval):
+            samples += 1
+            if samples % 60 == 0:
+                # Pick up hot-plugged disks now and then.
+                self._devices = _block_devices()
+            if samples % 15 == 0:
+                self._sample_storage()
+            try:
+                self.sample()
+            except Exception:
+                logger.exception("Host telemetry sample failed")
+
+    def _sample_storage(self) -> None:
+        try:
+            st = os.statvfs(VM_IMAGE_DIR)
+            self.image_dir_free_bytes = st.f_bavail * st.f_frsize
+        except OSError:
+            self.image_dir_free_bytes = None
+
+    def sample(self) -> None:
+        mono = time.monotonic()
+        files = self._files
+
+        online = files["cpu_online"].read()
+        if online:
+            self.vcpus = parse_cpu_online(online) or self.vcpus
+
+        mem = parse_meminfo(files["meminfo"].read() or b"")
+        total_kb = mem.get("MemTotal", 0)
+        available_kb = mem.get("MemAvailable", mem.get("MemFree", 0))
+        swap_used_kb = mem.get("SwapTotal", 0) - mem.get("SwapFree", 0)
+
+        stat = files["stat"].read()
+        cpu = parse_stat_cpu(stat) if stat else None
+        pressure = {}
+        for r in _PSI_RESOURCES:
+            data = files[f"psi_{r}"].read()
+            if data:
+                pressure[r] = parse_pressure(data)
+        disk = files["diskstats"].read()
+        sectors = parse_diskstats(disk, self._devices) if disk else None
+
+        current = (mono, cpu, pressure, sectors)
+        previous, self._previous = self._previous, current
+        self.memory_kb = total_kb
+        if previous is None:
+            return
+
+        elapsed = mono - previous[0]
+        nan = float("nan")
+        cpu_pct = iowait_pct = steal_pct = nan
+        if cpu and previous[1]:
+            d_total = cpu[0] - previous[1][0]
+            if d_total > 0:
+                cpu_pct = 100 * (d_total - (cpu[1] - previous[1][1]) - (cpu[2] - previous[1][2])) / d_total
+                iowait_pct = 100 * (cpu[2] - previous[1][2]) / d_total
+                steal_pct = 100 * (cpu[3] - previous[1][3]) / d_total
+
+        def psi(resource: str, kind: str) -> float:
+            now, before = pressure.get(resource, {}), previous[2].get(resource, {})
+            if kind not in now or kind not in before or elapsed <= 0:
+                return nan
+            return 100 * (now[kind] - before[kind]) / (elapsed * 1e6)
+
+        read_bps = write_bps = nan
+        if sectors and previous[3] and elapsed > 0:
+            # /proc/diskstats always counts 512-byte sectors regardless of the device.
+            read_bps = (sectors[0] - previous[3][0]) * 512 / elapsed
+            write_bps = (sectors[1] - previous[3][1]) * 512 / elapsed
+
+        row = (
+            cpu_pct,
+            iowait_pct,
+            steal_pct,
+            available_kb / 1024,
+            100 * (total_kb - available_kb) / total_kb if total_kb else nan,
+            swap_used_kb / 1024,
+            psi("cpu", "some"),
+            psi("memory", "some"),
+            psi("memory", "full"),
+            psi("io", "some"),
+            psi("io", "full"),
+            read_bps,
+            write_bps,
+        )
+        with self._lock:
+            self.ring.append(time.time(), row)
+
+    def latest(self) -> dict | None:
+        with self._lock:
+            latest = self.ring.latest()
+        return {"timestamp": latest[0], **latest[1]} if latest else None
+
+    def history(self, points: int, step: int = 1) -> dict:
+        with self._lock:
+            return self.ring.history(points, step)
+
+
+host_telemetry = HostTelemetry()
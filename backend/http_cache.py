@@ -0,0 +1,37 @@
+# Conditional GET helpers shared by the endpoints dashboards poll (/vms, /sys).
+import hashlib
+import json
+
+from fastapi import Request, Response
+
+from instrumentation import timed
+
+# Browsers revalidate on every request and get a 304 while the ETag still matches.
+CACHE_HEADERS = {"Cache-Control": "no-cache"}
+
+
+def content_etag(body: bytes) -> str:
+    """Strong ETag derived from the response body."""
+    return '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """True if the request's If-None-Match header lists `etag` (or is `*`)."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return "*" in candidates or etag in candidates
+
+
+def encode_json(payload) -> bytes:
+    with timed("json_encode"):
+        return json.dumps(payload, separators=(",", ":")).encode()
+
+
+def conditional_json(request: Request, body: bytes, etag: str) -> Response:
+    """Return `body` as JSON, or an empty 304 if the client already has this ETag."""
+    headers = {"ETag": etag, **CACHE_HEADERS}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
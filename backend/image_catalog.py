@@ -0,0 +1,350 @@
+# Disk image catalog: an in-memory index of VM_IMAGE_DIR with metadata read straight from the
+# qcow2 headers, kept current by inotify with a periodic rescan as a fallback.
+import ctypes
+import ctypes.util
+import fnmatch
+import logging
+import os
+import select
+import struct
+import threading
+
+from config import VM_IMAGE_DIR, IMAGE_CATALOG_RESCAN_INTERVAL
+from inventory import inventory
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".qcow2", ".img", ".raw", ".iso")
+
+_QCOW2_MAGIC = 0x514649FB
+_QCOW2_EXT_BACKING_FORMAT = 0xE2792ACA
+_QCOW2_V2_HEADER_LENGTH = 72
+
+
+def read_qcow2_header(fd: int) -> dict | None:
+    """
+    Parse the fields we need from a qcow2 header on an open file descriptor: version,
+    virtual size, cluster size, backing file name and backing format. Returns None if the
+    file is not qcow2. Only the header, the extension area and the backing name are read.
+    """
+    head = os.pread(fd, 104, 0)
+    if len(head) < _QCOW2_V2_HEADER_LENGTH:
+        return None
+    magic, version, backing_offset, backing_size, cluster_bits, size = struct.unpack_from(">IIQIIQ", head)
+    if magic != _QCOW2_MAGIC:
+        return None
+
+    header_length = _QCOW2_V2_HEADER_LENGTH
+    if version >= 3 and len(head) >= 104:
+        header_length = struct.unpack_from(">I", head, 100)[0]
+
+    backing_format = None
+    # Header extensions sit between the header and the end of the first cluster.
+    ext_area = os.pread(fd, min(1 << cluster_bits, 65536) - header_length, header_length)
+    pos = 0
+    while pos + 8 <= len(ext_area):
+        ext_type, ext_len = struct.unpack_from(">II", ext_area, pos)
+        if ext_type == 0:
+            break
+        if ext_type == _QCOW2_EXT_BACKING_FORMAT:
+            backing_format = ext_area[pos + 8:pos + 8 + ext_len].decode(errors="replace")
+        pos += 8 + ((ext_len + 7) & ~7)
+
+    backing_file = None
+    if backing_offset and backing_size:
+        backing_file = os.pread(fd, backing_size, backing_offset).decode(errors="replace")
+
+    return {
+        "version": version,
+        "virtual_size": size,
+        "cluster_size": 1 << cluster_bits,
+        "backing_file": backing_file,
+        "backing_format": backing_format,
+    }
+
+
+def _describe(path: str, st: os.stat_result) -> dict:
+    """Build the catalog record for one image file."""
+    record = {
+        "name": os.path.basename(path),
+        "path": path,
+        "format": "raw",
+        "virtual_size": st.st_size,
+        "actual_size": st.st_blocks * 512,
+        "file_size": st.st_size,
+        "backing_file": None,
+        "backing_format": None,
+        "mtime": st.st_mtime,
+        "_stamp": (st.st_mtime_ns, st.st_size),
+    }
+    if path.lower().endswith(".iso"):
+        record["format"] = "iso"
+        return record
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return record
+    try:
+        header = read_qcow2_header(fd)
+    except OSError:
+        header = None
+    finally:
+        os.close(fd)
+    if header is not None:
+        backing = header["backing_file"]
+        if backing and not os.path.isabs(backing):
+            backing = os.path.normpath(os.path.join(os.path.dirname(path), backing))
+        record.update(
+            format="qcow2",
+            virtual_size=header["virtual_size"],
+            backing_file=backing,
+            backing_format=header["backing_format"],
+        )
+    return record
+
+
+class _Inotify:
+    """Minimal ctypes binding for watching one directory with Linux inotify."""
+
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+
+    MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+    def __init__(self, directory: str):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), self.MASK) < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, f"inotify_add_watch failed for {directory}")
+
+    def read(self, timeout: float) -> list[tuple[int, str]] | None:
+        """Return [(mask, name), ...] within `timeout` seconds; None means events were lost."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        events, pos = [], 0
+        while pos + 16 <= len(data):
+            _, mask, _, length = struct.unpack_from("iIII", data, pos)
+            name = data[pos + 16:pos + 16 + length].split(b"\0", 1)[0].decode(errors="replace")
+            pos += 16 + length
+            if mask & (self.IN_Q_OVERFLOW | self.IN_IGNORED | self.IN_DELETE_SELF):
+                return None
+            events.append((mask, name))
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class ImageCatalog:
+    """
+    Index of image files directly inside `directory`.
+
+    The first scan reads every image's header once; afterwards inotify events re-read only
+    the files they name, and a periodic rescan (the only mechanism on NFS, where inotify
+    does not see changes made by other clients) re-reads files whose mtime or size changed.
+    Queries are answered from memory and joined with the domain inventory to report which
+    VMs use each image.
+    """
+
+    def __init__(self, directory: str = VM_IMAGE_DIR, rescan_interval: float = IMAGE_CATALOG_RESCAN_INTERVAL):
+        self.directory = directory
+        self.rescan_interval = rescan_interval
+        self._records: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._stopping = False
+        self._thread: threading.Thread | None = None
+        self._usage_cache: tuple[int, dict[str, list[str]]] | None = None
+        self.error: str | None = None
+
+    def start(self) -> None:
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="image-catalog", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping = True
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def wait_ready(self, timeout: float | None = None) -> bool:
+        return self._ready.wait(timeout)
+
+    # -- indexing ---------------------------------------------------------------------------
+
+    def _wanted(self, name: str) -> bool:
+        return not name.startswith(".") and name.lower().endswith(IMAGE_EXTENSIONS)
+
+    def rescan(self) -> None:
+        """Walk the directory, re-reading headers only for new or changed files."""
+        with self._lock:
+            old = self._records
+        records = {}
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if not self._wanted(entry.name):
+                        continue
+                    try:
+                        if not entry.is_file():
+                            continue
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    previous = old.get(entry.path)
+                    if previous is not None and previous["_stamp"] == (st.st_mtime_ns, st.st_size):
+                        records[entry.path] = dict(previous, actual_size=st.st_blocks * 512)
+                    else:
+                        records[entry.path] = _describe(entry.path, st)
+            self.error = None
+        except OSError as e:
+            self.error = f"Cannot read image directory {self.directory}: {e}"
+            logger.warning(self.error)
+        with self._lock:
+            self._records = records
+        self._ready.set()
+
+    def _refresh_file(self, name: str) -> None:
+        path = os.path.join(self.directory, name)
+        try:
+            st = os.stat(path)
+            record = _describe(path, st) if os.path.isfile(path) else None
+        except OSError:
+            record = None
+        with self._lock:
+            records = dict(self._records)
+            if record is None:
+                records.pop(path, None)
+            else:
+                records[path] = record
+            self._records = records
+
+    def _run(self) -> None:
+        self.rescan()
+        watcher = None
+        while not self._stopping:
+            if watcher is None:
+                try:
+                    watcher = _Inotify(self.directory)
+                except (OSError, AttributeError) as e:
+                    # No inotify (non-Linux, missing directory, watch limit): rescans only.
+                    logger.info("inotify unavailable for %s (%s); using periodic rescans", self.directory, e)
+                    watcher = False
+            if watcher is False:
+                deadline = self.rescan_interval
+                while deadline > 0 and not self._stopping:
+                    threading.Event().wait(min(1.0, deadline))
+                    deadline -= 1.0
+                if not self._stopping:
+                    self.rescan()
+                    watcher = None
+                continue
+
+            elapsed = 0.0
+            while elapsed < self.rescan_interval and not self._stopping:
+                events = watcher.read(1.0)
+                elapsed += 1.0
+                if events is None:
+                    # Queue overflow or the directory itself went away: rebuild from scratch.
+                    watcher.close()
+                    watcher = None
+                    break
+                for _, name in events:
+                    if self._wanted(name):
+                        self._refresh_file(name)
+            if not self._stopping:
+                self.rescan()
+        if watcher:
+            watcher.close()
+
+    # -- queries ----------------------------------------------------------------------------
+
+    def _usage(self) -> dict[str, list[str]]:
+        """Map image path -> names of domains referencing it, cached per inventory version."""
+        version = inventory.version
+        cached = self._usage_cache
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        usage: dict[str, list[str]] = {}
+        for vm in inventory.listing():
+            for disk in vm.get("disks") or ():
+                usage.setdefault(os.path.normpath(disk), []).append(vm["name"])
+        self._usage_cache = (version, usage)
+        return usage
+
+    def _public(self, record: dict, records: dict[str, dict], usage: dict[str, list[str]]) -> dict:
+        out = {k: v for k, v in record.items() if not k.startswith("_")}
+        chain, seen, backing = [], {record["path"]}, record["backing_file"]
+        while backing and backing not in seen:
+            chain.append(backing)
+            seen.add(backing)
+            parent = records.get(backing)
+            backing = parent["backing_file"] if parent else None
+        out["backing_chain"] = chain
+        out["domains"] = usage.get(record["path"], [])
+        return out
+
+    def query(
+        self,
+        offset: int = 0,
+        limit: int = 100,
+        fmt: str | None = None,
+        pattern: str | None = None,
+        domain: str | None = None,
+        in_use: bool | None = None,
+    ) -> dict:
+        """Filtered, name-sorted page of images: {"total", "offset", "limit", "images"}."""
+        with self._lock:
+            records = self._records
+        usage = self._usage()
+        matches = []
+        for path in sorted(records):
+            record = records[path]
+            if fmt and record["format"] != fmt:
+                continue
+            if pattern and not fnmatch.fnmatch(record["name"], pattern):
+                continue
+            users = usage.get(path, [])
+            if domain and domain not in users:
+                continue
+            if in_use is not None and bool(users) != in_use:
+                continue
+            matches.append(record)
+        page = matches[offset:offset + limit]
+        return {
+            "total": len(matches),
+            "offset": offset,
+            "limit": limit,
+            "images": [self._public(r, records, usage) for r in page],
+        }
+
+    def paths(self, fmt: str | None = None) -> list[str]:
+        with self._lock:
+            records = self._records
+        return sorted(p for p, r in records.items() if fmt is None or r["format"] == fmt)
+
+    def describe(self, path: str) -> dict | None:
+        """Catalog record for `path`, or None if it is not in the image directory."""
+        with self._lock:
+            records = self._records
+        record = records.get(os.path.normpath(path))
+        return self._public(record, records, self._usage()) if record else None
+
+
+catalog = ImageCatalog()
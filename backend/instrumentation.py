@@ -0,0 +1,369 @@
+# Instrumentation: per-route latency histograms (ASGI middleware), per-method libvirt call
+# timing, hot-path section timers and an on-demand cProfile capture, exported at /metrics in
+# Prometheus text format.
+import cProfile
+import io
+import marshal
+import pstats
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from config import METRICS_LATENCY_BUCKETS, PROFILE_MAX_REQUESTS
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    """Monotonic counter with a fixed set of label names."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in sorted(items):
+            yield self.name, _labels(self.label_names, labels), value
+
+
+class Histogram:
+    """
+    Prometheus-style histogram: per label set, a count per bucket upper bound plus the sum
+    and count of observations. Buckets are stored non-cumulatively and summed on export,
+    so an observation is one bisect and three additions.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets=METRICS_LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [bucket counts..., +Inf count, sum]
+        self._series: dict[tuple, list[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            series[i] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+        for labels, series in sorted(items):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _number(bound)
+                yield f"{self.name}_bucket", _labels(self.label_names, labels, f'le="{le}"'), cumulative
+            yield f"{self.name}_sum", _labels(self.label_names, labels), series[-1]
+            yield f"{self.name}_count", _labels(self.label_names, labels), cumulative
+
+
+class Registry:
+    """Metrics plus collector callbacks evaluated at scrape time for gauges owned by other modules."""
+
+    def __init__(self):
+        self._metrics: list = []
+        self._collectors: list = []
+
+    def counter(self, name: str, help: str, labels: tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labels: tuple[str, ...] = (), buckets=METRICS_LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, fn) -> None:
+        """
+        Register `fn() -> [(name, kind, help, [(labels_dict, value), ...]), ...]`, called on
+        every scrape.
+        """
+        self._collectors.append(fn)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_number(value)}")
+        for fn in self._collectors:
+            for name, kind, help, samples in fn():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    if value is None:
+                        continue
+                    label_str = _labels(tuple(labels), tuple(labels.values()))
+                    lines.append(f"{name}{label_str} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    "vmui_http_requests_total", "HTTP requests by route and status.", ("method", "route", "status")
+)
+http_duration = registry.histogram(
+    "vmui_http_request_duration_seconds", "HTTP request latency by route.", ("method", "route")
+)
+libvirt_duration = registry.histogram(
+    "vmui_libvirt_call_duration_seconds", "libvirt API call latency by method.", ("method",)
+)
+libvirt_errors = registry.counter(
+    "vmui_libvirt_call_errors_total", "libvirt API calls that raised, by method.", ("method",)
+)
+section_duration = registry.histogram(
+    "vmui_section_duration_seconds", "Time spent in instrumented hot-path sections.", ("section",)
+)
+
+_in_flight = 0
+
+
+def _in_flight_collector():
+    return [("vmui_http_requests_in_flight", "gauge", "HTTP requests being served.", [({}, _in_flight)])]
+
+
+registry.collector(_in_flight_collector)
+
+
+@contextmanager
+def timed(section: str):
+    """Record the duration of the enclosed block under vmui_section_duration_seconds{section=...}."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        section_duration.observe(time.perf_counter() - started, section)
+
+
+def instrument_libvirt(libvirt_module, classes=("virConnect", "virDomain", "virStoragePool", "virNetwork")) -> None:
+    """
+    Time every public method of the libvirt binding's object classes, labelled by
+    "Class.method". Each such call is one RPC to the daemon (or a local call for the test
+    driver). Safe to call more than once.
+    """
+    for cls_name in classes:
+        cls = getattr(libvirt_module, cls_name, None)
+        if cls is None or getattr(cls, "_vmui_instrumented", False):
+            continue
+        for name, fn in list(vars(cls).items()):
+            if name.startswith("_") or not callable(fn):
+                continue
+            setattr(cls, name, _timed_call(f"{cls_name}.{name}", fn))
+        cls._vmui_instrumented = True
+
+
+def _timed_call(method: str, fn):
+    def call(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            libvirt_errors.inc(method)
+            raise
+        finally:
+            libvirt_duration.observe(time.perf_counter() - started, method)
+
+    call.__name__ = fn.__name__
+    call.__doc__ = fn.__doc__
+    return call
+
+
+class ProfileBusy(RuntimeError):
+    """Raised when a capture is already running or another profiler is active."""
+
+
+class RequestProfiler:
+    """
+    cProfile capture spanning the next N requests.
+
+    `arm(n)` starts a capture window: the profiler is enabled when the first of the next
+    `n` requests arrives and disabled once all of them have finished. It runs on the event
+    loop thread, so it sees routing, validation, serialization and any inline work; libvirt
+    calls made on executor threads show up as time awaiting their futures.
+    """
+
+    def __init__(self):
+        self._profile: cProfile.Profile | None = None
+        self._remaining = 0
+        self._active = 0
+        self._profiled = 0
+        self._armed_at: float | None = None
+        self._started = 0.0
+        self._result: dict | None = None
+
+    def arm(self, requests: int) -> None:
+        if self._remaining or self._active:
+            raise ProfileBusy("A profile capture is already in progress")
+        self._remaining = max(1, min(requests, PROFILE_MAX_REQUESTS))
+        self._profiled = 0
+        self._armed_at = time.time()
+
+    def enter(self) -> bool:
+        """Called at request start; True if this request is part of the capture."""
+        if not self._remaining:
+            return False
+        if self._profile is None:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler (e.g. a debugger or py-spy in-process) owns the hook.
+                self._remaining = 0
+                return False
+            self._profile = profile
+            self._started = time.perf_counter()
+        self._remaining -= 1
+        self._active += 1
+        return True
+
+    def exit(self) -> None:
+        self._active -= 1
+        self._profiled += 1
+        if self._remaining or self._active or self._profile is None:
+            return
+        profile, self._profile = self._profile, None
+        profile.disable()
+        profile.create_stats()
+        self._result = {
+            "finished_at": time.time(),
+            "armed_at": self._armed_at,
+            "requests": self._profiled,
+            "wall_seconds": time.perf_counter() - self._started,
+            "stats": profile.stats,
+        }
+
+    def status(self) -> dict:
+        return {
+            "capturing": bool(self._remaining or self._active),
+            "remaining": self._remaining,
+            "in_progress": self._active,
+            "last_capture": (
+                {k: v for k, v in self._result.items() if k != "stats"} if self._result else None
+            ),
+        }
+
+    def report(self, sort: str = "cumulative", limit: int = 50) -> str | None:
+        """The last capture as pstats text, or None if there is none."""
+        if self._result is None:
+            return None
+        out = io.StringIO()
+        stats = pstats.Stats(_StatsHolder(self._result["stats"]), stream=out)
+        stats.sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def dump(self) -> bytes | None:
+        """The last capture in the binary format pstats/snakeviz load."""
+        return marshal.dumps(self._result["stats"]) if self._result else None
+
+
+class _StatsHolder:
+    # pstats.Stats accepts any object with create_stats() and a `stats` dict.
+    def __init__(self, stats: dict):
+        self.stats = stats
+
+    def create_stats(self) -> None:
+        pass
+
+
+profiler = RequestProfiler()
+
+
+def _route_template(scope) -> str:
+    """
+    The matched route's path template with any router prefix, e.g. /vms/start/{vm_name}.
+    Depending on the FastAPI version the route in the scope carries the prefixed or the
+    router-local path, so the prefix is the shortest leading part of the request path after
+    which the route's own pattern matches. Routes with a {...:path} converter thus get no
+    request-dependent prefix (the frontend catch-all is always "/{path:path}").
+    """
+    route = scope.get("route")
+    template = getattr(route, "path", None)
+    if not template:
+        return "unmatched"
+    regex = getattr(route, "path_regex", None)
+    path = scope["path"]
+    if regex is None:
+        return template
+    at = 0
+    while at != -1:
+        if regex.match(path[at:]):
+            return path[:at] + template
+        at = path.find("/", at + 1)
+    return template
+
+
+class InstrumentationMiddleware:
+    """
+    ASGI middleware recording latency and status per route template (e.g.
+    /vms/start/{vm_name}), so cardinality stays bounded. Requests that match no route are
+    recorded as "unmatched". Streaming responses (SSE) are timed until the stream ends.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        global _in_flight
+        status = 500
+        profiled = profiler.enter()
+        started = time.perf_counter()
+        _in_flight += 1
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            _in_flight -= 1
+            if profiled:
+                profiler.exit()
+            path = _route_template(scope)
+            http_duration.observe(elapsed, scope["method"], path)
+            http_requests.inc(scope["method"], path, str(status))
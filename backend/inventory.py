@@ -0,0 +1,512 @@
+# In-memory domain inventory: builds the VM summaries served by GET /vms once, then keeps them
+# current from libvirt domain events, so the request path never has to talk to libvirt.
+import logging
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+import libvirt
+
+from config import LIBVIRT_HOSTS, VM_IMAGE_DIR, STATE_NAMES, INVENTORY_RESYNC_INTERVAL, INVENTORY_TOMBSTONES
+from libvirt_utils import get_libvirt_conn, get_pool
+from instrumentation import timed
+from domain_xml import summarize_xml
+
+logger = logging.getLogger(__name__)
+
+# Domain events that can change a summary. Looked up by name so older bindings that lack
+# one of them still work with the rest.
+_WATCHED_EVENTS = (
+    "VIR_DOMAIN_EVENT_ID_LIFECYCLE",
+    "VIR_DOMAIN_EVENT_ID_DEVICE_ADDED",
+    "VIR_DOMAIN_EVENT_ID_DEVICE_REMOVED",
+    "VIR_DOMAIN_EVENT_ID_TUNABLE",
+)
+
+_event_impl_lock = threading.Lock()
+_event_impl_started = False
+
+
+def _ensure_event_loop() -> None:
+    """Register libvirt's default event implementation and run it on a daemon thread (once per process)."""
+    global _event_impl_started
+    with _event_impl_lock:
+        if _event_impl_started:
+            return
+        libvirt.virEventRegisterDefaultImpl()
+
+        def run():
+            while True:
+                try:
+                    libvirt.virEventRunDefaultImpl()
+                except Exception:
+                    logger.exception("libvirt event loop iteration failed")
+
+        threading.Thread(target=run, name="libvirt-events", daemon=True).start()
+        _event_impl_started = True
+
+
+def summarize_domain(domain) -> dict:
+    """Build the /vms summary for one domain: status, spice port, memory (MiB), vCPUs, disk files and CPU pinning."""
+    state, _ = domain.state()
+    info = {
+        "name": domain.name(),
+        "status": STATE_NAMES.get(state, "Unknown"),
+        "port": None,
+        "memory_mb": None,
+        "vcpus": None,
+        "disks": [],
+        "cpu_pinning": None,
+    }
+
+    # Only memory, vCPUs, CPU pinning, the SPICE port and disk files are needed; see domain_xml.py.
+    xml = domain.XMLDesc()
+    with timed("domain_xml_parse"):
+        try:
+            info.update(summarize_xml(xml).as_dict())
+        except ValueError:
+            # If XML is malformed, skip the parsed fields but still return basic info.
+            pass
+
+    return info
+
+
+def _diff(old: dict[str, dict], new: dict[str, dict]) -> list[dict]:
+    """Describe how `new` differs from `old` as add/remove/update operations."""
+    changes = []
+    for name, info in new.items():
+        before = old.get(name)
+        if before is None:
+            changes.append({"op": "add", "vm": info})
+        elif before != info:
+            fields = {k: v for k, v in info.items() if before.get(k) != v}
+            changes.append({"op": "update", "name": name, "fields": fields})
+    for name in old.keys() - new.keys():
+        changes.append({"op": "remove", "name": name})
+    return changes
+
+
+def image_pool(conn):
+    """The host's active storage pool whose target is VM_IMAGE_DIR, or None."""
+    target = os.path.normpath(VM_IMAGE_DIR)
+    try:
+        for storage_pool in conn.listAllStoragePools():
+            path = ET.fromstring(storage_pool.XMLDesc()).findtext("./target/path")
+            if path and os.path.normpath(path) == target and storage_pool.isActive():
+                return storage_pool
+    except (libvirt.libvirtError, AttributeError, ET.ParseError):
+        pass
+    return None
+
+
+def _image_pool_free_bytes(conn) -> int | None:
+    """Free bytes in the host's image storage pool, if it has one."""
+    storage_pool = image_pool(conn)
+    if storage_pool is None:
+        return None
+    try:
+        return int(storage_pool.info()[3])
+    except libvirt.libvirtError:
+        return None
+
+
+class _HostWatcher:
+    """
+    Keeps the domain summaries of one hypervisor current.
+
+    A dedicated connection subscribes to the host's domain events; each event only marks
+    the domain dirty, and the watcher's thread re-reads dirty domains through that host's
+    connection pool. A full resync every `resync_interval` seconds (or after the event
+    connection drops) catches anything the events missed. Each host has its own thread, so
+    a slow or unreachable host only delays its own part of the inventory.
+    """
+
+    def __init__(self, inventory: "DomainInventory", host: str, uri: str, resync_interval: float):
+        self.inventory = inventory
+        self.host = host
+        self.uri = uri
+        self.resync_interval = resync_interval
+        self.vms: dict[str, dict] = {}
+        self.attempted = threading.Event()
+        self.synced_at: float | None = None
+        self.error: str | None = None
+        # (logical CPUs, memory in MiB) reported by the host, plus free memory and free space
+        # in the storage pool holding VM_IMAGE_DIR, refreshed on every resync.
+        self.size: tuple[int, int] | None = None
+        self.free_memory_mb: int | None = None
+        self.storage_free_bytes: int | None = None
+        self._wake = threading.Condition()
+        self._dirty: set[str] = set()
+        self._resync_requested = True
+        self._last_resync = 0.0
+        self._stopping = False
+        self._thread: threading.Thread | None = None
+        self._event_conn = None
+        self._callback_ids: list[int] = []
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name=f"domain-inventory-{self.host}", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        with self._wake:
+            self._stopping = True
+            self._wake.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self._disconnect_events()
+
+    def invalidate(self, name: str) -> None:
+        with self._wake:
+            self._dirty.add(name)
+            self._wake.notify()
+
+    def request_resync(self) -> None:
+        with self._wake:
+            self._resync_requested = True
+            self._wake.notify()
+
+    def status(self) -> dict:
+        return {
+            "uri": self.uri,
+            "connected": self._event_conn is not None,
+            "domains": len(self.vms),
+            "cpus": self.size[0] if self.size else None,
+            "memory_mb": self.size[1] if self.size else None,
+            "free_memory_mb": self.free_memory_mb,
+            "storage_free_bytes": self.storage_free_bytes,
+            "synced_at": self.synced_at,
+            "error": self.error,
+        }
+
+    # -- event subscription -----------------------------------------------------------------
+
+    def _on_domain_event(self, conn, domain, *args) -> None:
+        # Runs on the libvirt event thread: only record the name, never call back into libvirt here.
+        self.invalidate(domain.name())
+
+    def _on_close(self, conn, reason, opaque) -> None:
+        logger.warning("libvirt event connection to %s closed (reason %s)", self.uri, reason)
+        self._event_conn = None
+        self.request_resync()
+
+    def _connect_events(self) -> None:
+        conn = get_libvirt_conn(self.uri)
+        try:
+            conn.registerCloseCallback(self._on_close, None)
+        except (AttributeError, libvirt.libvirtError):
+            pass
+        ids = []
+        for event_name in _WATCHED_EVENTS:
+            event_id = getattr(libvirt, event_name, None)
+            if event_id is None:
+                continue
+            ids.append(conn.domainEventRegisterAny(None, event_id, self._on_domain_event, None))
+        self._event_conn = conn
+        self._callback_ids = ids
+
+    def _disconnect_events(self) -> None:
+        conn, self._event_conn = self._event_conn, None
+        if conn is None:
+            return
+        for callback_id in self._callback_ids:
+            try:
+                conn.domainEventDeregisterAny(callback_id)
+            except libvirt.libvirtError:
+                pass
+        self._callback_ids = []
+        try:
+            conn.close()
+        except libvirt.libvirtError:
+            pass
+
+    # -- worker -----------------------------------------------------------------------------
+
+    def _summarize(self, domain) -> dict:
+        info = summarize_domain(domain)
+        info["host"] = self.host
+        return info
+
+    def _resync(self) -> None:
+        with get_pool(self.host).connection() as conn:
+            info = conn.getInfo()
+            self.size = (int(info[2]), int(info[1]))
+            self.free_memory_mb = int(conn.getFreeMemory()) // (1024 * 1024)
+            self.storage_free_bytes = _image_pool_free_bytes(conn)
+            vms = {}
+            for domain in conn.listAllDomains():
+                try:
+                    info = self._summarize(domain)
+                except libvirt.libvirtError:
+                    # Domain vanished between listing and reading it.
+                    continue
+                vms[info["name"]] = info
+        self.vms = vms
+        self.synced_at = time.time()
+        self._last_resync = time.monotonic()
+
+    def _refresh(self, names: set[str]) -> None:
+        updates: dict[str, dict | None] = {}
+        with get_pool(self.host).connection() as conn:
+            for name in names:
+                try:
+                    updates[name] = self._summarize(conn.lookupByName(name))
+                except libvirt.libvirtError as e:
+                    if e.get_error_code() != libvirt.VIR_ERR_NO_DOMAIN:
+                        raise
+                    updates[name] = None
+        vms = dict(self.vms)
+        for name, info in updates.items():
+            if info is None:
+                vms.pop(name, None)
+            else:
+                vms[name] = info
+        self.vms = vms
+
+    def _run(self) -> None:
+        while True:
+            with self._wake:
+                due = self._last_resync + self.resync_interval
+                if not (self._stopping or self._dirty or self._resync_requested):
+                    self._wake.wait(max(0.0, due - time.monotonic()))
+                if time.monotonic() >= due:
+                    # Periodic full resync, however busy the event stream keeps the thread.
+                    self._resync_requested = True
+                if self._stopping:
+                    return
+                resync, self._resync_requested = self._resync_requested, False
+                dirty, self._dirty = self._dirty, set()
+
+            try:
+                if self._event_conn is None or not self._event_conn.isAlive():
+                    self._disconnect_events()
+                    self._connect_events()
+                    resync = True
+                if resync:
+                    self._resync()
+                elif dirty:
+                    self._refresh(dirty)
+                self.error = None
+                self.inventory._publish()
+            except Exception as e:
+                self.error = str(e)
+                logger.exception("Domain inventory update for host %s failed; retrying", self.host)
+                with self._wake:
+                    self._dirty |= dirty
+                    self._resync_requested = self._resync_requested or resync
+                    self._wake.wait(min(5.0, self.resync_interval))
+            finally:
+                # Readers stop waiting for a host once it has been tried, reachable or not.
+                self.attempted.set()
+
+
+class DomainInventory:
+    """
+    Event-driven cache of domain summaries across every configured hypervisor.
+
+    One `_HostWatcher` per host keeps that host's summaries current; the inventory merges
+    them into a single name-keyed view in which every summary carries its "host". VM names
+    are expected to be unique across the cluster; if two hosts define the same name, the
+    host listed first in LIBVIRT_URIS wins and a warning is logged. Readers get the last
+    merged list without any libvirt call.
+
+    Every published change bumps `version`. Versions start from the wall clock in
+    milliseconds, so they keep increasing across restarts and a client's stale version from
+    a previous process is never mistaken for a current one. Per-domain change versions and
+    a bounded set of removal tombstones let `changes_since()` answer delta queries.
+    """
+
+    def __init__(self, hosts: dict[str, str] = LIBVIRT_HOSTS, resync_interval: float = INVENTORY_RESYNC_INTERVAL):
+        self._hosts = {host: _HostWatcher(self, host, uri, resync_interval) for host, uri in hosts.items()}
+        self._vms: dict[str, dict] = {}
+        self._listing: list[dict] | None = None
+        self._lock = threading.RLock()
+        self._duplicates: set[str] = set()
+        self._listeners: list = []
+        self._base_version = time.time_ns() // 1_000_000
+        self._version = self._base_version
+        self._added_at: dict[str, int] = {}
+        self._changed_at: dict[str, int] = {}
+        self._removed_at: dict[str, int] = {}
+        # Oldest version changes_since() can answer; raised when tombstones are discarded.
+        self._history_floor = self._base_version
+
+    # -- public API -------------------------------------------------------------------------
+
+    def start(self) -> None:
+        _ensure_event_loop()
+        for watcher in self._hosts.values():
+            watcher.start()
+
+    def stop(self) -> None:
+        for watcher in self._hosts.values():
+            watcher.stop()
+
+    def wait_ready(self, timeout: float | None = None) -> bool:
+        """
+        Block until every host has had its first sync attempt; returns False on timeout.
+        Unreachable hosts count as attempted, so they never hold the listing back.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for watcher in self._hosts.values():
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not watcher.attempted.wait(remaining):
+                return False
+        return True
+
+    def available(self, timeout: float | None = None) -> bool:
+        """
+        True once the listing can be served: every host has been tried, or at least one has
+        synced. Waits up to `timeout` otherwise. Routes use this rather than wait_ready() so
+        one slow host cannot hold back the VMs of the others.
+        """
+        if self.ready_hosts():
+            return True
+        return self.wait_ready(timeout) or bool(self.ready_hosts())
+
+    def ready_hosts(self) -> list[str]:
+        """Hosts whose domains are in the listing (their first sync has completed)."""
+        return [host for host, watcher in self._hosts.items() if watcher.synced_at is not None]
+
+    @property
+    def hosts(self) -> list[str]:
+        return list(self._hosts)
+
+    def host_size(self, host: str) -> tuple[int, int] | None:
+        """(logical CPUs, memory MiB) of `host` as last reported by libvirt."""
+        watcher = self._hosts.get(host)
+        return watcher.size if watcher else None
+
+    def host_stats(self, host: str) -> dict | None:
+        """Cached size, free memory and image storage of `host` (see host_status())."""
+        watcher = self._hosts.get(host)
+        return watcher.status() if watcher else None
+
+    def host_status(self) -> dict[str, dict]:
+        return {host: watcher.status() for host, watcher in self._hosts.items()}
+
+    def listing(self) -> list[dict]:
+        """Return all domain summaries ordered by name. Never calls libvirt."""
+        with self._lock:
+            if self._listing is None:
+                self._listing = [self._vms[name] for name in sorted(self._vms)]
+            return self._listing
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def snapshot(self) -> tuple[int, list[dict]]:
+        """Return (version, listing()) taken atomically."""
+        with self._lock:
+            return self._version, self.listing()
+
+    def changes_since(self, since: int) -> tuple[int, dict] | None:
+        """
+        Return (version, {"added": [...], "changed": [...], "removed": [names]}) describing what
+        changed after `since`, or None if `since` is unknown or too old and the caller should
+        fall back to a full listing.
+        """
+        with self._lock:
+            if since < self._history_floor or since > self._version:
+                return None
+            added = [self._vms[n] for n, v in self._added_at.items() if v > since]
+            changed = [
+                self._vms[n]
+                for n, v in self._changed_at.items()
+                if v > since and self._added_at[n] <= since
+            ]
+            removed = [n for n, v in self._removed_at.items() if v > since]
+            return self._version, {"added": added, "changed": changed, "removed": removed}
+
+    def get(self, name: str) -> dict | None:
+        with self._lock:
+            return self._vms.get(name)
+
+    def host_of(self, name: str) -> str | None:
+        """The host that owns domain `name`, or None if it is not in the inventory."""
+        vm = self.get(name)
+        return vm["host"] if vm is not None else None
+
+    def subscribe(self, listener) -> None:
+        """
+        Call `listener(changes)` from a worker thread whenever the inventory changes.
+
+        `changes` is a list of {"op": "add", "vm": {...}}, {"op": "remove", "name": ...} and
+        {"op": "update", "name": ..., "fields": {...only the fields that changed...}} entries.
+        Listeners must not block; hand the changes off to another thread or event loop.
+        """
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener) -> None:
+        try:
+            self._listeners.remove(listener)
+        except ValueError:
+            pass
+
+    def invalidate(self, name: str, host: str | None = None) -> None:
+        """
+        Schedule a re-read of one domain, e.g. after the API changed it. Without `host` the
+        owning host is used, or every host for a domain the inventory has not seen yet.
+        """
+        host = host or self.host_of(name)
+        if host in self._hosts:
+            self._hosts[host].invalidate(name)
+        else:
+            for watcher in self._hosts.values():
+                watcher.invalidate(name)
+
+    def request_resync(self) -> None:
+        for watcher in self._hosts.values():
+            watcher.request_resync()
+
+    # -- merging ----------------------------------------------------------------------------
+
+    def _record_versions(self, changes: list[dict]) -> None:
+        # Caller holds self._lock.
+        self._version += 1
+        version = self._version
+        for change in changes:
+            if change["op"] == "remove":
+                name = change["name"]
+                self._added_at.pop(name, None)
+                self._changed_at.pop(name, None)
+                self._removed_at[name] = version
+                continue
+            name = change["vm"]["name"] if change["op"] == "add" else change["name"]
+            if change["op"] == "add":
+                self._added_at[name] = version
+                self._removed_at.pop(name, None)
+            self._changed_at[name] = version
+        while len(self._removed_at) > INVENTORY_TOMBSTONES:
+            oldest = next(iter(self._removed_at))
+            self._history_floor = max(self._history_floor, self._removed_at.pop(oldest))
+
+    def _publish(self) -> None:
+        """Merge the per-host summaries and notify listeners of what changed."""
+        with self._lock:
+            vms: dict[str, dict] = {}
+            for host, watcher in self._hosts.items():
+                for name, info in watcher.vms.items():
+                    if name in vms:
+                        if name not in self._duplicates:
+                            self._duplicates.add(name)
+                            logger.warning("Domain %s is defined on both %s and %s", name, vms[name]["host"], host)
+                        continue
+                    vms[name] = info
+            old, self._vms = self._vms, vms
+            changes = _diff(old, vms)
+            if changes:
+                self._listing = None
+                self._record_versions(changes)
+        if not changes:
+            return
+        for listener in list(self._listeners):
+            try:
+                listener(changes)
+            except Exception:
+                logger.exception("Inventory listener failed")
+
+
+inventory = DomainInventory()
@@ -0,0 +1,271 @@
+# Background job engine for long-running work (VM creation): a bounded worker pool, stage and
+# progress reporting, cancellation, and a SQLite-backed history that survives restarts.
+import json
+import logging
+import sqlite3
+import subprocess
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from config import JOBS_DB_PATH, JOB_WORKERS
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+INTERRUPTED = "interrupted"
+
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED, INTERRUPTED)
+
+
+class JobCancelled(Exception):
+    """Raised inside a job runner when the job has been cancelled."""
+
+
+class JobFailed(Exception):
+    """Raised by a job runner to fail the job with a user-facing message."""
+
+
+class JobContext:
+    """Handle passed to a job runner for reporting progress and honouring cancellation."""
+
+    def __init__(self, manager: "JobManager", job_id: str):
+        self._manager = manager
+        self.job_id = job_id
+        self._cancel = threading.Event()
+        # Final state recorded when the runner stops because of _request_cancel().
+        self._cancel_state = CANCELLED
+        self._proc: subprocess.Popen | None = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def check_cancelled(self) -> None:
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def stage(self, name: str, progress: int) -> None:
+        """Enter a new stage; raises JobCancelled if the job was cancelled in the meantime."""
+        self.check_cancelled()
+        self._manager._update(self.job_id, stage=name, progress=progress)
+
+    def run(self, cmd: list[str]) -> None:
+        """Run a subprocess that is killed if the job is cancelled while it runs."""
+        self.check_cancelled()
+        self._proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        try:
+            while True:
+                try:
+                    _, stderr = self._proc.communicate(timeout=0.5)
+                    break
+                except subprocess.TimeoutExpired:
+                    if self._cancel.is_set():
+                        self._proc.kill()
+                        self._proc.wait()
+                        raise JobCancelled()
+            if self._proc.returncode != 0:
+                detail = stderr.decode(errors="replace").strip() or f"exit status {self._proc.returncode}"
+                raise JobFailed(f"{cmd[0]} failed: {detail}")
+        finally:
+            self._proc = None
+
+    def _request_cancel(self, state: str = CANCELLED) -> None:
+        self._cancel_state = state
+        self._cancel.set()
+
+
+class JobManager:
+    """
+    Queue jobs onto a fixed number of workers and record every state change.
+
+    Runners are registered per job kind with `register(kind, fn)`; `fn(ctx, params)` runs on
+    a worker thread and returns a JSON-serialisable result. Job rows live in SQLite so GET
+    /jobs keeps working across restarts: queued jobs are re-queued on start, and jobs that
+    were mid-run when the process died are marked interrupted.
+    """
+
+    def __init__(self, db_path: str = JOBS_DB_PATH, workers: int = JOB_WORKERS):
+        self.db_path = db_path
+        self.workers = workers
+        self._runners: dict[str, object] = {}
+        self._contexts: dict[str, JobContext] = {}
+        self._watchers: dict[str, set] = {}
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+        self._executor: ThreadPoolExecutor | None = None
+
+    # -- lifecycle --------------------------------------------------------------------------
+
+    def register(self, kind: str, runner) -> None:
+        self._runners[kind] = runner
+
+    def start(self) -> None:
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._db_lock, self._db:
+            self._db.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    stage TEXT,
+                    progress INTEGER NOT NULL DEFAULT 0,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )"""
+            )
+            self._db.execute(
+                "UPDATE jobs SET state = ?, error = ?, finished_at = ? WHERE state = ?",
+                (INTERRUPTED, "Server restarted while the job was running", time.time(), RUNNING),
+            )
+            pending = self._db.execute(
+                "SELECT id, kind, params FROM jobs WHERE state = ? ORDER BY created_at", (QUEUED,)
+            ).fetchall()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job")
+        for row in pending:
+            self._schedule(row["id"], row["kind"], json.loads(row["params"]))
+
+    def stop(self) -> None:
+        with self._lock:
+            contexts = list(self._contexts.values())
+        for ctx in contexts:
+            ctx._request_cancel(INTERRUPTED)
+        if self._executor is not None:
+            # Queued jobs stay queued in the database and are picked up again on next start;
+            # running ones stop at their next stage boundary and are recorded as interrupted.
+            self._executor.shutdown(wait=True, cancel_futures=True)
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+            self._db = None
+
+    # -- public API -------------------------------------------------------------------------
+
+    def submit(self, kind: str, params: dict) -> dict:
+        if kind not in self._runners:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = uuid.uuid4().hex
+        with self._db_lock, self._db:
+            self._db.execute(
+                "INSERT INTO jobs (id, kind, params, state, progress, created_at) VALUES (?, ?, ?, ?, 0, ?)",
+                (job_id, kind, json.dumps(params), QUEUED, time.time()),
+            )
+        self._schedule(job_id, kind, params)
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> dict | None:
+        with self._db_lock:
+            row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _row_to_dict(row) if row is not None else None
+
+    def history(self, limit: int = 50, state: str | None = None) -> list[dict]:
+        query, args = "SELECT * FROM jobs", []
+        if state:
+            query += " WHERE state = ?"
+            args.append(state)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        args.append(limit)
+        with self._db_lock:
+            rows = self._db.execute(query, args).fetchall()
+        return [_row_to_dict(row) for row in rows]
+
+    def active(self, kind: str) -> list[dict]:
+        """Queued and running jobs of `kind`, oldest first."""
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT * FROM jobs WHERE kind = ? AND state IN (?, ?) ORDER BY created_at",
+                (kind, QUEUED, RUNNING),
+            ).fetchall()
+        return [_row_to_dict(row) for row in rows]
+
+    def cancel(self, job_id: str) -> dict | None:
+        """Cancel a queued or running job. Finished jobs are returned unchanged."""
+        job = self.get(job_id)
+        if job is None or job["state"] in FINISHED_STATES:
+            return job
+        with self._lock:
+            ctx = self._contexts.get(job_id)
+        if ctx is not None:
+            ctx._request_cancel()
+        if job["state"] == QUEUED:
+            # Never reached a worker; the worker skips it when its turn comes.
+            self._update(job_id, state=CANCELLED, finished_at=time.time())
+        return self.get(job_id)
+
+    def watch(self, job_id: str, callback) -> None:
+        """Call `callback()` (from a worker thread) whenever the job's row changes."""
+        with self._lock:
+            self._watchers.setdefault(job_id, set()).add(callback)
+
+    def unwatch(self, job_id: str, callback) -> None:
+        with self._lock:
+            callbacks = self._watchers.get(job_id)
+            if callbacks is not None:
+                callbacks.discard(callback)
+                if not callbacks:
+                    del self._watchers[job_id]
+
+    # -- internals --------------------------------------------------------------------------
+
+    def _update(self, job_id: str, **fields) -> None:
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._db_lock, self._db:
+            self._db.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+        with self._lock:
+            callbacks = list(self._watchers.get(job_id, ()))
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                logger.exception("Job watcher failed")
+
+    def _schedule(self, job_id: str, kind: str, params: dict) -> None:
+        ctx = JobContext(self, job_id)
+        with self._lock:
+            self._contexts[job_id] = ctx
+        self._executor.submit(self._execute, ctx, kind, params)
+
+    def _execute(self, ctx: JobContext, kind: str, params: dict) -> None:
+        job_id = ctx.job_id
+        try:
+            job = self.get(job_id)
+            if job is None or job["state"] != QUEUED or ctx._cancel_state == INTERRUPTED:
+                return
+            self._update(job_id, state=RUNNING, started_at=time.time())
+            try:
+                result = self._runners[kind](ctx, params)
+            except JobCancelled:
+                self._update(job_id, state=ctx._cancel_state, finished_at=time.time())
+            except JobFailed as e:
+                self._update(job_id, state=FAILED, error=str(e), finished_at=time.time())
+            except Exception as e:
+                logger.exception("Job %s (%s) failed", job_id, kind)
+                self._update(job_id, state=FAILED, error=str(e), finished_at=time.time())
+            else:
+                self._update(
+                    job_id, state=SUCCEEDED, progress=100, result=json.dumps(result), finished_at=time.time()
+                )
+        finally:
+            with self._lock:
+                self._contexts.pop(job_id, None)
+
+
+def _row_to_dict(row: sqlite3.Row) -> dict:
+    job = dict(row)
+    job["params"] = json.loads(job["params"])
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+
+jobs = JobManager()
@@ -0,0 +1,159 @@
+# Dedicated worker pools for blocking libvirt calls, so async route handlers can await them
+# without tying up Starlette's shared threadpool.
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+from config import (
+    LIBVIRT_READ_WORKERS,
+    LIBVIRT_MUTATE_WORKERS,
+    LIBVIRT_BULK_WORKERS,
+    LIBVIRT_READ_TIMEOUT,
+    LIBVIRT_MUTATE_TIMEOUT,
+)
+from inventory import inventory
+from libvirt_utils import ConnectFailed, PoolTimeout, UnknownHost, get_pool
+
+
+class _Lane:
+    """One bounded worker pool plus counters for how long calls wait and run."""
+
+    def __init__(self, name: str, workers: int, timeout: float):
+        self.name = name
+        self.workers = workers
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"libvirt-{name}")
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.run_seconds_total = 0.0
+
+    def _call(self, submitted: float, fn, args, host: str | None):
+        started = time.monotonic()
+        waited = started - submitted
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        ok = False
+        try:
+            with get_pool(host).connection() as conn:
+                result = fn(conn, *args)
+            ok = True
+            return result
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.run_seconds_total += time.monotonic() - started
+                if ok:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+
+    async def run(self, fn, args, timeout: float | None, host: str | None = None):
+        with self._lock:
+            self.queued += 1
+        # Run in a copy of the caller's context, like asyncio.to_thread, so request-scoped
+        # context variables are visible to the libvirt call.
+        context = contextvars.copy_context()
+        future = self._executor.submit(context.run, self._call, time.monotonic(), fn, args, host)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.timed_out += 1
+            # A call that never started is dropped; one already inside libvirt cannot be
+            # interrupted and finishes in the background.
+            if future.cancel():
+                with self._lock:
+                    self.queued -= 1
+            raise HTTPException(504, f"libvirt {self.name} call timed out after {timeout or self.timeout:g}s")
+        except (PoolTimeout, ConnectFailed) as e:
+            raise HTTPException(503, str(e))
+        except UnknownHost as e:
+            raise HTTPException(404, f"Unknown host {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            finished = self.completed + self.failed
+            return {
+                "workers": self.workers,
+                "queued": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "timed_out": self.timed_out,
+                "wait_seconds_avg": (self.wait_seconds_total / finished) if finished else 0.0,
+                "wait_seconds_max": self.wait_seconds_max,
+                "run_seconds_total": self.run_seconds_total,
+            }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _route(host: str | None, for_vm: str | None) -> str | None:
+    # VMs the inventory does not know about go to the default host, which reports them as 404.
+    if host is None and for_vm is not None:
+        return inventory.host_of(for_vm)
+    return host
+
+
+class LibvirtExecutor:
+    """
+    Run blocking libvirt work off the event loop on separate worker lanes.
+
+    Reads (lookups, XML fetches) and mutations (start/stop, define, edits) get their own
+    bounded worker pools, so a burst of slow shutdowns or defines can never delay a read.
+    Bulk operations fan out on a third lane so a 50-VM boot storm does not hold up
+    individual start/stop requests either.
+
+    The callable receives a pooled connection as its first argument:
+
+        result = await libvirt_executor.read(lambda conn, name: ..., vm_name)
+
+    Pass `host=` to run against another managed hypervisor; the default host is used
+    otherwise. `for_vm=` routes the call to the host that owns that VM.
+
+    Each call has a timeout (504 when exceeded) and per-lane counters are kept for queue
+    depth, wait time and run time.
+    """
+
+    def __init__(self):
+        self.reads = _Lane("read", LIBVIRT_READ_WORKERS, LIBVIRT_READ_TIMEOUT)
+        self.mutations = _Lane("mutate", LIBVIRT_MUTATE_WORKERS, LIBVIRT_MUTATE_TIMEOUT)
+        self.bulk_mutations = _Lane("bulk", LIBVIRT_BULK_WORKERS, LIBVIRT_MUTATE_TIMEOUT)
+
+    async def read(self, fn, *args, timeout: float | None = None, host: str | None = None, for_vm: str | None = None):
+        return await self.reads.run(fn, args, timeout, _route(host, for_vm))
+
+    async def mutate(self, fn, *args, timeout: float | None = None, host: str | None = None, for_vm: str | None = None):
+        return await self.mutations.run(fn, args, timeout, _route(host, for_vm))
+
+    async def bulk(self, fn, *args, timeout: float | None = None, host: str | None = None, for_vm: str | None = None):
+        return await self.bulk_mutations.run(fn, args, timeout, _route(host, for_vm))
+
+    def stats(self) -> dict:
+        return {
+            "read": self.reads.stats(),
+            "mutate": self.mutations.stats(),
+            "bulk": self.bulk_mutations.stats(),
+        }
+
+    def shutdown(self) -> None:
+        self.reads.shutdown()
+        self.mutations.shutdown()
+        self.bulk_mutations.shutdown()
+
+
+libvirt_executor = LibvirtExecutor()
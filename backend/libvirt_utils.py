@@ -1,7 +1,167 @@
+# Libvirt connection helpers: a bounded pool of long-lived connections shared by all routes.
+import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
 import libvirt
 
-def get_libvirt_conn():
-    conn = libvirt.open("qemu:///system")
+from config import (
+    LIBVIRT_URI,
+    LIBVIRT_HOSTS,
+    DEFAULT_HOST,
+    LIBVIRT_POOL_SIZE,
+    LIBVIRT_POOL_TIMEOUT,
+    LIBVIRT_POOL_PING_INTERVAL,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(RuntimeError):
+    """Raised when no pooled connection became available within the checkout timeout."""
+
+
+class ConnectFailed(RuntimeError):
+    """Raised when the pool has to open a connection and libvirt refuses it."""
+
+
+def get_libvirt_conn(uri: str = LIBVIRT_URI):
+    """Open a new, unpooled connection. Prefer `pool.connection()` in request handlers."""
+    conn = libvirt.open(uri)
     if conn is None:
-        raise RuntimeError("Failed to open connection to qemu:///system")
+        raise RuntimeError(f"Failed to open connection to {uri}")
     return conn
+
+
+def _close_quietly(conn) -> None:
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+def _is_connection_error(err: "libvirt.libvirtError") -> bool:
+    """True if the error means the connection itself is unusable (daemon restarted, socket closed)."""
+    code = err.get_error_code()
+    domain = err.get_error_domain()
+    return code in (libvirt.VIR_ERR_SYSTEM_ERROR, libvirt.VIR_ERR_NO_CONNECT, libvirt.VIR_ERR_INVALID_CONN) or (
+        domain == libvirt.VIR_FROM_RPC
+    )
+
+
+class LibvirtPool:
+    """
+    Bounded pool of persistent libvirt connections.
+
+    Connections are opened lazily, up to `size` at a time. A checkout blocks for at most
+    `timeout` seconds when every connection is in use. Idle connections are health-checked
+    before reuse (isAlive, plus a cheap RPC when they have been idle longer than
+    `ping_interval`) and transparently reopened, so a libvirtd restart costs one reconnect
+    instead of a failed request.
+    """
+
+    def __init__(self, uri: str, size: int, timeout: float, ping_interval: float):
+        self.uri = uri
+        self.size = size
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        self._slots = threading.BoundedSemaphore(size)
+        # LIFO so the most recently used (known good) connection is handed out first.
+        self._idle: "queue.LifoQueue[tuple[object, float]]" = queue.LifoQueue()
+        self._closed = False
+
+    def _healthy(self, conn, idle_since: float) -> bool:
+        try:
+            if not conn.isAlive():
+                return False
+            if time.monotonic() - idle_since > self.ping_interval:
+                conn.getLibVersion()
+            return True
+        except libvirt.libvirtError:
+            return False
+
+    def acquire(self):
+        """Check a connection out of the pool, opening or reopening one if necessary."""
+        if self._closed:
+            raise RuntimeError("libvirt connection pool is closed")
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(f"No libvirt connection available after {self.timeout:g}s")
+        try:
+            while True:
+                try:
+                    conn, idle_since = self._idle.get_nowait()
+                except queue.Empty:
+                    try:
+                        return get_libvirt_conn(self.uri)
+                    except libvirt.libvirtError as e:
+                        raise ConnectFailed(f"Cannot connect to {self.uri}: {e}") from e
+                if self._healthy(conn, idle_since):
+                    return conn
+                logger.info("Discarding stale libvirt connection to %s", self.uri)
+                _close_quietly(conn)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, conn, broken: bool = False) -> None:
+        """Return a connection to the pool; broken connections are closed instead of reused."""
+        try:
+            if broken or self._closed:
+                _close_quietly(conn)
+            else:
+                self._idle.put((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Context manager form of acquire()/release()."""
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except libvirt.libvirtError as e:
+            broken = _is_connection_error(e)
+            raise
+        finally:
+            self.release(conn, broken)
+
+    def close(self) -> None:
+        """Close every idle connection; connections still checked out are closed on release."""
+        self._closed = True
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            _close_quietly(conn)
+
+
+# One pool per managed host; `pool` is the default host's.
+pools = {
+    host: LibvirtPool(uri, LIBVIRT_POOL_SIZE, LIBVIRT_POOL_TIMEOUT, LIBVIRT_POOL_PING_INTERVAL)
+    for host, uri in LIBVIRT_HOSTS.items()
+}
+pool = pools[DEFAULT_HOST]
+
+
+class UnknownHost(KeyError):
+    """Raised for a host name that is not in LIBVIRT_URIS."""
+
+
+def get_pool(host: str | None = None) -> LibvirtPool:
+    """The connection pool for `host` (the default host when None)."""
+    if host is None:
+        return pool
+    try:
+        return pools[host]
+    except KeyError:
+        raise UnknownHost(host)
+
+
+def close_pools() -> None:
+    for p in pools.values():
+        p.close()
+
@@ -1,19 +1,80 @@
 # Simple FastAPI app entrypoint: configure CORS and mount VM-related routers.
 
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+import libvirt
+
+from config import LIBVIRT_CALL_METRICS
+from instrumentation import InstrumentationMiddleware, instrument_libvirt
+
+from libvirt_utils import close_pools
+from inventory import inventory
+from libvirt_executor import libvirt_executor
+from jobs import jobs
+from golden_images import golden_images
+from image_catalog import catalog as image_catalog
+from metrics import metrics
+from host_telemetry import host_telemetry
+from capacity import capacity
+from events import hub as events_hub
+from console_sessions import consoles
+from static_assets import static_assets
+from spice_decode import spice_decoder
 
 from routes.vms_list import router as vms_list_router
+from routes.vms_events import router as vms_events_router
 from routes.vms_edit import router as vms_edit_router
 from routes.vms_create import router as vms_create_router
 from routes.vms_control import router as vms_control_router
+from routes.vms_bulk import router as vms_bulk_router
+from routes.vms_metrics import router as vms_metrics_router
+from routes.vms_pinning import router as vms_pinning_router
+from routes.vms_console import router as vms_console_router
 from routes.get_sys_info import router as sys_router
 from routes.vms_disks import router as vms_disks_router
+from routes.jobs import router as jobs_router
+from routes.templates import router as templates_router
+from routes.images import router as images_router
+from routes.prometheus import router as prometheus_router
+from routes.consoles import router as consoles_router
+from routes.static_files import router as static_router
 
 
 
+@asynccontextmanager
+async def lifespan(app):
+    # Inventory changes are pushed to /vms/events clients through the hub on this loop.
+    events_hub.attach(asyncio.get_running_loop())
+    inventory.subscribe(events_hub.publish_threadsafe)
+    static_assets.start()
+    host_telemetry.start()
+    capacity.start()
+    inventory.start()
+    image_catalog.start()
+    metrics.start()
+    golden_images.start()
+    jobs.start()
+    consoles.start()
+    spice_decoder.start()
+    yield
+    spice_decoder.stop()
+    consoles.stop()
+    jobs.stop()
+    golden_images.stop()
+    image_catalog.stop()
+    metrics.stop()
+    host_telemetry.stop()
+    inventory.stop()
+    capacity.stop()
+    libvirt_executor.shutdown()
+    # Close the pooled libvirt connections so libvirtd does not log dropped clients.
+    close_pools()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
 
 # Allow all origins during development; restrict this in production deployments.
 origins = ["*"]  # adjust in production
@@ -36,15 +97,33 @@ async def add_cors_header(request, call_next):
         response.headers["Access-Control-Allow-Origin"] = "*"
     return response
 
+# Outermost, so request latency covers every other middleware. Per-method libvirt timing
+# wraps the binding's classes once at startup (LIBVIRT_CALL_METRICS=0 turns it off).
+app.add_middleware(InstrumentationMiddleware)
+if LIBVIRT_CALL_METRICS:
+    instrument_libvirt(libvirt)
+
 # Mount VM-related routes under the "/vms" prefix so the API is grouped.
 app.include_router(vms_list_router, prefix="/vms")
+app.include_router(vms_events_router, prefix="/vms")
 app.include_router(vms_edit_router, prefix="/vms")
 app.include_router(vms_create_router, prefix="/vms")
 app.include_router(vms_control_router, prefix="/vms")
+app.include_router(vms_bulk_router, prefix="/vms")
+app.include_router(vms_metrics_router, prefix="/vms")
+app.include_router(vms_pinning_router, prefix="/vms")
+app.include_router(vms_console_router, prefix="/vms")
 app.include_router(sys_router, prefix="/sys")
 app.include_router(vms_disks_router, prefix="/vms")
+app.include_router(jobs_router, prefix="/jobs")
+app.include_router(templates_router, prefix="/templates")
+app.include_router(images_router, prefix="/images")
+app.include_router(prometheus_router)
+app.include_router(consoles_router, prefix="/consoles")
+# Last: the frontend is served for every GET path no API route claimed.
+app.include_router(static_router)
 
-# Ensure a placeholder favicon is present at the project root so the separate static server can serve it.
+# Ensure a placeholder favicon is present at the project root so it can be served with the other assets.
 import os
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 favicon_path = os.path.join(project_root, "favicon.ico")
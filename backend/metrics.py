@@ -0,0 +1,247 @@
+# Per-VM performance metrics: one getAllDomainStats call per host and interval for every domain, with
+# derived rates kept in fixed-size, array-backed ring buffers.
+import logging
+import math
+import threading
+import time
+from array import array
+
+import libvirt
+
+from config import METRICS_INTERVAL, METRICS_HISTORY
+from libvirt_utils import pools
+
+logger = logging.getLogger(__name__)
+
+# Values stored per sample, in this order.
+FIELDS = (
+    "cpu_percent",
+    "memory_used_mb",
+    "balloon_mb",
+    "block_read_bps",
+    "block_write_bps",
+    "net_rx_bps",
+    "net_tx_bps",
+)
+
+_STATS = (
+    libvirt.VIR_DOMAIN_STATS_STATE
+    | libvirt.VIR_DOMAIN_STATS_CPU_TOTAL
+    | libvirt.VIR_DOMAIN_STATS_BALLOON
+    | libvirt.VIR_DOMAIN_STATS_VCPU
+    | libvirt.VIR_DOMAIN_STATS_INTERFACE
+    | libvirt.VIR_DOMAIN_STATS_BLOCK
+)
+
+_NAN = float("nan")
+
+
+class RingBuffer:
+    """
+    Fixed-capacity history of samples with a fixed set of fields.
+
+    Timestamps and values live in flat `array('d')` buffers allocated once; a sample is
+    written in place at the head index, so recording costs no allocation and the memory
+    is bounded at capacity * (len(fields) + 1) doubles. Missing values are NaN.
+    """
+
+    __slots__ = ("capacity", "fields", "times", "values", "head", "count")
+
+    def __init__(self, capacity: int, fields: tuple[str, ...] = FIELDS):
+        self.capacity = capacity
+        self.fields = fields
+        self.times = array("d", bytes(8 * capacity))
+        self.values = array("d", [_NAN]) * (capacity * len(fields))
+        self.head = 0
+        self.count = 0
+
+    def append(self, timestamp: float, sample: tuple[float, ...]) -> None:
+        i = self.head
+        width = len(self.fields)
+        self.times[i] = timestamp
+        self.values[i * width:(i + 1) * width] = array("d", sample)
+        self.head = (i + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def latest(self) -> tuple[float, dict] | None:
+        if not self.count:
+            return None
+        i = (self.head - 1) % self.capacity
+        width = len(self.fields)
+        return self.times[i], _as_dict(self.fields, self.values[i * width:(i + 1) * width])
+
+    def history(self, points: int, step: int = 1) -> dict:
+        """
+        The last `points` samples, oldest first, as {"timestamps": [...], field: [...]}.
+        With `step` > 1 every `step` consecutive samples are averaged into one point
+        (timestamped by its last sample), so `points` then counts averaged points.
+        """
+        step = max(1, step)
+        n = min(points * step, self.count)
+        n -= n % step
+        width = len(self.fields)
+        slots = [(self.head - n + k) % self.capacity for k in range(n)]
+        out = {"timestamps": [self.times[slots[k + step - 1]] for k in range(0, n, step)]}
+        for f, field in enumerate(self.fields):
+            column = [self.values[i * width + f] for i in slots]
+            out[field] = [_json_float(_mean(column[k:k + step])) for k in range(0, n, step)]
+        return out
+
+
+def _mean(values: list[float]) -> float:
+    present = [v for v in values if not math.isnan(v)]
+    return sum(present) / len(present) if present else _NAN
+
+
+def _json_float(value: float) -> float | None:
+    return None if math.isnan(value) else round(value, 2)
+
+
+def _as_dict(fields: tuple[str, ...], values) -> dict:
+    return {field: _json_float(v) for field, v in zip(fields, values)}
+
+
+def _counter_sum(stats: dict, prefix: str, suffix: str) -> int:
+    """Sum a per-device counter, e.g. block.<n>.rd.bytes over all disks."""
+    total = 0
+    for i in range(int(stats.get(f"{prefix}.count", 0))):
+        total += int(stats.get(f"{prefix}.{i}.{suffix}", 0))
+    return total
+
+
+class MetricsCollector:
+    """
+    Sample every domain's CPU, balloon, block and network counters with one bulk RPC.
+
+    Cumulative counters are turned into rates against the previous sample of the same
+    domain. Rings are created when a domain is first seen running and dropped when the
+    domain disappears; a stopped domain keeps its history but gets no new samples.
+    """
+
+    def __init__(self, interval: float = METRICS_INTERVAL, capacity: int = METRICS_HISTORY):
+        self.interval = interval
+        self.capacity = capacity
+        self._rings: dict[str, RingBuffer] = {}
+        self._previous: dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.last_sample_at: float | None = None
+        self.last_duration: float | None = None
+        self.last_error: str | None = None
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="vm-metrics", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            started = time.monotonic()
+            records, errors = [], []
+            for host, host_pool in pools.items():
+                # One bulk call per host; a failing host only loses its own sample.
+                try:
+                    with host_pool.connection() as conn:
+                        records.extend(conn.getAllDomainStats(_STATS, 0))
+                except Exception as e:
+                    errors.append(f"{host}: {e}")
+                    logger.warning("Metrics sample from %s failed: %s", host, e)
+            self._record(time.time(), started, records, failed=bool(errors))
+            self.last_error = "; ".join(errors) or None
+            self.last_duration = time.monotonic() - started
+            self._stop.wait(max(0.0, self.interval - self.last_duration))
+
+    def _record(self, now: float, mono: float, records, failed: bool = False) -> None:
+        seen = set()
+        with self._lock:
+            for domain, stats in records:
+                name = domain.name()
+                seen.add(name)
+                if stats.get("state.state") != libvirt.VIR_DOMAIN_RUNNING:
+                    self._previous.pop(name, None)
+                    continue
+                counters = (
+                    mono,
+                    int(stats.get("cpu.time", 0)),
+                    _counter_sum(stats, "block", "rd.bytes"),
+                    _counter_sum(stats, "block", "wr.bytes"),
+                    _counter_sum(stats, "net", "rx.bytes"),
+                    _counter_sum(stats, "net", "tx.bytes"),
+                )
+                previous = self._previous.get(name)
+                self._previous[name] = counters
+                if previous is None:
+                    continue
+                elapsed = counters[0] - previous[0]
+                if elapsed <= 0:
+                    continue
+                vcpus = max(1, int(stats.get("vcpu.current", 1)))
+                # Counters reset when the guest restarts; skip rates that would go negative.
+                deltas = [c - p if c >= p else _NAN for c, p in zip(counters[1:], previous[1:])]
+                balloon_kib = stats.get("balloon.current")
+                unused_kib = stats.get("balloon.unused")
+                used_kib = stats.get("balloon.rss") if unused_kib is None else (balloon_kib or 0) - unused_kib
+                sample = (
+                    deltas[0] / (elapsed * 1e9 * vcpus) * 100,
+                    used_kib / 1024 if used_kib is not None else _NAN,
+                    balloon_kib / 1024 if balloon_kib is not None else _NAN,
+                    deltas[1] / elapsed,
+                    deltas[2] / elapsed,
+                    deltas[3] / elapsed,
+                    deltas[4] / elapsed,
+                )
+                ring = self._rings.get(name)
+                if ring is None:
+                    ring = self._rings[name] = RingBuffer(self.capacity)
+                ring.append(now, sample)
+            # Only forget domains once every host answered; an unreachable host's VMs keep
+            # their history until it is back.
+            if not failed:
+                for name in list(self._rings):
+                    if name not in seen:
+                        del self._rings[name]
+                for name in list(self._previous):
+                    if name not in seen:
+                        del self._previous[name]
+            self.last_sample_at = now
+
+    def current(self) -> dict[str, dict]:
+        """Latest sample of every VM that has one: {name: {"timestamp", field: value, ...}}."""
+        with self._lock:
+            out = {}
+            for name, ring in self._rings.items():
+                latest = ring.latest()
+                if latest is not None:
+                    out[name] = {"timestamp": latest[0], **latest[1]}
+            return out
+
+    def for_vm(self, name: str, points: int) -> dict | None:
+        """Latest sample and up to `points` of history for one VM, or None if never sampled."""
+        with self._lock:
+            ring = self._rings.get(name)
+            if ring is None:
+                return None
+            latest = ring.latest()
+            return {
+                "current": {"timestamp": latest[0], **latest[1]} if latest else None,
+                "history": ring.history(points),
+            }
+
+    def status(self) -> dict:
+        return {
+            "interval": self.interval,
+            "capacity": self.capacity,
+            "fields": list(FIELDS),
+            "last_sample_at": self.last_sample_at,
+            "last_duration": self.last_duration,
+            "last_error": self.last_error,
+        }
+
+
+metrics = MetricsCollector()
@@ -0,0 +1,348 @@
+# Replay driver for console captures (console_capture.py): a local stand-in SPICE server plays
+# the capture's server-to-browser records through the real relay (console_proxy.py) to an
+# in-process WebSocket client that sends the captured browser traffic back. The received
+# DrawCopy images are then decoded by the src/ decoders under node. Reports throughput,
+# end-to-end message latency and frame-decode time distributions as JSON.
+#
+#   python replay_console.py captures/web-01-20261017T101500-3.spicecap
+#   python replay_console.py CAPTURE --speed 0 --decode server -o replay.json
+#   python replay_console.py CAPTURE --latency-ms 40 --bandwidth 2000000
+import argparse
+import asyncio
+import json
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from console_capture import DOWN, UP, CaptureReader
+from spice_decode import SPICE_MAGIC, SPICE_MSG_DISPLAY_DRAW_COPY, offers_mini_header, spice_decoder
+
+SRC = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# Parses and decodes each DrawCopy with spice-html5's own code, as display.js does, and
+# times it; putImageData is left out. jsbn.js (pulled in by spicemsg.js) expects a browser.
+NODE_HARNESS = """
+globalThis.navigator = { appName: 'node' };
+const { readFileSync } = await import('fs');
+const Messages = await import('%(src)s/spicemsg.js');
+const { Constants } = await import('%(src)s/enums.js');
+const { convert_spice_lz_to_web } = await import('%(src)s/lz.js');
+const { convert_spice_bitmap_to_web } = await import('%(src)s/bitmap.js');
+const Quic = await import('%(src)s/quic.js');
+const ctx = { createImageData: (w, h) => ({ width: w, height: h, data: new Uint8ClampedArray(w * h * 4) }) };
+const names = {};
+for (const [k, v] of Object.entries(Constants))
+    if (k.startsWith('SPICE_IMAGE_TYPE_') || k.startsWith('VMUI_IMAGE_TYPE_'))
+        names[v] = k.replace(/^(SPICE|VMUI)_IMAGE_TYPE_/, '').toLowerCase();
+const data = readFileSync(process.argv[2]);
+const results = [];
+for (let at = 0; at < data.length;) {
+    const size = data.readUInt32LE(at); at += 4;
+    const body = data.buffer.slice(data.byteOffset + at, data.byteOffset + at + size); at += size;
+    const started = process.hrtime.bigint();
+    const draw = new Messages.SpiceMsgDisplayDrawCopy(body);
+    const image = draw.data.src_bitmap;
+    if (!image) continue;
+    const type = image.descriptor.type;
+    if (type == Constants.SPICE_IMAGE_TYPE_LZ_RGB) convert_spice_lz_to_web(ctx, image.lz_rgb);
+    else if (type == Constants.SPICE_IMAGE_TYPE_QUIC) Quic.convert_spice_quic_to_web(ctx, image.quic);
+    else if (type == Constants.SPICE_IMAGE_TYPE_BITMAP) convert_spice_bitmap_to_web(ctx, image.bitmap);
+    else if (type == Constants.VMUI_IMAGE_TYPE_RGBA) new Uint8ClampedArray(image.rgba.data);
+    results.push([names[type] || String(type), Number(process.hrtime.bigint() - started) / 1e6]);
+}
+console.log(JSON.stringify(results));
+"""
+
+
+class SpiceFramer:
+    """
+    Splits one direction-down SPICE stream into units: the link header, link reply and link
+    result, then each mini-header message. `feed` returns the units completed by a chunk as
+    (message type or None, body of DrawCopy messages or None).
+    """
+
+    def __init__(self):
+        self.passthrough = False
+        self._stage = 0  # 0 link header, 1 link reply, 2 link result, 3 message header, 4 body
+        self._left = 16
+        self._buf = bytearray()
+        self._type = None
+
+    def feed(self, data) -> list[tuple[int | None, bytes | None]]:
+        units = []
+        p, n = 0, len(data)
+        while p < n and not self.passthrough:
+            k = min(self._left, n - p)
+            keep = self._stage < 4 or self._type == SPICE_MSG_DISPLAY_DRAW_COPY
+            if keep:
+                self._buf += data[p:p + k]
+            p += k
+            self._left -= k
+            if self._left:
+                break
+            buf = bytes(self._buf)
+            self._buf.clear()
+            if self._stage == 0:
+                magic, _, _, size = struct.unpack("<4sIII", buf)
+                self.passthrough = magic != SPICE_MAGIC or not size
+                self._stage, self._left = 1, size
+                units.append((None, None))
+            elif self._stage == 1:
+                self.passthrough = not offers_mini_header(buf)
+                self._stage, self._left = 2, 4
+                units.append((None, None))
+            elif self._stage == 2:
+                self._stage, self._left = 3, 6
+                units.append((None, None))
+            elif self._stage == 3:
+                self._type, size = struct.unpack("<HI", buf)
+                if size:
+                    self._stage, self._left = 4, size
+                else:
+                    self._left = 6
+                    units.append((self._type, None))
+            else:
+                units.append((self._type, buf if self._type == SPICE_MSG_DISPLAY_DRAW_COPY else None))
+                self._stage, self._left = 3, 6
+        return units
+
+
+class StandInServer:
+    """
+    Plays the capture's server-to-browser records to the one connection it accepts, once the
+    browser's link message arrives. Each record becomes ready at its captured time divided
+    by `speed` (all at once when speed is 0), then crosses a simulated link:
+    `bandwidth` bytes/sec serialisation in order, then `latency` seconds of delay.
+    """
+
+    def __init__(self, records: list[tuple[float, bytes]], speed: float, latency: float, bandwidth: float):
+        self.records = records
+        self.speed = speed
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.ready: list[float] = []
+        self.port = None
+        self.done = threading.Event()
+        self._started = threading.Event()
+
+    def start(self) -> None:
+        threading.Thread(target=lambda: asyncio.run(self._main()), daemon=True).start()
+        self._started.wait()
+
+    async def _main(self) -> None:
+        server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = server.sockets[0].getsockname()[1]
+        self._started.set()
+        async with server:
+            await asyncio.get_running_loop().run_in_executor(None, self.done.wait)
+
+    async def _handle(self, reader, writer) -> None:
+        await reader.read(65536)
+        drain = asyncio.ensure_future(self._discard(reader))
+        start = time.perf_counter()
+        first = self.records[0][0] if self.records else 0.0
+        sent = start
+        for t, data in self.records:
+            ready = start + ((t - first) / self.speed if self.speed else 0.0)
+            sent = max(ready, sent) + (len(data) / self.bandwidth if self.bandwidth else 0.0)
+            self.ready.append(ready)
+            delay = sent + self.latency - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            writer.write(data)
+            await writer.drain()
+        # Half-close and let the relay hang up first: closing with unread data queued would
+        # reset the connection and drop whatever the relay has not read yet.
+        writer.write_eof()
+        await drain
+        writer.close()
+        self.done.set()
+
+    async def _discard(self, reader) -> None:
+        while await reader.read(65536):
+            pass
+
+
+def _distribution(samples: list[float]) -> dict | None:
+    """Mean and nearest-rank percentiles in ms of samples in ms."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+
+    def rank(q):
+        return ordered[max(0, min(len(ordered) - 1, int(round(q / 100 * len(ordered) + 0.5)) - 1))]
+
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered), 3),
+        "p50": round(rank(50), 3),
+        "p90": round(rank(90), 3),
+        "p99": round(rank(99), 3),
+        "max": round(ordered[-1], 3),
+    }
+
+
+def _browser(port: int, up: list[tuple[float, bytes]], speed: float, decode: str) -> tuple[list, list, dict, float]:
+    """Connect through the relay, send the captured browser traffic and record what arrives."""
+    from starlette.applications import Starlette
+    from starlette.routing import WebSocketRoute
+    from starlette.testclient import TestClient
+    from starlette.websockets import WebSocketDisconnect
+
+    from console_proxy import relay
+
+    sessions = []
+
+    async def endpoint(websocket):
+        sessions.append(await relay.bridge(websocket, "replay", "replay", "127.0.0.1", port, "replay", decode))
+
+    app = Starlette(routes=[WebSocketRoute("/replay", endpoint)])
+    received: list[tuple[float, int]] = []
+    units: list[tuple[float, int | None, bytes | None]] = []
+    framer = SpiceFramer()
+    with TestClient(app) as client:
+        with client.websocket_connect("/replay", subprotocols=["binary"]) as ws:
+            ws.send_bytes(up[0][1])
+
+            def send_rest():
+                start, first = time.perf_counter(), up[0][0]
+                for t, data in up[1:]:
+                    delay = start + ((t - first) / speed if speed else 0.0) - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    ws.send_bytes(data)
+
+            threading.Thread(target=send_rest, daemon=True).start()
+            started = time.perf_counter()
+            while True:
+                try:
+                    data = ws.receive_bytes()
+                except WebSocketDisconnect:
+                    break
+                now = time.perf_counter()
+                received.append((now, len(data)))
+                units.extend((now, msg_type, body) for msg_type, body in framer.feed(data))
+            elapsed = time.perf_counter() - started
+    session = sessions[0].as_dict() if sessions and sessions[0] is not None else {}
+    return received, units, session, elapsed
+
+
+def _decode_times(node: str, bodies: list[bytes]) -> dict:
+    if not bodies:
+        return {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "draws.bin")
+        with open(path, "wb") as f:
+            for body in bodies:
+                f.write(struct.pack("<I", len(body)))
+                f.write(body)
+        harness = os.path.join(tmp, "harness.mjs")
+        with open(harness, "w") as f:
+            f.write(NODE_HARNESS % {"src": "file://" + SRC})
+        result = subprocess.run([node, harness, path], check=True, capture_output=True, text=True)
+    by_type: dict[str, list[float]] = {}
+    for image_type, ms in json.loads(result.stdout):
+        by_type.setdefault(image_type, []).append(ms)
+    return {t: _distribution(samples) for t, samples in sorted(by_type.items())}
+
+
+def replay(args) -> dict:
+    with CaptureReader(args.capture) as reader:
+        summary = reader.summary()
+        down = [(t, bytes(p)) for d, t, p in reader if d == DOWN]
+        up = [(t, bytes(p)) for d, t, p in reader if d == UP]
+    if not up or not down:
+        raise SystemExit(f"{args.capture}: nothing to replay (needs traffic in both directions)")
+
+    # Which record completes each unit of the server stream, to match against arrivals.
+    framer = SpiceFramer()
+    unit_records = []
+    for i, (_, data) in enumerate(down):
+        unit_records.extend(i for _ in framer.feed(data))
+
+    server = StandInServer(down, args.speed, args.latency_ms / 1000, args.bandwidth)
+    server.start()
+    if args.decode == "server":
+        spice_decoder.start()
+    try:
+        received, units, session, elapsed = _browser(server.port, up, args.speed, args.decode)
+    finally:
+        spice_decoder.stop()
+        server.done.set()
+
+    latencies = [
+        (arrived - server.ready[record]) * 1000
+        for (arrived, _, _), record in zip(units, unit_records)
+        if record < len(server.ready)
+    ]
+    browser_bytes = sum(n for _, n in received)
+    server_bytes = sum(len(d) for _, d in down)
+    bodies = [body for _, _, body in units if body is not None]
+    return {
+        "capture": summary,
+        "settings": {
+            "speed": args.speed or "max",
+            "latency_ms": args.latency_ms,
+            "bandwidth_bytes_per_sec": args.bandwidth or None,
+            "decode": args.decode,
+        },
+        "duration_s": round(elapsed, 3),
+        "throughput": {
+            "server_bytes": server_bytes,
+            "browser_bytes": browser_bytes,
+            "browser_bytes_per_sec": round(browser_bytes / elapsed, 1) if elapsed else None,
+            "websocket_messages": len(received),
+        },
+        "messages": {"server": len(unit_records), "browser": len(units), "draw_copies": len(bodies)},
+        "latency_ms": _distribution(latencies),
+        "decode_ms": _decode_times(args.node, bodies),
+        "relay_session": session,
+    }
+
+
+def _print_summary(report: dict, out=sys.stderr) -> None:
+    t = report["throughput"]
+    print(
+        f"{report['duration_s']:.2f}s  {t['browser_bytes']} bytes to the browser "
+        f"({(t['browser_bytes_per_sec'] or 0) / 1e6:.2f} MB/s), {report['messages']['browser']} messages",
+        file=out,
+    )
+    rows = [("end-to-end latency", report["latency_ms"])]
+    rows += [(f"decode {image_type}", dist) for image_type, dist in report["decode_ms"].items()]
+    print(f"{'':<24} {'count':>7} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}", file=out)
+    for label, dist in rows:
+        if dist:
+            print(
+                f"{label:<24} {dist['count']:>7} {dist['p50']:>9.3f} {dist['p90']:>9.3f} {dist['p99']:>9.3f} {dist['max']:>9.3f}",
+                file=out,
+            )
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Replay a console capture through the relay and the SPICE decoders.")
+    parser.add_argument("capture", help="capture file recorded with ?capture=1")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 = real time, 2 = twice as fast, 0 = max speed")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="simulated one-way network latency")
+    parser.add_argument("--bandwidth", type=float, default=0.0, help="simulated link bytes/sec (0 = unlimited)")
+    parser.add_argument("--decode", choices=("client", "server"), default="client", help="image decoding mode")
+    parser.add_argument("--node", default="node", help="node binary used to run the src/ decoders")
+    parser.add_argument("-o", "--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    report = replay(args)
+    _print_summary(report)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
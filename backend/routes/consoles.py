@@ -0,0 +1,84 @@
+# Console session management: open SPICE console sessions per VM and user with live
+# throughput, the configured bandwidth limits, closing a session, and switching a session
+# between client and server image decoding; plus the traffic captures recorded with
+# ?capture=1 on the console WebSocket.
+import os
+
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import FileResponse
+from typing import Optional
+
+from console_capture import capture_path, list_captures
+from console_proxy import relay
+from console_sessions import consoles
+from schemas_local import ConsoleDecodeRequest
+from spice_decode import spice_decoder
+
+router = APIRouter()
+
+
+@router.get("/", summary="Open console sessions", tags=["consoles"])
+async def list_consoles(
+    vm: Optional[str] = Query(None, description="Only sessions for this VM"),
+    user: Optional[str] = Query(None, description="Only sessions for this user"),
+):
+    """
+    Every open console session (one per SPICE channel) with bytes/sec in each direction over
+    the last sampling interval, totals, time spent throttled and send latency, plus a per-VM
+    rollup of sessions and users and the bandwidth limits in force.
+    """
+    return {
+        "limits": consoles.limits(),
+        "total_sessions": relay.total_sessions,
+        "failed_connects": relay.failed_connects,
+        "idle_reaped": consoles.reaped,
+        "decode": spice_decoder.stats(),
+        "vms": consoles.by_vm(),
+        "sessions": consoles.sessions(vm, user),
+    }
+
+
+@router.get("/captures", summary="Recorded console captures", tags=["consoles"])
+def get_captures():
+    """
+    Capture files with their metadata, duration and bytes in each direction. A plain def, so
+    walking the records runs in the thread pool rather than on the event loop.
+    """
+    return {"captures": list_captures()}
+
+
+@router.get("/captures/{name}", summary="Download a console capture", tags=["consoles"])
+async def download_capture(name: str):
+    path = capture_path(name)
+    if path is None:
+        raise HTTPException(404, f"Capture '{name}' not found")
+    return FileResponse(path, media_type="application/octet-stream", filename=name)
+
+
+@router.delete("/captures/{name}", summary="Delete a console capture", tags=["consoles"])
+def delete_capture(name: str):
+    path = capture_path(name)
+    if path is None:
+        raise HTTPException(404, f"Capture '{name}' not found")
+    os.remove(path)
+    return {"message": f"Capture '{name}' deleted"}
+
+
+@router.delete("/{session_id}", summary="Close a console session", tags=["consoles"])
+async def close_console(session_id: int):
+    if not consoles.close(session_id, "closed by administrator"):
+        raise HTTPException(404, f"Console session {session_id} not found")
+    return {"message": "Console session closed"}
+
+
+@router.post("/{session_id}/decode", summary="Choose where a session's images are decoded", tags=["consoles"])
+async def set_console_decode(session_id: int, request: ConsoleDecodeRequest):
+    """
+    "server" decodes the display channel's LZ images in the backend's worker pool and sends
+    them pre-decoded; "client" leaves decoding to the browser. Applies from the next message.
+    """
+    if request.mode == "server" and not spice_decoder.available:
+        raise HTTPException(409, "Server-side decoding is disabled (SPICE_DECODE_WORKERS=0)")
+    if not consoles.set_decode(session_id, request.mode):
+        raise HTTPException(404, f"Console session {session_id} not found")
+    return {"message": f"Console session {session_id} now decodes on the {request.mode}"}
@@ -1,60 +1,152 @@
-from fastapi import APIRouter
-import os
+from fastapi import APIRouter, HTTPException, Query, Request, Response
 from typing import Optional
 
+from host_telemetry import host_telemetry
+from capacity import capacity
+from scheduler import POLICIES, scheduler
+from topology import pinning
+from config import DEFAULT_HOST
+from instrumentation import ProfileBusy, profiler
+from http_cache import conditional_json, content_etag, encode_json
+from libvirt_executor import libvirt_executor
+from libvirt_utils import pool
+from inventory import inventory
+
 router = APIRouter()
 
 
-def _read_mem_total_kb() -> int:
-    """Return total system memory in kB from /proc/meminfo, or 0 on failure."""
-    try:
-        with open("/proc/meminfo", "r", encoding="utf-8") as f:
-            for line in f:
-                if line.startswith("MemTotal:"):
-                    parts = line.split()
-                    if len(parts) >= 2:
-                        return int(parts[1])
-    except Exception:
-        pass
-    return 0
+@router.get("/", summary="System info", tags=["sys"])
+async def get_system_info(
+    request: Request,
+    history: int = Query(0, ge=0, le=10000, description="Number of history points to include"),
+    step: int = Query(1, ge=1, le=3600, description="Average this many samples into each history point"),
+):
+    """
+    Return host information useful for the UI, served from the latest telemetry sample:
+    - vcpus: number of online logical CPUs
+    - memory_kb: total memory in kilobytes (from /proc/meminfo)
+    - memory_mb: total memory in megabytes (rounded down)
+    - telemetry: CPU utilisation, available memory, PSI stall percentages and disk
+      throughput over the last sampling interval
+    - history: with ?history=N, the last N points (optionally averaged over `step` samples)
+
+    The response carries a content ETag; If-None-Match with the same value returns 304.
+    """
+    mem_kb = host_telemetry.memory_kb
+    mem_mb: Optional[int] = (mem_kb // 1024) if mem_kb else None
+    data = {
+        "vcpus": host_telemetry.vcpus,
+        "memory_kb": mem_kb,
+        "memory_mb": mem_mb,
+        "interval": host_telemetry.interval,
+        "telemetry": host_telemetry.latest(),
+    }
+    if history:
+        data["history"] = host_telemetry.history(history, step)
+    body = encode_json(data)
+    return conditional_json(request, body, content_etag(body))
+
+
+@router.get("/libvirt", summary="libvirt executor and connection pool statistics", tags=["sys"])
+def get_libvirt_stats():
+    """
+    Queue depth, wait and run times for the read and mutation worker lanes, the connection
+    pool configuration, and the sync status of every managed host. Useful for spotting
+    lifecycle bursts that back up or hosts that have dropped out.
+    """
+    return {
+        "uri": pool.uri,
+        "pool_size": pool.size,
+        "executor": libvirt_executor.stats(),
+        "hosts": inventory.host_status(),
+    }
+
+
+@router.get("/capacity", summary="Committed vCPUs and memory against overcommit limits", tags=["sys"])
+async def get_capacity():
+    """
+    The admission-control ledger: host size, overcommit ratios, resulting limits, what is
+    committed to domains (including pending reservations) and what is still available.
+    """
+    return capacity.snapshot()
 
 
-def _read_cpu_online_count() -> int:
+@router.get("/scheduler", summary="VM placement scores and recent decisions", tags=["sys"])
+async def get_scheduler(
+    vcpus: int = Query(0, ge=0, description="vCPUs of a hypothetical VM to score hosts for"),
+    memory_mb: int = Query(0, ge=0, description="Memory of a hypothetical VM to score hosts for"),
+    policy: Optional[str] = Query(None, description="Scoring policy; the configured default when omitted"),
+    limit: int = Query(50, ge=1, le=1000, description="Number of recent decisions to return"),
+):
     """
-    Try to read /sys/devices/system/cpu/online (e.g. '0-3,5') to compute online CPUs.
-    Fallback to os.cpu_count() if /sys is not available.
+    The placement policy in use, the cached stats and score of every host for a VM of the
+    given size, and the most recent placement decisions with each host's score or the
+    reason it was rejected.
     """
     try:
-        path = "/sys/devices/system/cpu/online"
-        if os.path.exists(path):
-            s = open(path, "r", encoding="utf-8").read().strip()
-            if s:
-                count = 0
-                for part in s.split(","):
-                    if "-" in part:
-                        a, b = part.split("-")
-                        count += int(b) - int(a) + 1
-                    else:
-                        # single cpu index like "0" or "5"
-                        count += 1
-                if count > 0:
-                    return count
-    except Exception:
-        pass
-    # Final fallback
-    return os.cpu_count() or 0
+        candidates = scheduler.preview(vcpus, memory_mb, policy)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    return {
+        "policy": scheduler.policy,
+        "policies": list(POLICIES),
+        "candidates": candidates,
+        "decisions": scheduler.decisions(limit),
+    }
 
 
-@router.get("/", summary="System info", tags=["sys"])
-def get_system_info():
+@router.get("/topology", summary="Host NUMA topology and vCPU pin map", tags=["sys"])
+async def get_topology(
+    host: Optional[str] = Query(None, description="Managed host; the default host when omitted"),
+    refresh: bool = Query(False, description="Re-read the topology instead of using the cached copy"),
+):
     """
-    Return basic system information useful for the UI:
-    - vcpus: number of online logical CPUs
-    - memory_kb: total memory in kilobytes (from /proc/meminfo)
-    - memory_mb: total memory in megabytes (rounded down)
+    The host's NUMA nodes (CPUs, memory, free memory, CPUs not pinned to any VM), each
+    CPU's socket/core/siblings, the CPUs reserved for housekeeping, and the host-wide pin
+    map: which VM vCPUs are pinned to which CPUs.
     """
-    vcpus = _read_cpu_online_count()
-    mem_kb = _read_mem_total_kb()
-    mem_mb: Optional[int] = (mem_kb // 1024) if mem_kb else None
-    return {"vcpus": vcpus, "memory_kb": mem_kb, "memory_mb": mem_mb}
+    host = host or DEFAULT_HOST
+    return await libvirt_executor.read(pinning.host_view, host, refresh, host=host)
+
 
+@router.post("/profile", summary="Profile the next N requests", tags=["sys"])
+async def start_profile(requests: int = Query(100, ge=1, description="Number of requests to capture")):
+    """
+    Arm a cProfile capture spanning the next `requests` requests (capped at
+    PROFILE_MAX_REQUESTS). Fetch the result from GET /sys/profile once it has finished.
+    """
+    try:
+        profiler.arm(requests)
+    except ProfileBusy as e:
+        raise HTTPException(409, str(e))
+    return profiler.status()
+
+
+@router.get("/profile", summary="Last request profile", tags=["sys"])
+async def get_profile(
+    format: str = Query("status", pattern="^(status|text|pstats)$"),
+    sort: str = Query("cumulative", description="pstats sort key for format=text"),
+    limit: int = Query(50, ge=1, le=1000, description="Functions listed for format=text"),
+):
+    """
+    Capture status by default; `format=text` returns the last capture as a pstats report,
+    `format=pstats` as a binary stats file for `python -m pstats` or snakeviz.
+    """
+    if format == "status":
+        return profiler.status()
+    if format == "pstats":
+        data = profiler.dump()
+        if data is None:
+            raise HTTPException(404, "No profile has been captured yet")
+        return Response(
+            data,
+            media_type="application/octet-stream",
+            headers={"Content-Disposition": 'attachment; filename="requests.pstats"'},
+        )
+    try:
+        report = profiler.report(sort, limit)
+    except KeyError:
+        raise HTTPException(400, f"Unknown sort key '{sort}'")
+    if report is None:
+        raise HTTPException(404, "No profile has been captured yet")
+    return Response(report, media_type="text/plain")
@@ -0,0 +1,35 @@
+# Endpoints for browsing the disk image catalog (see image_catalog.py).
+import asyncio
+from typing import Literal
+
+from fastapi import APIRouter, HTTPException, Query
+
+from image_catalog import catalog
+
+router = APIRouter()
+
+
+@router.get("/", summary="List disk images with metadata", tags=["images"])
+async def list_images(
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    format: Literal["qcow2", "raw", "iso"] | None = None,
+    name: str | None = Query(None, description="Shell-style pattern, e.g. 'win*'"),
+    domain: str | None = Query(None, description="Only images referenced by this VM"),
+    in_use: bool | None = Query(None, description="Only images that are (true) or are not (false) attached"),
+):
+    """
+    Page through the images in VM_IMAGE_DIR. Each entry has format, virtual and allocated
+    size, backing chain and the VMs that reference it. Served from memory.
+    """
+    if not catalog.wait_ready(0) and not await asyncio.to_thread(catalog.wait_ready, 10):
+        raise HTTPException(503, "Image catalog is not ready yet")
+    if catalog.error:
+        raise HTTPException(500, catalog.error)
+    return catalog.query(offset, limit, format, name, domain, in_use)
+
+
+@router.post("/rescan", summary="Rescan the image directory now", tags=["images"])
+async def rescan_images():
+    await asyncio.to_thread(catalog.rescan)
+    return {"message": "Image catalog rescanned", "error": catalog.error}
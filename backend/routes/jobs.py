@@ -0,0 +1,70 @@
+# Endpoints for background jobs: status, history, cancellation and a progress stream.
+import asyncio
+import json
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+from config import EVENTS_HEARTBEAT_INTERVAL
+from jobs import FINISHED_STATES, jobs
+
+router = APIRouter()
+
+
+@router.get("/", summary="Recent jobs", tags=["jobs"])
+def list_jobs(limit: int = 50, state: str | None = None):
+    return {"jobs": jobs.history(limit=max(1, min(limit, 500)), state=state)}
+
+
+@router.get("/{job_id}", summary="Job status", tags=["jobs"])
+def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(404, f"Job '{job_id}' not found")
+    return job
+
+
+@router.delete("/{job_id}", summary="Cancel a job", tags=["jobs"])
+def cancel_job(job_id: str):
+    job = jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(404, f"Job '{job_id}' not found")
+    return job
+
+
+@router.get("/{job_id}/events", summary="Stream job progress (Server-Sent Events)", tags=["jobs"])
+async def job_events(job_id: str, request: Request):
+    """
+    Server-Sent Events stream of the job record: one `job` event now, another after every
+    stage/state change, ending once the job has finished. Rapid changes are coalesced,
+    so a slow client only ever receives the latest state.
+    """
+    if jobs.get(job_id) is None:
+        raise HTTPException(404, f"Job '{job_id}' not found")
+
+    loop = asyncio.get_running_loop()
+    changed = asyncio.Event()
+
+    def notify():
+        loop.call_soon_threadsafe(changed.set)
+
+    async def stream():
+        jobs.watch(job_id, notify)
+        try:
+            while True:
+                changed.clear()
+                job = await asyncio.to_thread(jobs.get, job_id)
+                yield f"event: job\ndata: {json.dumps(job)}\n\n"
+                if job["state"] in FINISHED_STATES:
+                    return
+                while not changed.is_set():
+                    if await request.is_disconnected():
+                        return
+                    try:
+                        await asyncio.wait_for(changed.wait(), EVENTS_HEARTBEAT_INTERVAL)
+                    except asyncio.TimeoutError:
+                        yield ": heartbeat\n\n"
+        finally:
+            jobs.unwatch(job_id, notify)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
@@ -0,0 +1,59 @@
+# GET /metrics: request, libvirt and hot-path instrumentation plus executor and inventory
+# gauges in Prometheus text exposition format.
+from fastapi import APIRouter, Response
+
+from domain_xml import cache_stats as domain_xml_cache_stats
+from instrumentation import PROMETHEUS_CONTENT_TYPE, registry
+from inventory import inventory
+from libvirt_executor import libvirt_executor
+from metrics import metrics
+
+router = APIRouter()
+
+
+def _executor_samples():
+    stats = libvirt_executor.stats()
+    out = []
+    for metric, kind, help, key in (
+        ("vmui_libvirt_lane_queued", "gauge", "Calls waiting for a libvirt worker.", "queued"),
+        ("vmui_libvirt_lane_running", "gauge", "Calls running on libvirt workers.", "running"),
+        ("vmui_libvirt_lane_completed_total", "counter", "Calls completed per lane.", "completed"),
+        ("vmui_libvirt_lane_failed_total", "counter", "Calls that raised per lane.", "failed"),
+        ("vmui_libvirt_lane_timeouts_total", "counter", "Calls that exceeded their timeout per lane.", "timed_out"),
+        ("vmui_libvirt_lane_wait_seconds_max", "gauge", "Longest queue wait seen per lane.", "wait_seconds_max"),
+    ):
+        out.append((metric, kind, help, [({"lane": lane}, s[key]) for lane, s in stats.items()]))
+    return out
+
+
+def _inventory_samples():
+    hosts = inventory.host_status()
+    xml_cache = domain_xml_cache_stats()
+    return [
+        ("vmui_inventory_domains", "gauge", "Domains known per host.",
+         [({"host": h}, s["domains"]) for h, s in hosts.items()]),
+        ("vmui_inventory_synced", "gauge", "1 if the host's last resync succeeded.",
+         [({"host": h}, int(s["synced_at"] is not None and s["error"] is None)) for h, s in hosts.items()]),
+        ("vmui_inventory_last_sync_timestamp_seconds", "gauge", "Time of the host's last successful resync.",
+         [({"host": h}, s["synced_at"]) for h, s in hosts.items()]),
+        ("vmui_domain_xml_cache_hits_total", "counter", "Domain XML summaries served from the cache.",
+         [({}, xml_cache["hits"])]),
+        ("vmui_domain_xml_cache_misses_total", "counter", "Domain XML documents parsed.",
+         [({}, xml_cache["misses"])]),
+        ("vmui_vm_metrics_sample_duration_seconds", "gauge", "Duration of the last bulk VM stats sample.",
+         [({}, metrics.last_duration)]),
+    ]
+
+
+registry.collector(_executor_samples)
+registry.collector(_inventory_samples)
+
+
+@router.get("/metrics", summary="Prometheus metrics", tags=["sys"], include_in_schema=False)
+def prometheus_metrics():
+    """
+    Per-route request counts and latency histograms, per-method libvirt call latency and
+    errors, hot-path section timings (domain XML parsing, JSON encoding), executor lane
+    and inventory gauges.
+    """
+    return Response(registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
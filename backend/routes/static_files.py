@@ -0,0 +1,41 @@
+# Frontend assets (pages, scripts, styles, the SPICE client) served from memory with
+# precompressed variants, strong ETags and immutable caching for versioned URLs.
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import RedirectResponse
+
+from http_cache import CACHE_HEADERS, etag_matches
+from static_assets import VERSIONED_PREFIX, static_assets
+
+router = APIRouter()
+
+# Versioned URLs change whenever any asset does, so they never need revalidating.
+IMMUTABLE_HEADERS = {"Cache-Control": "public, max-age=31536000, immutable"}
+_ENCODING_SUFFIX = {"br": "-br", "gzip": "-gz", None: ""}
+
+
+@router.get("/", include_in_schema=False)
+def index():
+    return RedirectResponse("/main_page.html")
+
+
+@router.api_route("/{path:path}", methods=["GET", "HEAD"], include_in_schema=False)
+def static_file(path: str, request: Request):
+    versioned = False
+    parts = path.split("/", 2)
+    if len(parts) == 3 and parts[0] == VERSIONED_PREFIX:
+        # Only the current version is immutable; a page from before a change still loads,
+        # it just revalidates.
+        versioned = parts[1] == static_assets.version
+        path = parts[2]
+    asset = static_assets.get(path)
+    if asset is None:
+        raise HTTPException(404, "Not found")
+
+    body, encoding = asset.representation(request.headers.get("accept-encoding", ""))
+    etag = f'"{asset.etag}{_ENCODING_SUFFIX[encoding]}"'
+    headers = {"ETag": etag, "Vary": "Accept-Encoding", **(IMMUTABLE_HEADERS if versioned else CACHE_HEADERS)}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type=asset.content_type, headers=headers)
@@ -0,0 +1,38 @@
+# Endpoints for golden-image templates that VMs can be cloned from.
+import asyncio
+
+from fastapi import APIRouter, HTTPException
+
+from golden_images import TemplateConflict, TemplateError, golden_images
+from schemas_local import TemplateRegisterRequest
+
+router = APIRouter()
+
+
+@router.get("/", summary="List golden-image templates", tags=["templates"])
+async def list_templates():
+    return {"templates": await asyncio.to_thread(golden_images.list_templates)}
+
+
+@router.post("/", summary="Register an image as a golden template", tags=["templates"])
+async def register_template(req: TemplateRegisterRequest):
+    """
+    Register `image` (a file in the VM image directory) as template `name`. The image is
+    made read-only and `warm_pool` overlays are pre-created for it in the background.
+    A name already registered for a different image is rejected with 409.
+    """
+    try:
+        return await asyncio.to_thread(golden_images.register, req.name, req.image, req.warm_pool)
+    except TemplateConflict as e:
+        raise HTTPException(409, str(e))
+    except TemplateError as e:
+        raise HTTPException(400, str(e))
+
+
+@router.delete("/{name}", summary="Unregister a template", tags=["templates"])
+async def unregister_template(name: str):
+    try:
+        await asyncio.to_thread(golden_images.unregister, name)
+    except TemplateError as e:
+        raise HTTPException(404, str(e))
+    return {"message": f"Template '{name}' unregistered"}
@@ -0,0 +1,135 @@
+# Bulk endpoints: apply start/stop/kill/reboot, or per-VM edits, to many VMs concurrently.
+import asyncio
+import fnmatch
+import json
+import logging
+
+import libvirt
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+
+from config import LIBVIRT_BULK_WORKERS, BULK_DEFAULT_PARALLELISM
+from inventory import inventory
+from libvirt_executor import libvirt_executor
+from routes.vms_control import ACTIONS
+from routes.vms_edit import apply_edit
+from schemas_local import VMBulkRequest, VMBulkEditRequest, VMEditRequest
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# Strong references to running per-VM tasks, so a batch keeps going after its client left.
+_inflight: set[asyncio.Task] = set()
+
+
+def _resolve_targets(req: VMBulkRequest) -> list[str]:
+    """Expand explicit names, the glob pattern and the status filter into a de-duplicated name list."""
+    names = list(dict.fromkeys(req.names or []))
+    if req.pattern:
+        known = [vm["name"] for vm in inventory.listing()]
+        names.extend(n for n in fnmatch.filter(known, req.pattern) if n not in names)
+    if req.status:
+        wanted = req.status.lower()
+        names = [
+            n for n in names
+            if (vm := inventory.get(n)) is not None and (vm["status"] or "").lower() == wanted
+        ]
+    return names
+
+
+async def _run_one(fn, name: str, gate: asyncio.Semaphore, *args) -> dict:
+    async with gate:
+        try:
+            result = await libvirt_executor.bulk(fn, name, *args, for_vm=name)
+            return {"name": name, "ok": True, "status_code": 200, "message": result.get("message")}
+        except HTTPException as e:
+            return {"name": name, "ok": False, "status_code": e.status_code, "message": e.detail}
+        # Anything else fails this VM only: one raising task would make gather() drop every
+        # result, and end a streamed response without its summary line.
+        except libvirt.libvirtError as e:
+            return {"name": name, "ok": False, "status_code": 500, "message": f"Libvirt error: {e}"}
+        except Exception as e:
+            logger.exception("Bulk operation on %s failed", name)
+            return {"name": name, "ok": False, "status_code": 500, "message": str(e) or type(e).__name__}
+
+
+def _launch(calls: list[tuple], parallelism: int | None) -> list[asyncio.Task]:
+    """Start `_run_one(fn, name, gate, *args)` for each (fn, name, *args), `parallelism` at a time."""
+    limit = max(1, min(parallelism or BULK_DEFAULT_PARALLELISM, LIBVIRT_BULK_WORKERS))
+    gate = asyncio.Semaphore(limit)
+    tasks = [asyncio.ensure_future(_run_one(fn, name, gate, *args)) for fn, name, *args in calls]
+    for task in tasks:
+        _inflight.add(task)
+        task.add_done_callback(_inflight.discard)
+    return tasks
+
+
+async def _respond(tasks: list[asyncio.Task], action: str, stream: bool):
+    """Stream per-VM results as NDJSON followed by a summary line, or return them all at once."""
+
+    def summary(results: list[dict]) -> dict:
+        succeeded = sum(1 for r in results if r["ok"])
+        return {
+            "done": True,
+            "action": action,
+            "total": len(results),
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded,
+        }
+
+    if not stream:
+        results = list(await asyncio.gather(*tasks))
+        return {**summary(results), "results": results}
+
+    async def progress():
+        results = []
+        for next_done in asyncio.as_completed(tasks):
+            result = await next_done
+            results.append(result)
+            yield json.dumps(result) + "\n"
+        yield json.dumps(summary(results)) + "\n"
+
+    return StreamingResponse(progress(), media_type="application/x-ndjson")
+
+
+@router.post("/bulk", summary="Apply a lifecycle action to many VMs", tags=["vms"])
+async def bulk_action(req: VMBulkRequest, stream: bool = True):
+    """
+    Run `action` against every target VM, at most `parallelism` at a time.
+
+    By default the response is streamed as NDJSON: one line per VM as soon as its action
+    finishes ({"name", "ok", "status_code", "message"}), then a final {"done": true, ...}
+    summary line, so large batches never sit silent long enough to hit proxy timeouts.
+    With `?stream=false` a single JSON object with all results is returned instead.
+    Operations already started keep running if the client disconnects.
+    """
+    if not req.names and not req.pattern:
+        raise HTTPException(400, "Specify 'names' and/or 'pattern'")
+    if not inventory.available(0) and not await asyncio.to_thread(inventory.available, 10):
+        raise HTTPException(503, "VM inventory is not available yet")
+
+    targets = _resolve_targets(req)
+    action = ACTIONS[req.action]
+    tasks = _launch([(action, name) for name in targets], req.parallelism)
+    return await _respond(tasks, req.action, stream)
+
+
+@router.post("/bulk/edit", summary="Edit many VMs at once", tags=["vms"])
+async def bulk_edit(req: VMBulkEditRequest, stream: bool = True):
+    """
+    Apply per-VM edits ({"edits": [{"name": ..., "memory_mb": ..., "vcpus": ...}, ...]}),
+    each committed the same way as POST /vms/edit/{name}. Results are reported like POST
+    /vms/bulk, with "action": "edit".
+    """
+    names = [item.name for item in req.edits]
+    if not names:
+        raise HTTPException(400, "Specify at least one edit")
+    if len(set(names)) != len(names):
+        raise HTTPException(400, "Each VM may appear only once in 'edits'")
+
+    calls = [
+        (apply_edit, item.name, VMEditRequest(**item.model_dump(exclude={"name"})))
+        for item in req.edits
+    ]
+    return await _respond(_launch(calls, req.parallelism), "edit", stream)
@@ -0,0 +1,24 @@
+# SPICE console over WebSocket: /vms/{vm_name}/console relays to the VM's SPICE port.
+from fastapi import APIRouter, WebSocket
+from typing import Optional
+
+from console_proxy import relay
+
+router = APIRouter()
+
+
+@router.websocket("/{vm_name}/console")
+async def vm_console(
+    websocket: WebSocket,
+    vm_name: str,
+    user: Optional[str] = None,
+    decode: Optional[str] = None,
+    capture: bool = False,
+):
+    # ?decode=server has the backend decode LZ images for this connection (spice_decode.py);
+    # ?capture=1 records its traffic for replay_console.py (console_capture.py), if the server
+    # allows it (CONSOLE_CAPTURE_ENABLED) and the capture quotas are not exhausted.
+    # Closes with 4404 when the VM is unknown or has no SPICE port, 1011 when it is unreachable
+    # or the connection fails mid-session, 4408 when the session manager ends the session
+    # (idle, kicked, too slow).
+    await relay.serve(websocket, vm_name, user, decode, capture)
@@ -2,101 +2,107 @@
 from fastapi import APIRouter, HTTPException
 import libvirt
 
-from libvirt_utils import get_libvirt_conn
+from libvirt_executor import libvirt_executor
+from inventory import inventory
 
 router = APIRouter()
 
-@router.post("/start/{vm_name}")
-def start_vm(vm_name: str):
-    # Start a VM by name. Returns 404 if not found, 500 on libvirt errors.
-    conn = get_libvirt_conn()
+
+def _lookup(conn, vm_name: str):
     try:
-        dom = conn.lookupByName(vm_name)
+        return conn.lookupByName(vm_name)
     except libvirt.libvirtError:
-        conn.close()
         raise HTTPException(404, f"VM '{vm_name}' not found")
 
+
+def _start(conn, vm_name: str) -> dict:
+    # Start a VM by name. Returns 404 if not found, 500 on libvirt errors.
+    dom = _lookup(conn, vm_name)
+
     state, _ = dom.state()
     if state == 1:
-        conn.close()
         return {"message": "VM already running"}
 
     try:
         dom.create()
-        conn.close()
+        inventory.invalidate(vm_name)
         return {"message": "VM started"}
     except libvirt.libvirtError as e:
-        conn.close()
         raise HTTPException(500, f"Failed to start VM: {e}")
 
 
-@router.post("/stop/{vm_name}")
-def stop_vm(vm_name: str):
+def _stop(conn, vm_name: str) -> dict:
     # Gracefully shutdown a VM. If already stopped, return a message.
-    conn = get_libvirt_conn()
-    try:
-        dom = conn.lookupByName(vm_name)
-    except libvirt.libvirtError:
-        conn.close()
-        raise HTTPException(404, f"VM '{vm_name}' not found")
+    dom = _lookup(conn, vm_name)
 
     state, _ = dom.state()
     if state in (4, 5):
-        conn.close()
         return {"message": "VM already stopped"}
 
     try:
         dom.shutdown()
-        conn.close()
+        inventory.invalidate(vm_name)
         return {"message": "Shutdown initiated"}
     except libvirt.libvirtError as e:
-        conn.close()
         raise HTTPException(500, f"Failed to stop VM: {e}")
 
 
-@router.post("/kill/{vm_name}")
-def kill_vm(vm_name: str):
+def _kill(conn, vm_name: str) -> dict:
     # Force-stop a VM (equivalent to pulling power). Use with caution.
-    conn = get_libvirt_conn()
-    try:
-        dom = conn.lookupByName(vm_name)
-    except libvirt.libvirtError:
-        conn.close()
-        raise HTTPException(404, f"VM '{vm_name}' not found")
+    dom = _lookup(conn, vm_name)
 
     state, _ = dom.state()
     if state in (4, 5):
-        conn.close()
         return {"message": "VM already stopped"}
 
     try:
         dom.destroy()
-        conn.close()
+        inventory.invalidate(vm_name)
         return {"message": "Force stopped"}
     except libvirt.libvirtError as e:
-        conn.close()
         raise HTTPException(500, f"Failed to kill VM: {e}")
 
 
-@router.post("/reboot/{vm_name}")
-def reboot_vm(vm_name: str):
+def _reboot(conn, vm_name: str) -> dict:
     # Reboot a running VM. If VM is stopped, reports that it's stopped.
-    conn = get_libvirt_conn()
-    try:
-        dom = conn.lookupByName(vm_name)
-    except libvirt.libvirtError:
-        conn.close()
-        raise HTTPException(404, f"VM '{vm_name}' not found")
+    dom = _lookup(conn, vm_name)
 
     state, _ = dom.state()
     if state in (4, 5):
-        conn.close()
         return {"message": "VM is stopped"}
 
     try:
         dom.reboot()
-        conn.close()
+        inventory.invalidate(vm_name)
         return {"message": "Reboot initiated"}
     except libvirt.libvirtError as e:
-        conn.close()
         raise HTTPException(500, f"Failed to reboot VM: {e}")
+
+
+# Lifecycle actions by name, shared with the bulk endpoint.
+ACTIONS = {
+    "start": _start,
+    "stop": _stop,
+    "kill": _kill,
+    "reboot": _reboot,
+}
+
+
+@router.post("/start/{vm_name}")
+async def start_vm(vm_name: str):
+    return await libvirt_executor.mutate(_start, vm_name, for_vm=vm_name)
+
+
+@router.post("/stop/{vm_name}")
+async def stop_vm(vm_name: str):
+    return await libvirt_executor.mutate(_stop, vm_name, for_vm=vm_name)
+
+
+@router.post("/kill/{vm_name}")
+async def kill_vm(vm_name: str):
+    return await libvirt_executor.mutate(_kill, vm_name, for_vm=vm_name)
+
+
+@router.post("/reboot/{vm_name}")
+async def reboot_vm(vm_name: str):
+    return await libvirt_executor.mutate(_reboot, vm_name, for_vm=vm_name)
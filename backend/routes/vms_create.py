@@ -1,78 +1,268 @@
+# VM creation runs as a background job: POST /vms/create queues it and returns the job id,
+# and a job worker creates the disk, defines the domain and starts it.
 from fastapi import APIRouter, HTTPException
+import asyncio
 import os
-import subprocess
 import libvirt
 
-from libvirt_utils import get_libvirt_conn
+from libvirt_executor import libvirt_executor
+from libvirt_utils import get_pool
+from inventory import image_pool, inventory
+from jobs import JobCancelled, JobFailed, jobs
+from capacity import CapacityError, capacity
+from scheduler import is_local, scheduler
+from golden_images import TemplateError, golden_images
+from domain_builder import DomainXMLError, build_domain_xml, hugepages_available
 from schemas_local import VMCreateRequest
-from config import VM_IMAGE_DIR
+from config import (
+    VM_IMAGE_DIR,
+    DEFAULT_HOST,
+    LIBVIRT_HOSTS,
+    VM_DEFAULT_PROFILE,
+    VM_MACHINE_TYPE,
+    VM_NETWORK,
+    VM_HUGEPAGES,
+    VM_SHARED_STORAGE,
+)
 
 router = APIRouter()
 
-@router.post("/create")
-def create_vm(vm: VMCreateRequest):
-    conn = get_libvirt_conn()
+# Serializes the duplicate-name check against submitting, so two requests for one name
+# cannot both queue a job.
+_submit_lock = asyncio.Lock()
 
+
+def _disk_path(vm: VMCreateRequest) -> str:
+    return os.path.join(VM_IMAGE_DIR, f"{vm.name}.qcow2")
+
+
+def _domain_xml(vm: VMCreateRequest, disk_path: str) -> str:
+    """The validated definition for `vm`; raises DomainXMLError for invalid parameters."""
+    host = vm.host or DEFAULT_HOST
+    # Free huge pages can only be checked on the machine this backend runs on.
+    hugepages = VM_HUGEPAGES == "always" or (
+        VM_HUGEPAGES == "auto" and is_local(host) and hugepages_available(vm.memory_mb)
+    )
+    return build_domain_xml(
+        vm.name,
+        vm.memory_mb,
+        vm.vcpus,
+        disk_path,
+        iso_path=vm.iso_path,
+        profile=vm.profile or VM_DEFAULT_PROFILE,
+        machine=vm.machine or VM_MACHINE_TYPE,
+        network=vm.network or VM_NETWORK,
+        disk_bus=vm.disk_bus,
+        hugepages=hugepages,
+    )
+
+
+def _pool_storage(host: str) -> bool:
+    """Whether disks for `host` must be created through its storage pool (see VM_SHARED_STORAGE)."""
+    return not VM_SHARED_STORAGE and not is_local(host)
+
+
+def _create_volume(conn, vm: VMCreateRequest):
+    """A blank qcow2 volume for `vm` in the host's image storage pool."""
+    storage_pool = image_pool(conn)
+    if storage_pool is None:
+        raise JobFailed(f"Host has no active storage pool with target {VM_IMAGE_DIR}")
+    name = f"{vm.name}.qcow2"
     try:
-        _ = conn.lookupByName(vm.name)
-        conn.close()
-        raise HTTPException(400, f"VM '{vm.name}' already exists")
+        storage_pool.storageVolLookupByName(name)
     except libvirt.libvirtError:
         pass
+    else:
+        raise JobFailed(f"Disk image already exists: {name}")
+    xml = (
+        f"<volume><name>{name}</name><capacity unit='G'>{vm.disk_gb}</capacity>"
+        "<target><format type='qcow2'/></target></volume>"
+    )
+    try:
+        return storage_pool.createXML(xml, 0)
+    except libvirt.libvirtError as e:
+        raise JobFailed(f"Failed to create disk volume: {e}")
+
 
-    disk_path = os.path.join(VM_IMAGE_DIR, f"{vm.name}.qcow2")
+def _require_absent(conn, vm_name: str) -> None:
+    # VM names are unique across the cluster, since every other route addresses VMs by name.
+    if inventory.get(vm_name) is not None:
+        raise HTTPException(400, f"VM '{vm_name}' already exists")
     try:
-        subprocess.run(
-            ["qemu-img", "create", "-f", "qcow2", disk_path, f"{vm.disk_gb}G"],
-            check=True
-        )
-    except Exception as e:
-        conn.close()
-        raise HTTPException(500, f"Failed to create disk: {e}")
-
-    iso_section = (
-        f"<disk type='file' device='cdrom'><driver name='qemu' type='raw'/><source file='{vm.iso_path}'/><target dev='sda' bus='sata'/></disk>"
-        if vm.iso_path
-        else ""
-    )
+        conn.lookupByName(vm_name)
+    except libvirt.libvirtError:
+        return
+    raise HTTPException(400, f"VM '{vm_name}' already exists")
 
-    boot_type = "<boot dev='cdrom'/>" if vm.iso_path else "<boot dev='hd'/>"
-
-    xml = f"""
-<domain type='kvm'>
-  <name>{vm.name}</name>
-  <memory unit='MiB'>{vm.memory_mb}</memory>
-  <vcpu>{vm.vcpus}</vcpu>
-  <os>
-    <type arch='x86_64' machine='pc'>hvm</type>
-    {boot_type}
-  </os>
-  <devices>
-    <disk type='file' device='disk'>
-      <driver name='qemu' type='qcow2'/>
-      <source file='{disk_path}'/>
-      <target dev='vda' bus='virtio'/>
-    </disk>
-    {iso_section}
-    <interface type='network'>
-      <source network='default'/>
-      <model type='virtio'/>
-    </interface>
-    <graphics type='spice' autoport='yes'/>
-  </devices>
-</domain>
-"""
 
+def _run_create_job(ctx, params: dict) -> dict:
+    """Job runner for "create_vm": disk image, then define, then start, with cleanup on failure."""
+    vm = VMCreateRequest(**params)
+    host = vm.host or DEFAULT_HOST
+    disk_path = _disk_path(vm)
+    reserved = False
+    disk_created = False
+    volume = None
+    clone_source = None
+    domain = None
     try:
-        domain = conn.defineXML(xml)
-        if domain is None:
-            conn.close()
-            raise HTTPException(500, "Failed to define VM")
+        ctx.stage("reserving capacity", 5)
+        try:
+            if vm.wait_for_capacity:
+                capacity.wait_admit(vm.name, vm.vcpus, vm.memory_mb, lambda: ctx.cancelled, host=host)
+            else:
+                capacity.admit(vm.name, vm.vcpus, vm.memory_mb, host=host)
+            reserved = True
+        except CapacityError as e:
+            if ctx.cancelled:
+                raise JobCancelled()
+            raise JobFailed(str(e))
 
-        domain.create()
-    except libvirt.libvirtError as e:
-        conn.close()
-        raise HTTPException(500, f"Libvirt error: {e}")
+        if vm.template:
+            ctx.stage("cloning template", 10)
+            if os.path.exists(disk_path):
+                raise JobFailed(f"Disk image already exists: {disk_path}")
+            disk_created = True
+            try:
+                clone_source = golden_images.provision(vm.template, disk_path, vm.disk_gb, ctx.run)
+            except TemplateError as e:
+                raise JobFailed(str(e))
+        elif _pool_storage(host):
+            # The disk must exist on the remote host itself, not in this machine's VM_IMAGE_DIR.
+            ctx.stage("creating disk", 10)
+            with get_pool(host).connection() as conn:
+                volume = _create_volume(conn, vm)
+                disk_path = volume.path()
+        else:
+            ctx.stage("creating disk", 10)
+            # Never run qemu-img over an existing file: it would wipe another VM's disk.
+            if os.path.exists(disk_path):
+                raise JobFailed(f"Disk image already exists: {disk_path}")
+            disk_created = True
+            ctx.run(["qemu-img", "create", "-f", "qcow2", disk_path, f"{vm.disk_gb}G"])
+
+        ctx.stage("defining domain", 70)
+        with get_pool(host).connection() as conn:
+            try:
+                _require_absent(conn, vm.name)
+            except HTTPException as e:
+                raise JobFailed(e.detail)
+            try:
+                domain = conn.defineXMLFlags(_domain_xml(vm, disk_path), libvirt.VIR_DOMAIN_DEFINE_VALIDATE)
+                if domain is None:
+                    raise JobFailed("Failed to define VM")
+                ctx.stage("starting domain", 85)
+                domain.create()
+            except DomainXMLError as e:
+                raise JobFailed(str(e))
+            except libvirt.libvirtError as e:
+                raise JobFailed(f"Libvirt error: {e}")
+    except BaseException:
+        # Roll back what this job created so a failed or cancelled create leaves nothing behind.
+        if reserved:
+            capacity.release(vm.name)
+        if domain is not None:
+            try:
+                domain.undefine()
+            except libvirt.libvirtError:
+                pass
+        if disk_created:
+            try:
+                os.remove(disk_path)
+            except OSError:
+                pass
+        if volume is not None:
+            try:
+                volume.delete(0)
+            except libvirt.libvirtError:
+                pass
+        raise
+    finally:
+        inventory.invalidate(vm.name, host)
+
+    capacity.commit(vm.name, active=True)
+    result = {"message": f"VM '{vm.name}' created and started", "disk_path": disk_path, "host": host}
+    if vm.template:
+        # "warm" if a pre-created overlay was used, "cold" if one had to be created now.
+        result.update(template=vm.template, clone=clone_source)
+    return result
+
+
+jobs.register("create_vm", _run_create_job)
 
-    conn.close()
-    return {"message": f"VM '{vm.name}' created and started", "disk_path": disk_path}
+
+@router.post("/create", status_code=202)
+async def create_vm(vm: VMCreateRequest):
+    """
+    Queue creation of a VM and return immediately with the job that performs it.
+    The definition comes from the `profile` template (server, desktop or minimal) with
+    performance defaults applied; see domain_builder.py.
+    With `template`, the disk is a copy-on-write clone of that golden image (taken from
+    the warm pool when one is ready) instead of a blank image.
+    Poll GET /jobs/{job_id} or stream GET /jobs/{job_id}/events for progress;
+    DELETE /jobs/{job_id} cancels it.
+
+    Requests that would exceed the host's overcommit limits are rejected with 409, or with
+    `wait_for_capacity` queued until enough capacity is free. A create for a name that
+    already has a queued or running create job is rejected with 409.
+
+    Without `host`, and with more than one managed host, the scheduler picks one using
+    `policy` ("spread" or "binpack"; SCHEDULER_POLICY by default). The chosen host is in
+    the response and the decision in GET /sys/scheduler.
+
+    On remote hosts the disk is created in the host's storage pool at VM_IMAGE_DIR, and
+    templates need VM_SHARED_STORAGE, since golden images live on this machine.
+    """
+    if vm.host is not None and vm.host not in LIBVIRT_HOSTS:
+        raise HTTPException(400, f"Unknown host '{vm.host}'")
+    try:
+        # Validates the name (also used for the disk file), paths, profile and sizes up front.
+        _domain_xml(vm, _disk_path(vm))
+    except DomainXMLError as e:
+        raise HTTPException(400, str(e))
+    if vm.template is None and not vm.disk_gb:
+        raise HTTPException(400, "disk_gb is required when no template is given")
+    if vm.template is not None:
+        try:
+            golden_images.get(vm.template)
+        except TemplateError as e:
+            raise HTTPException(400, str(e))
+    if vm.host is None and len(LIBVIRT_HOSTS) > 1:
+        try:
+            vm.host = scheduler.place(
+                vm.name,
+                vm.vcpus,
+                vm.memory_mb,
+                vm.disk_gb,
+                vm.policy,
+                require_fit=not vm.wait_for_capacity,
+                template=vm.template is not None,
+            )
+        except ValueError as e:
+            raise HTTPException(400, str(e))
+        except CapacityError as e:
+            raise HTTPException(409, str(e))
+    if vm.template is not None and _pool_storage(vm.host or DEFAULT_HOST):
+        raise HTTPException(
+            400, f"Templates need shared storage (VM_SHARED_STORAGE) on remote host '{vm.host or DEFAULT_HOST}'"
+        )
+    await libvirt_executor.read(_require_absent, vm.name, host=vm.host)
+    if not vm.wait_for_capacity:
+        # Early 409 only: the job takes the reservation itself, so a job cancelled while
+        # queued (or never submitted) cannot leave one behind. Concurrent creates that both
+        # pass here are still kept from overshooting by the job's admit().
+        try:
+            capacity.check(vm.name, vm.vcpus, vm.memory_mb, host=vm.host or DEFAULT_HOST)
+        except CapacityError as e:
+            raise HTTPException(409, str(e))
+    async with _submit_lock:
+        pending = await asyncio.to_thread(jobs.active, "create_vm")
+        if any(job["params"].get("name") == vm.name for job in pending):
+            raise HTTPException(409, f"VM '{vm.name}' is already being created")
+        job = await asyncio.to_thread(jobs.submit, "create_vm", vm.model_dump())
+    return {
+        "message": f"Creation of VM '{vm.name}' queued",
+        "host": vm.host or DEFAULT_HOST,
+        "job_id": job["id"],
+        "job": job,
+    }
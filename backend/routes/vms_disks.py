@@ -1,44 +1,32 @@
 from fastapi import APIRouter, HTTPException
-import os
-import libvirt
+import asyncio
 
-from libvirt_utils import get_libvirt_conn
-from config import VM_IMAGE_DIR
+from inventory import inventory
+from image_catalog import catalog
 
 router = APIRouter()
 
 
 @router.get("/{vm_name}/disks", summary="List disk image paths for a VM", tags=["vms"])
-def get_vm_disks(vm_name: str):
+async def get_vm_disks(vm_name: str):
     """
-    Return a JSON object { "disks": ["/path/to/disk1.qcow2", ...] } by listing qcow2 files
-    from the configured VM_IMAGE_DIR. The endpoint still verifies that the VM exists,
-    but it does not accept arbitrary paths from the client.
+    Return { "disks": ["/path/to/disk1.qcow2", ...], "attached": [...] }. `disks` lists the
+    qcow2 images in VM_IMAGE_DIR that can be picked for the VM; `attached` holds catalog
+    metadata for the images the domain actually references. Both come from the in-memory
+    image catalog and inventory, so no directory listing or libvirt call happens here.
     """
-    conn = get_libvirt_conn()
-    try:
-        try:
-            # verify VM exists; return 404 if not
-            conn.lookupByName(vm_name)
-        except libvirt.libvirtError:
-            raise HTTPException(status_code=404, detail=f"VM '{vm_name}' not found")
+    if not inventory.available(0) and not await asyncio.to_thread(inventory.available, 10):
+        raise HTTPException(status_code=503, detail="VM inventory is not ready yet")
+    vm = inventory.get(vm_name)
+    if vm is None:
+        raise HTTPException(status_code=404, detail=f"VM '{vm_name}' not found")
+    if not catalog.wait_ready(0) and not await asyncio.to_thread(catalog.wait_ready, 10):
+        raise HTTPException(status_code=503, detail="Image catalog is not ready yet")
+    if catalog.error:
+        raise HTTPException(status_code=500, detail=catalog.error)
 
-        try:
-            # List qcow2 images in the configured directory
-            images = []
-            # Ensure directory exists and is readable
-            for fname in sorted(os.listdir(VM_IMAGE_DIR)):
-                if fname and fname.lower().endswith(".qcow2"):
-                    images.append(os.path.join(VM_IMAGE_DIR, fname))
-            return {"disks": images}
-        except FileNotFoundError:
-            raise HTTPException(status_code=500, detail=f"Image directory not found: {VM_IMAGE_DIR}")
-        except PermissionError:
-            raise HTTPException(status_code=500, detail=f"Permission denied reading image directory: {VM_IMAGE_DIR}")
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Failed to read images: {e}")
-    finally:
-        try:
-            conn.close()
-        except Exception:
-            pass
+    attached = []
+    for path in vm.get("disks") or ():
+        info = catalog.describe(path)
+        attached.append(info if info is not None else {"path": path, "in_catalog": False})
+    return {"disks": catalog.paths("qcow2"), "attached": attached}
@@ -3,112 +3,133 @@ from fastapi import APIRouter, HTTPException
 import xml.etree.ElementTree as ET
 import libvirt
 
-from libvirt_utils import get_libvirt_conn
+from libvirt_executor import libvirt_executor
+from inventory import inventory
+from capacity import CapacityError, capacity
 from schemas_local import VMEditRequest
 
 router = APIRouter()
 
-@router.post("/edit/{vm_name}")
-def edit_vm(vm_name: str, changes: VMEditRequest):
-    # Apply requested changes. If the domain is running, attempt live updates;
-    # otherwise update the domain XML so changes take effect on next boot.
-    conn = get_libvirt_conn()
+_LIVE_AND_CONFIG = libvirt.VIR_DOMAIN_AFFECT_LIVE | libvirt.VIR_DOMAIN_AFFECT_CONFIG
+
+
+def _set_kib(root: ET.Element, tag: str, kib: int) -> None:
+    # Use KiB units in XML to avoid unit mismatch confusion.
+    elem = root.find(tag)
+    if elem is None:
+        elem = ET.SubElement(root, tag)
+    elem.text = str(kib)
+    elem.set("unit", "KiB")
+
+
+def _memory_xml(root: ET.Element, memory_mb: int) -> str:
+    _set_kib(root, "memory", memory_mb * 1024)
+    _set_kib(root, "currentMemory", memory_mb * 1024)
+    return f"Memory set to {memory_mb} MB (next boot)"
+
+
+def _memory_live(domain, memory_mb: int) -> str:
+    new_kib = memory_mb * 1024
+    try:
+        current_max_kib = domain.maxMemory()
+    except libvirt.libvirtError:
+        current_max_kib = None
+    if current_max_kib is not None and new_kib <= int(current_max_kib):
+        domain.setMemoryFlags(new_kib, _LIVE_AND_CONFIG)
+        return f"Memory changed live to {memory_mb} MB"
+    # The balloon cannot grow past the boot-time maximum, so raise it for the next boot.
+    domain.setMemoryFlags(new_kib, libvirt.VIR_DOMAIN_AFFECT_CONFIG | libvirt.VIR_DOMAIN_MEM_MAXIMUM)
+    domain.setMemoryFlags(new_kib, libvirt.VIR_DOMAIN_AFFECT_CONFIG)
+    return f"Memory set to {memory_mb} MB (next boot; exceeds the running maximum)"
+
+
+def _vcpus_xml(root: ET.Element, vcpus: int) -> str:
+    vcpu = root.find("vcpu")
+    if vcpu is None:
+        vcpu = ET.SubElement(root, "vcpu")
+    vcpu.text = str(vcpus)
+    # A stale `current` larger than the new maximum would make the definition invalid.
+    vcpu.attrib.pop("current", None)
+    return f"vCPUs set to {vcpus} (next boot)"
+
+
+def _vcpus_live(domain, vcpus: int) -> str:
+    max_vcpus = domain.vcpusFlags(libvirt.VIR_DOMAIN_AFFECT_LIVE | libvirt.VIR_DOMAIN_VCPU_MAXIMUM)
+    if vcpus <= max_vcpus:
+        domain.setVcpusFlags(vcpus, _LIVE_AND_CONFIG)
+        return f"vCPUs changed live to {vcpus}"
+    domain.setVcpusFlags(vcpus, libvirt.VIR_DOMAIN_AFFECT_CONFIG | libvirt.VIR_DOMAIN_VCPU_MAXIMUM)
+    domain.setVcpusFlags(vcpus, libvirt.VIR_DOMAIN_AFFECT_CONFIG)
+    return f"vCPUs set to {vcpus} (next boot; exceeds the running maximum)"
+
+
+# Editable fields, applied in this order. Each maps to (edit the persistent XML document,
+# change a running domain via LIVE|CONFIG flags). Fields whose live editor is None are
+# written to the persistent definition only, even when the VM is running.
+EDITORS = {
+    "memory_mb": (_memory_xml, _memory_live),
+    "vcpus": (_vcpus_xml, _vcpus_live),
+}
+
+
+def apply_edit(conn, vm_name: str, changes: VMEditRequest) -> dict:
+    """
+    Apply all requested changes to one VM.
+
+    On a running VM, fields that can change live are applied with LIVE|CONFIG so the
+    running guest and the persistent definition stay in step. Everything else is edited
+    into a single parse of the inactive XML and committed with one defineXML, which
+    updates the definition in place; the domain is never undefined.
+    """
+    requested = changes.model_dump(exclude_none=True)
+    if not requested:
+        raise HTTPException(400, "No changes requested")
+    for field, value in requested.items():
+        if isinstance(value, int) and value <= 0:
+            raise HTTPException(400, f"'{field}' must be positive")
+
     try:
         domain = conn.lookupByName(vm_name)
     except libvirt.libvirtError:
-        conn.close()
         raise HTTPException(404, f"VM '{vm_name}' not found")
 
-    state, _ = domain.state()
-    messages = []
-
-    if changes.memory_mb is not None:
-        try:
-            # convert MB -> KiB for libvirt APIs / XML
-            new_kib = int(changes.memory_mb) * 1024
-
-            # If running, ensure max memory is large enough, then set live memory.
-            if state == 1:
-                # determine current max memory (KiB). Prefer maxMemory() if available.
-                try:
-                    current_max_kib = domain.maxMemory()
-                except Exception:
-                    info = domain.info()
-                    current_max_kib = info[1] if info and len(info) > 1 else None
-
-                # If new memory exceeds current max, raise max first.
-                if current_max_kib is None or new_kib > int(current_max_kib):
-                    try:
-                        domain.setMaxMemory(new_kib)
-                        messages.append(f"Max memory increased to {changes.memory_mb} MB")
-                    except libvirt.libvirtError as e:
-                        conn.close()
-                        raise HTTPException(500, f"Failed to increase max memory: {e}")
-
-                # Now set current memory (value in KiB)
-                try:
-                    domain.setMemory(new_kib)
-                    messages.append(f"Memory changed live to {changes.memory_mb} MB")
-                except libvirt.libvirtError as e:
-                    conn.close()
-                    raise HTTPException(500, f"Failed to change memory: {e}")
+    try:
+        capacity.admit(vm_name, requested.get("vcpus"), requested.get("memory_mb"))
+    except CapacityError as e:
+        raise HTTPException(409, str(e))
 
+    messages = []
+    pending = []
+    try:
+        running = domain.isActive()
+        for field, (edit_xml, edit_live) in EDITORS.items():
+            if field not in requested:
+                continue
+            if running and edit_live is not None:
+                messages.append(edit_live(domain, requested[field]))
             else:
-                # Modify XML for persistent change when the VM is not running.
-                xml = domain.XMLDesc()
-                root = ET.fromstring(xml)
-
-                # Use KiB units in XML to avoid unit mismatch confusion.
-                mem_elem = root.find("memory")
-                if mem_elem is None:
-                    mem_elem = ET.SubElement(root, "memory", unit="KiB")
-                mem_elem.text = str(new_kib)
-                mem_elem.set("unit", "KiB")
-
-                cur_elem = root.find("currentMemory")
-                if cur_elem is None:
-                    cur_elem = ET.SubElement(root, "currentMemory", unit="KiB")
-                cur_elem.text = str(new_kib)
-                cur_elem.set("unit", "KiB")
-
-                new_xml = ET.tostring(root).decode()
-                domain.undefine()
-                domain = conn.defineXML(new_xml)
-                if domain is None:
-                    conn.close()
-                    raise HTTPException(500, "Failed to redefine VM after memory change")
-
-                messages.append(f"Memory set to {changes.memory_mb} MB (next boot)")
-        except libvirt.libvirtError as e:
-            conn.close()
-            raise HTTPException(500, f"Failed to change memory: {e}")
-
-    if changes.vcpus is not None:
-        try:
-            # Live change if running, otherwise update XML.
-            if state == 1:
-                domain.setVcpus(changes.vcpus)
-                messages.append(f"vCPUs changed live to {changes.vcpus}")
-            else:
-                xml = domain.XMLDesc()
-                root = ET.fromstring(xml)
-
-                vcpu = root.find("vcpu")
-                if vcpu is None:
-                    vcpu = ET.SubElement(root, "vcpu")
-                vcpu.text = str(changes.vcpus)
-
-                new_xml = ET.tostring(root).decode()
-                domain.undefine()
-                domain = conn.defineXML(new_xml)
-                if domain is None:
-                    conn.close()
-                    raise HTTPException(500, "Failed to redefine VM after vCPU change")
-
-                messages.append(f"vCPUs set to {changes.vcpus} (next boot)")
-        except libvirt.libvirtError as e:
-            conn.close()
-            raise HTTPException(500, f"Failed to change vCPUs: {e}")
-
-    conn.close()
+                pending.append((edit_xml, requested[field]))
+
+        if pending:
+            # Fetched after the live edits, which may have touched the persistent config too.
+            root = ET.fromstring(domain.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE))
+            for edit_xml, value in pending:
+                messages.append(edit_xml(root, value))
+            conn.defineXML(ET.tostring(root, encoding="unicode"))
+    except libvirt.libvirtError as e:
+        capacity.release(vm_name)
+        raise HTTPException(500, f"Failed to update VM: {e}")
+    except BaseException:
+        capacity.release(vm_name)
+        raise
+    finally:
+        inventory.invalidate(vm_name)
+
+    capacity.commit(vm_name)
+
     return {"message": "VM updated successfully", "details": messages}
+
+
+@router.post("/edit/{vm_name}")
+async def edit_vm(vm_name: str, changes: VMEditRequest):
+    return await libvirt_executor.mutate(apply_edit, vm_name, changes, for_vm=vm_name)
@@ -0,0 +1,93 @@
+# Streaming VM state: an initial snapshot followed by inventory deltas, over SSE or WebSocket.
+import asyncio
+import json
+
+from fastapi import APIRouter, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+
+from config import EVENTS_HEARTBEAT_INTERVAL, EVENTS_SEND_TIMEOUT
+from events import RESYNC, hub
+from inventory import inventory
+
+router = APIRouter()
+
+
+async def _next_batch(sub):
+    """Wait up to one heartbeat interval for the next change batch; returns (timed_out, batch)."""
+    try:
+        return False, await asyncio.wait_for(sub.queue.get(), EVENTS_HEARTBEAT_INTERVAL)
+    except asyncio.TimeoutError:
+        return True, None
+
+
+def _sse(event: str, payload: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload, separators=(',', ':'))}\n\n"
+
+
+@router.get("/events", summary="Stream VM changes (Server-Sent Events)", tags=["vms"])
+async def vm_events_sse(request: Request):
+    """
+    Server-Sent Events stream. Sends a `snapshot` event ({"vms": [...]}, same shape as GET /vms)
+    and then `delta` events ({"changes": [...]}) as domains are added, removed or updated.
+    A comment line is sent as a heartbeat when nothing changed for a while. If the client
+    falls behind, pending deltas are discarded and a fresh `snapshot` is sent instead.
+    """
+    if not await asyncio.to_thread(inventory.available, 10):
+        raise HTTPException(503, "VM inventory is not available yet")
+
+    async def stream():
+        # Subscribe before taking the snapshot so no change can slip in between; deltas
+        # that were already reflected in the snapshot are harmless to re-apply.
+        sub = hub.subscribe()
+        try:
+            yield _sse("snapshot", {"vms": inventory.listing()})
+            while not await request.is_disconnected():
+                timed_out, batch = await _next_batch(sub)
+                if timed_out:
+                    yield ": heartbeat\n\n"
+                elif batch is RESYNC:
+                    yield _sse("snapshot", {"vms": inventory.listing()})
+                else:
+                    yield _sse("delta", {"changes": batch})
+        finally:
+            hub.unsubscribe(sub)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.websocket("/events/ws")
+async def vm_events_ws(websocket: WebSocket):
+    # WebSocket variant of /vms/events: JSON messages {"type": "snapshot"|"delta"|"heartbeat", ...}.
+    await websocket.accept()
+    if not await asyncio.to_thread(inventory.available, 10):
+        await websocket.close(code=1013, reason="VM inventory is not available yet")
+        return
+
+    sub = hub.subscribe()
+
+    async def send(message: dict):
+        # A client that cannot take a message within the timeout is dropped rather than buffered.
+        await asyncio.wait_for(websocket.send_json(message), EVENTS_SEND_TIMEOUT)
+
+    try:
+        await send({"type": "snapshot", "vms": inventory.listing()})
+        while True:
+            timed_out, batch = await _next_batch(sub)
+            if timed_out:
+                await send({"type": "heartbeat"})
+            elif batch is RESYNC:
+                await send({"type": "snapshot", "vms": inventory.listing()})
+            else:
+                await send({"type": "delta", "changes": batch})
+    except (WebSocketDisconnect, asyncio.TimeoutError, RuntimeError):
+        pass
+    finally:
+        hub.unsubscribe(sub)
+        try:
+            await websocket.close()
+        except RuntimeError:
+            pass
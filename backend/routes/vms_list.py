@@ -1,63 +1,44 @@
 # Endpoint to list defined VMs with parsed metadata (status, memory, vCPUs, spice port).
-from fastapi import APIRouter
-import xml.etree.ElementTree as ET
+import asyncio
+import threading
 
-from libvirt_utils import get_libvirt_conn
-from config import STATE_NAMES
+from fastapi import APIRouter, HTTPException, Request
+
+from http_cache import conditional_json, encode_json
+from inventory import inventory
 
 router = APIRouter()
 
+# Serialized full listing for the latest inventory version, shared by all pollers.
+_body_lock = threading.Lock()
+_body_cache: tuple[int, bytes] | None = None
+
+
+def _listing_body() -> tuple[int, bytes]:
+    global _body_cache
+    with _body_lock:
+        version, vms = inventory.snapshot()
+        if _body_cache is None or _body_cache[0] != version:
+            _body_cache = (version, encode_json({"vms": vms, "version": version}))
+        return _body_cache
+
+
 @router.get("/")
-def list_vms():
-    # Query libvirt for all domains and extract a small summary for each.
-    conn = get_libvirt_conn()
-    domains = conn.listAllDomains()
-
-    vms = []
-    for domain in domains:
-        state, _ = domain.state()
-        info = {
-            "name": domain.name(),
-            "status": STATE_NAMES.get(state, "Unknown"),
-            "port": None,
-            "memory_mb": None,
-            "vcpus": None,
-        }
-
-        # Parse domain XML to extract graphics port, memory (with unit handling), and vCPUs.
-        xml = domain.XMLDesc()
-        try:
-            root = ET.fromstring(xml)
-
-            graphics = root.find(".//graphics[@type='spice']")
-            if graphics is not None:
-                port = graphics.get("port")
-                if port and port != "-1":
-                    # Spice uses -1 when autoport is enabled; otherwise return int port.
-                    info["port"] = int(port)
-
-            mem_elem = root.find("memory")
-            if mem_elem is not None:
-                mem = int(mem_elem.text)
-                unit = mem_elem.get("unit", "KiB")
-
-                # Normalize memory to MiB for the API response.
-                if unit == "KiB":
-                    mem //= 1024
-                elif unit == "GiB":
-                    mem *= 1024
-
-                info["memory_mb"] = mem
-
-            vcpu_elem = root.find("vcpu")
-            if vcpu_elem is not None:
-                info["vcpus"] = int(vcpu_elem.text)
-
-        except ET.ParseError:
-            # If XML is malformed, skip the parsed fields but still return basic info.
-            pass
-
-        vms.append(info)
-
-    conn.close()
-    return {"vms": vms}
+async def list_vms(request: Request, since: int | None = None):
+    # Serve the summaries from the event-driven inventory; no libvirt calls and no worker
+    # threads on this path. Only requests made before the initial sync may wait for it.
+    # With several hosts, the listing is served as soon as any of them has synced, so one
+    # slow or unreachable host cannot hold the page (GET /sys/libvirt shows host status).
+    if not inventory.available(0) and not await asyncio.to_thread(inventory.available, 10):
+        raise HTTPException(503, "VM inventory is not available yet")
+
+    # ?since=<version>: only what was added, changed or removed after that version. Falls
+    # through to a full listing if the version is unknown or older than the retained history.
+    if since is not None:
+        delta = inventory.changes_since(since)
+        if delta is not None:
+            version, changes = delta
+            return {"version": version, "since": since, **changes}
+
+    version, body = _listing_body()
+    return conditional_json(request, body, f'"vms-{version}"')
@@ -0,0 +1,28 @@
+# Endpoints for live per-VM performance metrics sampled by metrics.py.
+from fastapi import APIRouter, HTTPException, Query
+
+from inventory import inventory
+from metrics import metrics
+
+router = APIRouter()
+
+
+@router.get("/metrics", summary="Latest metrics for all running VMs", tags=["vms"])
+async def all_vm_metrics():
+    """
+    Return {"vms": {name: {"timestamp", "cpu_percent", "memory_used_mb", ...}}, ...} with
+    the most recent sample of every VM. Rates are per second; cpu_percent is relative to
+    the VM's vCPUs. VMs appear after their second sample.
+    """
+    return {**metrics.status(), "vms": metrics.current()}
+
+
+@router.get("/{vm_name}/metrics", summary="Metrics and recent history for a VM", tags=["vms"])
+async def vm_metrics(vm_name: str, points: int = Query(60, ge=1, le=10000)):
+    data = metrics.for_vm(vm_name, points)
+    if data is None:
+        if inventory.get(vm_name) is None:
+            raise HTTPException(404, f"VM '{vm_name}' not found")
+        # Known VM that is stopped or has not been sampled twice yet.
+        data = {"current": None, "history": None}
+    return {"name": vm_name, "interval": metrics.interval, **data}
@@ -0,0 +1,62 @@
+# Endpoints for vCPU pinning: show, apply (automatic NUMA-aware or manual) and remove a VM's
+# CPU pinning. The planning and the host-wide pin map live in topology.py.
+from fastapi import APIRouter, HTTPException
+import libvirt
+
+from config import DEFAULT_HOST
+from libvirt_executor import libvirt_executor
+from inventory import inventory
+from schemas_local import VMPinningRequest
+from topology import PinningError, pinning
+
+router = APIRouter()
+
+
+def _host(vm_name: str) -> str:
+    return inventory.host_of(vm_name) or DEFAULT_HOST
+
+
+def _pin(conn, vm_name: str, request: VMPinningRequest) -> dict:
+    host = _host(vm_name)
+    try:
+        applied = pinning.pin(conn, host, vm_name, request)
+    except LookupError:
+        raise HTTPException(404, f"VM '{vm_name}' not found")
+    except PinningError as e:
+        raise HTTPException(409, str(e))
+    except libvirt.libvirtError as e:
+        raise HTTPException(500, f"Failed to pin VM: {e}")
+    return {"message": "VM pinned", "host": host, "pinning": applied}
+
+
+def _unpin(conn, vm_name: str) -> dict:
+    try:
+        pinning.unpin(conn, _host(vm_name), vm_name)
+    except LookupError:
+        raise HTTPException(404, f"VM '{vm_name}' not found")
+    except libvirt.libvirtError as e:
+        raise HTTPException(500, f"Failed to unpin VM: {e}")
+    return {"message": "VM unpinned"}
+
+
+@router.get("/{vm_name}/pinning")
+async def get_pinning(vm_name: str):
+    # Served from the host-wide pin map; no libvirt calls.
+    host = inventory.host_of(vm_name)
+    if host is None:
+        raise HTTPException(404, f"VM '{vm_name}' not found")
+    return {"host": host, "pinning": pinning.pin_map(host).get(vm_name)}
+
+
+@router.post("/{vm_name}/pinning")
+async def pin_vm(vm_name: str, request: VMPinningRequest):
+    """
+    Pin the VM's vCPUs to dedicated host CPUs. Running VMs are re-pinned live; the pinning
+    and the NUMA memory policy are also written to the persistent definition.
+    """
+    return await libvirt_executor.mutate(_pin, vm_name, request, for_vm=vm_name)
+
+
+@router.delete("/{vm_name}/pinning")
+async def unpin_vm(vm_name: str):
+    return await libvirt_executor.mutate(_unpin, vm_name, for_vm=vm_name)
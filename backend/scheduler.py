@@ -0,0 +1,178 @@
+# Placement scheduler: picks the host for a new VM from cached per-host stats (capacity ledger
+# headroom, free memory, image storage) using a pluggable scoring policy.
+import logging
+import threading
+import time
+from collections import deque
+from urllib.parse import urlparse
+
+from config import LIBVIRT_HOSTS, SCHEDULER_POLICY, SCHEDULER_DECISIONS, VM_SHARED_STORAGE
+from capacity import CapacityError, capacity
+from host_telemetry import host_telemetry
+from inventory import inventory
+
+logger = logging.getLogger(__name__)
+
+
+def is_local(host: str) -> bool:
+    """Whether managed `host` is the machine this backend runs on (a URI without a hostname)."""
+    return urlparse(LIBVIRT_HOSTS[host]).hostname is None
+
+
+def _free_fraction(free: float | None, total: float | None) -> float:
+    if free is None or not total:
+        return 0.0
+    return max(0.0, min(1.0, free / total))
+
+
+def _spread(c: dict) -> float:
+    # Prefer the emptiest host: weighted share of memory, vCPU and storage left after placement.
+    return (
+        0.5 * _free_fraction(c["memory_headroom_mb"], c["memory_limit_mb"])
+        + 0.3 * _free_fraction(c["vcpu_headroom"], c["vcpu_limit"])
+        + 0.2 * _free_fraction(c["storage_free_bytes"], c["storage_reference_bytes"])
+    )
+
+
+def _binpack(c: dict) -> float:
+    # Prefer the fullest host that still fits, keeping other hosts free for large VMs.
+    return 1.0 - _spread(c)
+
+
+# Scoring policies by name: fn(candidate) -> score, highest wins.
+POLICIES = {
+    "spread": _spread,
+    "binpack": _binpack,
+}
+
+
+class Scheduler:
+    """
+    Choose a host for a new VM.
+
+    Every managed host that has synced is a candidate. A candidate is described from cached
+    data only: capacity-ledger headroom after the request, free memory (host telemetry
+    for the local machine, the inventory's last resync for others) and free space for
+    images (statvfs of VM_IMAGE_DIR locally, the matching libvirt storage pool remotely).
+    Hosts where the VM does not fit are filtered out; the rest are ranked by the policy.
+    Template clones are built from golden images on this machine, so without
+    VM_SHARED_STORAGE they are only placed on local hosts.
+    Each decision, with every candidate's score or rejection reason, is kept in a bounded
+    log for GET /sys/scheduler.
+    """
+
+    def __init__(self, policy: str = SCHEDULER_POLICY, keep: int = SCHEDULER_DECISIONS):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown scheduler policy '{policy}'")
+        self.policy = policy
+        self._decisions: deque = deque(maxlen=keep)
+        self._lock = threading.Lock()
+
+    def _candidate(self, host: str, vcpus: int, memory_mb: int) -> dict:
+        stats = inventory.host_stats(host) or {}
+        vcpu_limit, memory_limit = capacity.limits(host)
+        vcpu_headroom, memory_headroom = capacity.headroom(host)
+        if is_local(host):
+            latest = host_telemetry.latest() or {}
+            free_memory_mb = latest.get("memory_available_mb")
+            storage_free = host_telemetry.image_dir_free_bytes
+        else:
+            free_memory_mb = stats.get("free_memory_mb")
+            storage_free = stats.get("storage_free_bytes")
+        return {
+            "host": host,
+            "synced": stats.get("synced_at") is not None and stats.get("error") is None,
+            "vcpu_limit": vcpu_limit,
+            "vcpu_headroom": vcpu_headroom - vcpus,
+            "memory_limit_mb": memory_limit,
+            "memory_headroom_mb": memory_headroom - memory_mb,
+            "free_memory_mb": free_memory_mb,
+            "storage_free_bytes": storage_free,
+        }
+
+    def _reject_reason(self, c: dict, memory_mb: int, disk_bytes: int) -> str | None:
+        if not c["synced"]:
+            return "host not synced"
+        if not c["placeable"]:
+            return "template disks need shared storage on remote hosts"
+        if c["vcpu_headroom"] < 0:
+            return "not enough vCPU capacity"
+        if c["memory_headroom_mb"] < 0:
+            return "not enough memory capacity"
+        if c["free_memory_mb"] is not None and c["free_memory_mb"] < memory_mb:
+            return "not enough free memory"
+        if c["storage_free_bytes"] is not None and c["storage_free_bytes"] < disk_bytes:
+            return "not enough image storage"
+        return None
+
+    def _score(
+        self, vcpus: int, memory_mb: int, disk_bytes: int, policy: str, template: bool = False
+    ) -> list[dict]:
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown scheduler policy '{policy}'")
+        score = POLICIES[policy]
+        candidates = [self._candidate(host, vcpus, memory_mb) for host in LIBVIRT_HOSTS]
+        for c in candidates:
+            c["placeable"] = not template or VM_SHARED_STORAGE or is_local(c["host"])
+        # Storage is scored relative to the roomiest host, since pool sizes are not cached.
+        reference = max((c["storage_free_bytes"] or 0) for c in candidates) or None
+        for c in candidates:
+            c["storage_reference_bytes"] = reference
+            c["rejected"] = self._reject_reason(c, memory_mb, disk_bytes)
+            c["score"] = round(score(c), 4)
+        return candidates
+
+    def place(
+        self,
+        vm_name: str,
+        vcpus: int,
+        memory_mb: int,
+        disk_gb: int | None = None,
+        policy: str | None = None,
+        require_fit: bool = True,
+        template: bool = False,
+    ) -> str:
+        """
+        Return the host for a new VM, or raise CapacityError if no host fits. With
+        `require_fit=False` the best-scoring synced host is returned even if the VM does not
+        fit yet (for requests that wait for capacity). `template` is set for VMs cloned
+        from a golden image.
+        """
+        policy = policy or self.policy
+        candidates = self._score(vcpus, memory_mb, (disk_gb or 0) * 1024 ** 3, policy, template)
+
+        eligible = [c for c in candidates if c["rejected"] is None]
+        if not eligible and not require_fit:
+            eligible = [c for c in candidates if c["synced"] and c["placeable"]]
+        chosen = max(eligible, key=lambda c: c["score"])["host"] if eligible else None
+
+        decision = {
+            "time": time.time(),
+            "vm": vm_name,
+            "policy": policy,
+            "request": {"vcpus": vcpus, "memory_mb": memory_mb, "disk_gb": disk_gb},
+            "chosen": chosen,
+            "candidates": [
+                {"host": c["host"], "score": c["score"], "rejected": c["rejected"]} for c in candidates
+            ],
+        }
+        with self._lock:
+            self._decisions.append(decision)
+        logger.info("Placement of %s (%s): %s", vm_name, policy, chosen or "no host fits")
+
+        if chosen is None:
+            reasons = "; ".join(f"{c['host']}: {c['rejected']}" for c in candidates)
+            raise CapacityError(f"No host can fit VM '{vm_name}' ({reasons})")
+        return chosen
+
+    def decisions(self, limit: int = 50) -> list[dict]:
+        """Most recent placement decisions, newest first."""
+        with self._lock:
+            return list(self._decisions)[::-1][:limit]
+
+    def preview(self, vcpus: int = 0, memory_mb: int = 0, policy: str | None = None) -> list[dict]:
+        """Current candidate stats and scores for a hypothetical request, without recording it."""
+        return self._score(vcpus, memory_mb, 0, policy or self.policy)
+
+
+scheduler = Scheduler()
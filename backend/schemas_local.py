@@ -1,3 +1,5 @@
+from typing import Literal
+
 from pydantic import BaseModel
 
 class VMEditRequest(BaseModel):
@@ -8,5 +10,55 @@ class VMCreateRequest(BaseModel):
     name: str
     memory_mb: int
     vcpus: int
-    disk_gb: int
+    # Required for blank disks; with a template it only grows the clone beyond the template size.
+    disk_gb: int | None = None
     iso_path: str | None = None
+    template: str | None = None
+    # Queue the job until capacity frees up instead of rejecting the request with 409.
+    wait_for_capacity: bool = False
+    # Managed host to create the VM on (see LIBVIRT_URIS); the default host when omitted.
+    host: str | None = None
+    # Placement policy when `host` is omitted: "spread" or "binpack" (default SCHEDULER_POLICY).
+    policy: str | None = None
+    # Hardware profile ("server", "desktop", "minimal"; default VM_DEFAULT_PROFILE) and
+    # overrides for the machine type, network and disk bus ("virtio", "scsi", "sata").
+    profile: str | None = None
+    machine: str | None = None
+    network: str | None = None
+    disk_bus: str | None = None
+
+class VMPinningRequest(BaseModel):
+    # "auto" picks dedicated CPUs on one NUMA node; "manual" takes a cpuset per vCPU, e.g.
+    # {"0": "2", "1": "3"}, and optionally the emulator cpuset.
+    mode: Literal["auto", "manual"] = "auto"
+    vcpus: dict[int, str] | None = None
+    emulator: str | None = None
+    # Restrict placement (and the guest's memory) to this NUMA node.
+    numa_node: int | None = None
+    # Let "auto" spread a VM too large for one node over several (memory interleaved).
+    allow_span: bool = False
+
+class ConsoleDecodeRequest(BaseModel):
+    mode: Literal["client", "server"]
+
+class TemplateRegisterRequest(BaseModel):
+    name: str
+    image: str
+    warm_pool: int | None = None
+
+class VMBulkRequest(BaseModel):
+    action: Literal["start", "stop", "kill", "reboot"]
+    # Targets: explicit names and/or a shell-style glob over VM names (e.g. "lab-*"),
+    # optionally narrowed to VMs currently in one status (e.g. "Shut off").
+    names: list[str] | None = None
+    pattern: str | None = None
+    status: str | None = None
+    parallelism: int | None = None
+
+class VMBulkEditItem(VMEditRequest):
+    name: str
+
+class VMBulkEditRequest(BaseModel):
+    # One entry per VM, each with its own changes.
+    edits: list[VMBulkEditItem]
+    parallelism: int | None = None
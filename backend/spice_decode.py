@@ -0,0 +1,384 @@
+# Server-side SPICE image decoding for weak clients: the console relay frames a display
+# channel's stream and, for sessions in "server" mode, decodes the LZ RGB images of DrawCopy
+# messages in a process pool and forwards them to the browser already in canvas RGBA order,
+# as an image type only our spice-html5 build understands (VMUI_IMAGE_TYPE_RGBA in
+# src/enums.js). Drawing those is a plain putImageData on the client instead of a per-pixel
+# JavaScript decode loop on the page's main thread.
+import asyncio
+import multiprocessing
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from config import SPICE_DECODE_DEFAULT, SPICE_DECODE_MAX_PIXELS, SPICE_DECODE_WORKERS
+
+
+DECODE_MODES = ("client", "server")
+
+SPICE_MAGIC = b"REDQ"
+SPICE_CHANNEL_DISPLAY = 2
+SPICE_COMMON_CAP_MINI_HEADER = 3
+SPICE_TICKET_PUBKEY_BYTES = 1024 // 8 + 34
+SPICE_MSG_DISPLAY_DRAW_COPY = 304
+SPICE_CLIP_TYPE_RECTS = 1
+SPICE_IMAGE_TYPE_LZ_RGB = 101
+# Not part of the SPICE protocol: emitted by this relay and drawn by src/display.js.
+VMUI_IMAGE_TYPE_RGBA = 200
+
+LZ_IMAGE_TYPE_RGB32 = 8
+LZ_IMAGE_TYPE_RGBA = 9
+LZ_IMAGE_TYPE_XXXA = 10
+LZ_HEADER = struct.Struct(">4sIIIIII")  # magic, version, type, width, height, stride, top_down
+
+# SpiceLinkHeader: magic, major, minor, size of the SpiceLinkMess/SpiceLinkReply that follows.
+_LINK_HEADER = struct.Struct("<4sIII")
+# SpiceMiniDataHeader: message type and body size.
+_MINI_HEADER = struct.Struct("<HI")
+
+
+def link_channel_type(data: bytes) -> int | None:
+    """Channel type from the browser's first frame (SpiceLinkHeader + SpiceLinkMess), if it is one."""
+    if len(data) < _LINK_HEADER.size + 5 or data[:4] != SPICE_MAGIC:
+        return None
+    return data[_LINK_HEADER.size + 4]
+
+
+def _lz_decode(src, at: int, out: bytearray, bpp: int, alpha: bool) -> int:
+    """
+    Decode one LZ pass from src[at:] into `out` (bpp bytes per pixel: 3 for the BGR pass,
+    1 for the alpha pass); returns the position after the pass. Follows lz_rgb32_decompress
+    in src/lz.js, but copies whole runs with slice assignment instead of pixel by pixel.
+    Raises IndexError or ValueError on a corrupt stream.
+    """
+    size = len(out)
+    extra = 3 if alpha else 1
+    op = 0
+    while op < size:
+        ctrl = src[at]
+        at += 1
+        if ctrl < 32:
+            # Literal run of ctrl + 1 pixels.
+            n = (ctrl + 1) * bpp
+            end = at + n
+            if op + n > size:
+                n = size - op
+            if at + n > len(src):
+                raise IndexError("LZ literal past the end of the data")
+            out[op:op + n] = src[at:at + n]
+            at = end
+            op += n
+            continue
+        # Back reference: length in the top 3 bits (7 = extended), distance in the low 5 + next byte.
+        length = ctrl >> 5
+        if length == 7:
+            code = 255
+            while code == 255:
+                code = src[at]
+                at += 1
+                length += code
+        code = src[at]
+        at += 1
+        if code == 255 and ctrl & 31 == 31:
+            distance = ((src[at] << 8) + src[at + 1] + 8192) * bpp
+            at += 2
+        else:
+            distance = (((ctrl & 31) << 8) + code + 1) * bpp
+        n = (length + extra - 1) * bpp
+        ref = op - distance
+        if ref < 0:
+            raise ValueError("LZ reference before the start of the image")
+        if op + n > size:
+            n = size - op
+        if distance >= n:
+            out[op:op + n] = out[ref:ref + n]
+        else:
+            # Overlapping copy: the last `distance` bytes repeat (a run when distance is one pixel).
+            out[op:op + n] = (out[ref:op] * (n // distance + 1))[:n]
+        op += n
+    return at
+
+
+def _to_rgba(bgr: bytearray | None, alpha: bytearray | None, width: int, height: int, flip: bool) -> bytearray:
+    """Canvas RGBA from the BGR pass (rows flipped when `flip`) and the alpha pass (as decoded)."""
+    rgba = bytearray(width * height * 4)
+    if bgr is not None:
+        if flip:
+            row = width * 3
+            bgr = b"".join(bgr[y * row:(y + 1) * row] for y in range(height - 1, -1, -1))
+        # Extended-slice assignment swizzles whole planes in C.
+        rgba[0::4] = bgr[2::3]
+        rgba[1::4] = bgr[1::3]
+        rgba[2::4] = bgr[0::3]
+    rgba[3::4] = b"\xff" * (width * height) if alpha is None else alpha
+    return rgba
+
+
+def decode_lz_rgb(lz_type: int, width: int, height: int, top_down: bool, data) -> tuple[bytearray, bool]:
+    """
+    (RGBA pixels, has_alpha) for an LZ RGB32/RGBA/XXXA image, identical to what
+    convert_spice_lz_to_web in src/lz.js produces (including its orientation of the alpha
+    plane, which is not flipped with the colour rows).
+    """
+    count = width * height
+    bgr = alpha = None
+    at = 0
+    if lz_type in (LZ_IMAGE_TYPE_RGB32, LZ_IMAGE_TYPE_RGBA):
+        bgr = bytearray(count * 3)
+        at = _lz_decode(data, at, bgr, 3, False)
+    if lz_type in (LZ_IMAGE_TYPE_RGBA, LZ_IMAGE_TYPE_XXXA):
+        alpha = bytearray(count)
+        _lz_decode(data, at, alpha, 1, True)
+    elif lz_type != LZ_IMAGE_TYPE_RGB32:
+        raise ValueError(f"Unsupported LZ image type {lz_type}")
+    return _to_rgba(bgr, alpha, width, height, not top_down and bgr is not None), lz_type == LZ_IMAGE_TYPE_RGBA
+
+
+def lz_image(body) -> tuple[int, int, int] | None:
+    """
+    (offset, width, height) of the source image of a DrawCopy message body when it is an LZ
+    RGB image we can decode and the last thing in the message, else None. Layout as parsed
+    by SpiceMsgDisplayDrawCopy in src/spicemsg.js.
+    """
+    size = len(body)
+    at = 4 + 16  # surface_id, box
+    if size < at + 1:
+        return None
+    if body[at] == SPICE_CLIP_TYPE_RECTS:
+        if size < at + 5:
+            return None
+        at += 5 + 16 * struct.unpack_from("<I", body, at + 1)[0]
+    else:
+        at += 1
+    # src_bitmap offset, src_area, rop_descriptor, scale_mode, mask flags, mask pos, mask bitmap offset.
+    if size < at + 36:
+        return None
+    image_at = struct.unpack_from("<I", body, at)[0]
+    mask_at = struct.unpack_from("<I", body, at + 32)[0]
+    at += 36
+    if mask_at or image_at < at or size < image_at + 22 + LZ_HEADER.size:
+        return None
+    if body[image_at + 8] != SPICE_IMAGE_TYPE_LZ_RGB:
+        return None
+    width, height = struct.unpack_from("<II", body, image_at + 10)
+    if image_at + 22 + struct.unpack_from("<I", body, image_at + 18)[0] != size:
+        return None
+    if struct.unpack_from(">I", body, image_at + 22 + 8)[0] not in (LZ_IMAGE_TYPE_RGB32, LZ_IMAGE_TYPE_RGBA, LZ_IMAGE_TYPE_XXXA):
+        return None
+    return image_at, width, height
+
+
+def rewrite_draw_copy(body: bytes) -> tuple[bytes | None, float]:
+    """
+    Runs in the worker processes: the DrawCopy body with its LZ image replaced by the decoded
+    VMUI_IMAGE_TYPE_RGBA image (descriptor, u8 has_alpha, width * height * 4 bytes), or None
+    when it cannot be decoded; plus the CPU seconds spent.
+    """
+    started = time.process_time()
+    found = lz_image(body)
+    if found is None:
+        return None, time.process_time() - started
+    image_at = found[0]
+    _, _, lz_type, width, height, _, top_down = LZ_HEADER.unpack_from(body, image_at + 22)
+    try:
+        pixels, has_alpha = decode_lz_rgb(
+            lz_type, width, height, bool(top_down), memoryview(body)[image_at + 22 + LZ_HEADER.size:]
+        )
+    except (IndexError, ValueError):
+        return None, time.process_time() - started
+    descriptor = bytearray(body[image_at:image_at + 18])
+    descriptor[8] = VMUI_IMAGE_TYPE_RGBA
+    struct.pack_into("<II", descriptor, 10, width, height)
+    out = b"".join((body[:image_at], descriptor, bytes((has_alpha,)), pixels))
+    return out, time.process_time() - started
+
+
+class DecodeService:
+    """
+    The process pool the display streams hand DrawCopy bodies to. Decoding is pure CPU work,
+    so it runs in SPICE_DECODE_WORKERS processes off the event loop and outside the GIL.
+    Started and stopped from the app lifespan; without workers, every session decodes in
+    the browser.
+    """
+
+    def __init__(self):
+        self._pool: ProcessPoolExecutor | None = None
+        self.images = 0
+        self.failed = 0
+        self.cpu_seconds = 0.0
+        self.wall_seconds = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    @property
+    def available(self) -> bool:
+        return self._pool is not None
+
+    def start(self) -> None:
+        if self._pool is None and SPICE_DECODE_WORKERS > 0:
+            # spawn, not fork: the server process has libvirt and executor threads running.
+            self._pool = ProcessPoolExecutor(SPICE_DECODE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+            # Workers start on demand; get them spawned now rather than on a session's first image.
+            for _ in range(SPICE_DECODE_WORKERS):
+                self._pool.submit(time.process_time)
+
+    def stop(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def rewrite(self, body: bytes) -> tuple[bytes | None, float]:
+        """(new body or None, CPU seconds) for one DrawCopy body, decoded in the pool."""
+        started = time.perf_counter()
+        out, cpu = await asyncio.get_running_loop().run_in_executor(self._pool, rewrite_draw_copy, body)
+        self.wall_seconds += time.perf_counter() - started
+        self.cpu_seconds += cpu
+        self.bytes_in += len(body)
+        if out is None:
+            self.failed += 1
+        else:
+            self.images += 1
+            self.bytes_out += len(out)
+        return out, cpu
+
+    def stats(self) -> dict:
+        return {
+            "workers": SPICE_DECODE_WORKERS if self._pool is not None else 0,
+            "default_mode": SPICE_DECODE_DEFAULT,
+            "max_pixels": SPICE_DECODE_MAX_PIXELS,
+            "images": self.images,
+            "failed": self.failed,
+            "cpu_ms_per_image": round(self.cpu_seconds / self.images * 1000, 3) if self.images else None,
+            "wall_ms_per_image": round(self.wall_seconds / self.images * 1000, 3) if self.images else None,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+        }
+
+
+# Stream states of DisplayStream.
+_LINK, _REPLY, _AUTH, _HEADER, _SKIP, _BODY = range(6)
+
+
+class DisplayStream:
+    """
+    Frames the server-to-browser half of one display channel: SpiceLinkHeader, SpiceLinkReply
+    and the 4-byte link result, then mini-header messages (spice-html5 always asks for the
+    mini header; if the server does not offer it the stream is passed through untouched).
+
+    In "client" mode message bodies are only counted past. In "server" mode a DrawCopy is
+    held back until complete and, when its source is an LZ RGB image of at most
+    SPICE_DECODE_MAX_PIXELS, re-emitted with the decoded image; the stream waits for the
+    decode so message order is kept. `mode` may change at any time and applies from the
+    next message.
+    """
+
+    def __init__(self, decoder: DecodeService, mode: str):
+        self.decoder = decoder
+        self.mode = mode
+        self.passthrough = False
+        self._state = _LINK
+        self._left = _LINK_HEADER.size
+        self._buf = bytearray()
+        self.images_decoded = 0
+        self.images_failed = 0
+        self.decode_cpu_seconds = 0.0
+        self.decode_wall_seconds = 0.0
+
+    def _expect(self, state: int, size: int) -> None:
+        self._state = state
+        self._left = size
+
+    async def feed(self, data: memoryview) -> bytes:
+        """The bytes to forward to the browser for `data` read from the SPICE server."""
+        n = len(data)
+        if self.passthrough:
+            return bytes(data)
+        if self._state == _SKIP and self._left > n:
+            self._left -= n
+            return bytes(data)
+        out = bytearray()
+        p = 0
+        while p < n:
+            if self.passthrough:
+                out += data[p:]
+                break
+            k = min(self._left, n - p)
+            if self._state == _SKIP:
+                out += data[p:p + k]
+            else:
+                self._buf += data[p:p + k]
+            p += k
+            self._left -= k
+            if not self._left:
+                await self._complete(out)
+        return bytes(out)
+
+    async def _complete(self, out: bytearray) -> None:
+        state = self._state
+        if state == _SKIP:
+            self._expect(_HEADER, _MINI_HEADER.size)
+            return
+        buf = bytes(self._buf)
+        self._buf.clear()
+        if state == _HEADER:
+            msg_type, size = _MINI_HEADER.unpack(buf)
+            if msg_type == SPICE_MSG_DISPLAY_DRAW_COPY and size and self.mode == "server":
+                self._expect(_BODY, size)
+            else:
+                out += buf
+                self._expect(_SKIP, size) if size else self._expect(_HEADER, _MINI_HEADER.size)
+        elif state == _BODY:
+            out += await self._draw_copy(buf)
+            self._expect(_HEADER, _MINI_HEADER.size)
+        elif state == _LINK:
+            out += buf
+            magic, _, _, size = _LINK_HEADER.unpack(buf)
+            if magic != SPICE_MAGIC or not size:
+                self.passthrough = True
+            else:
+                self._expect(_REPLY, size)
+        elif state == _REPLY:
+            out += buf
+            if not offers_mini_header(buf):
+                self.passthrough = True
+            else:
+                self._expect(_AUTH, 4)
+        elif state == _AUTH:
+            out += buf
+            self._expect(_HEADER, _MINI_HEADER.size)
+
+    async def _draw_copy(self, body: bytes) -> bytes:
+        found = lz_image(body)
+        if found is not None and found[1] * found[2] <= SPICE_DECODE_MAX_PIXELS and self.decoder.available:
+            started = time.perf_counter()
+            new_body, cpu = await self.decoder.rewrite(body)
+            self.decode_wall_seconds += time.perf_counter() - started
+            self.decode_cpu_seconds += cpu
+            if new_body is not None:
+                self.images_decoded += 1
+                return _MINI_HEADER.pack(SPICE_MSG_DISPLAY_DRAW_COPY, len(new_body)) + new_body
+            self.images_failed += 1
+        return _MINI_HEADER.pack(SPICE_MSG_DISPLAY_DRAW_COPY, len(body)) + body
+
+    def as_dict(self) -> dict:
+        return {
+            "mode": self.mode,
+            "images_decoded": self.images_decoded,
+            "images_failed": self.images_failed,
+            "decode_cpu_ms": round(self.decode_cpu_seconds * 1000, 3),
+            "decode_ms_avg": round(self.decode_wall_seconds / self.images_decoded * 1000, 3) if self.images_decoded else None,
+        }
+
+
+def offers_mini_header(reply: bytes) -> bool:
+    # SpiceLinkReply: error, public key, num_common_caps, num_channel_caps, caps_offset.
+    at = 4 + SPICE_TICKET_PUBKEY_BYTES
+    if len(reply) < at + 12:
+        return False
+    error, = struct.unpack_from("<I", reply, 0)
+    num_common, _, caps_offset = struct.unpack_from("<III", reply, at)
+    if error or not num_common or len(reply) < caps_offset + 4:
+        return False
+    return bool(struct.unpack_from("<I", reply, caps_offset)[0] & (1 << SPICE_COMMON_CAP_MINI_HEADER))
+
+
+spice_decoder = DecodeService()
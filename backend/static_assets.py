@@ -0,0 +1,315 @@
+# Frontend assets served by the API app: files are read and compressed (gzip, plus brotli when
+# the Brotli package is installed) once, pages are rewritten to reference a content-versioned
+# URL prefix that is cached as immutable, and the src/ SPICE client can be served as one bundle.
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+import threading
+import time
+
+from config import (
+    STATIC_BROTLI_QUALITY,
+    STATIC_BUNDLE,
+    STATIC_DIR,
+    STATIC_GZIP_LEVEL,
+)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# URL prefix of versioned assets: /assets/<version>/<path>. The version is a hash over the
+# content of every asset, so any change yields new URLs and the old ones can be cached forever.
+VERSIONED_PREFIX = "assets"
+
+EXTENSIONS = {".html", ".js", ".css", ".ico", ".png", ".svg", ".gif", ".jpg", ".woff", ".woff2", ".map"}
+_COMPRESSIBLE = {".html", ".js", ".css", ".svg", ".map", ".ico"}
+_SKIP_DIRS = {"backend", "__pycache__", "node_modules"}
+_MIN_COMPRESS_SIZE = 256
+
+# The ES module the bundle replaces: pages import it and get every src/ module in one response.
+BUNDLE_ENTRY = "src/main.js"
+
+_REF_RE = re.compile(r"""(\b(?:src|href)=|\bfrom\s+|\bimport\s+)(["'])([^"'<>\s]+)\2""")
+_IMPORT_RE = re.compile(
+    r"""^import\s+(?:\{([^}]*)\}|\*\s+as\s+(\w+))\s+from\s+["']([^"']+)["']\s*;?[ \t]*$""", re.M
+)
+_EXPORT_LIST_RE = re.compile(r"^export\s*\{([^}]*)\}\s*;?[ \t]*$", re.M)
+_EXPORT_DECL_RE = re.compile(r"^export\s+((?:var|let|const|function\*?|class)\s+([A-Za-z_$][\w$]*))", re.M)
+
+
+class Asset:
+    """One servable file: raw and compressed bodies plus a strong ETag."""
+
+    __slots__ = ("path", "content_type", "body", "gzip", "br", "etag", "stamp", "version")
+
+    def __init__(self, path: str, body: bytes, stamp, version: str | None = None):
+        self.path = path
+        content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        if content_type.startswith("text/") or content_type.endswith("javascript"):
+            content_type += "; charset=utf-8"
+        self.content_type = content_type
+        self.body = body
+        self.etag = hashlib.blake2b(body, digest_size=12).hexdigest()
+        self.stamp = stamp
+        # The asset version pages and the bundle were rendered against.
+        self.version = version
+        self.gzip = self.br = None
+        if os.path.splitext(path)[1] in _COMPRESSIBLE and len(body) >= _MIN_COMPRESS_SIZE:
+            gz = gzip.compress(body, compresslevel=STATIC_GZIP_LEVEL, mtime=0)
+            self.gzip = gz if len(gz) < len(body) else None
+            if brotli is not None:
+                br = brotli.compress(body, quality=STATIC_BROTLI_QUALITY)
+                self.br = br if len(br) < len(body) else None
+
+    def representation(self, accept_encoding: str) -> tuple[bytes, str | None]:
+        """(body, Content-Encoding) for the client's Accept-Encoding, preferring brotli."""
+        accepted = _accepted_encodings(accept_encoding)
+        if self.br is not None and "br" in accepted:
+            return self.br, "br"
+        if self.gzip is not None and "gzip" in accepted:
+            return self.gzip, "gzip"
+        return self.body, None
+
+
+def _accepted_encodings(header: str) -> set[str]:
+    accepted = set()
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name and q > 0:
+            accepted.add(name.lower())
+    return accepted
+
+
+def _exports(source: str) -> list[tuple[str, str]]:
+    """(exported name, local name) for every export in a module."""
+    exports = []
+    for match in _EXPORT_LIST_RE.finditer(source):
+        for item in match.group(1).split(","):
+            local, _, exported = item.strip().partition(" as ")
+            if local:
+                exports.append((exported.strip() or local.strip(), local.strip()))
+    exports += [(m.group(2), m.group(2)) for m in _EXPORT_DECL_RE.finditer(source)]
+    return exports
+
+
+def bundle_modules(entry: str, read) -> bytes:
+    """
+    Concatenate the ES module graph rooted at `entry` into one module with the same exports.
+
+    Every module becomes a function scope evaluated once in dependency order, returning its
+    exports as getters; imports become bindings to those objects. Handles the forms the
+    src/ client uses: `import {a, b as c} from`, `import * as X from`, `export {a, b as c}`
+    and `export var|let|const|function|class`. `read(path)` returns a module's source.
+    """
+    order: list[str] = []
+    state: dict[str, int] = {}
+
+    def visit(path: str) -> None:
+        if state.get(path) == 2:
+            return
+        if state.get(path) == 1:
+            raise ValueError(f"Circular import involving {path}")
+        state[path] = 1
+        for match in _IMPORT_RE.finditer(read(path)):
+            visit(posixpath.normpath(posixpath.join(posixpath.dirname(path), match.group(3))))
+        state[path] = 2
+        order.append(path)
+
+    visit(entry)
+    ids = {path: f"__m{i}" for i, path in enumerate(order)}
+    out = [f"// {entry} and its imports, bundled by the backend (STATIC_BUNDLE). Edit the modules in src/.\n"]
+    for path in order:
+        source = read(path)
+        prelude = []
+        for match in _IMPORT_RE.finditer(source):
+            target = ids[posixpath.normpath(posixpath.join(posixpath.dirname(path), match.group(3)))]
+            if match.group(2):
+                prelude.append(f"const {match.group(2)} = {target};")
+            else:
+                names = [n.strip() for n in match.group(1).split(",") if n.strip()]
+                bindings = ", ".join(n.replace(" as ", ": ") for n in names)
+                prelude.append(f"const {{ {bindings} }} = {target};")
+        exports = _exports(source)
+        body = _IMPORT_RE.sub("", source)
+        body = _EXPORT_LIST_RE.sub("", body)
+        body = _EXPORT_DECL_RE.sub(r"\1", body)
+        getters = ", ".join(f"get {name}() {{ return {local}; }}" for name, local in exports)
+        out.append(
+            f"\n// ---- {path}\nconst {ids[path]} = (function () {{\n"
+            + "\n".join(prelude)
+            + f"\n{body}\nreturn Object.freeze({{ {getters} }});\n}})();\n"
+        )
+    names = [name for name, _ in _exports(read(entry))]
+    out.append(f"\nexport const {{ {', '.join(names)} }} = {ids[entry]};\n")
+    return "".join(out).encode()
+
+
+class StaticAssets:
+    """
+    The frontend tree under STATIC_DIR, held in memory.
+
+    Files are loaded (and compressed) on first use and when their size or mtime changes; the
+    tree is re-scanned, stat calls only, when a page is served, at most once a second, since
+    every page load starts with a page. `start()` warms everything in a background thread
+    so compression stays off the request path.
+    """
+
+    def __init__(self, root: str = STATIC_DIR, bundle: bool = STATIC_BUNDLE):
+        self.root = os.path.realpath(root)
+        self.bundle = bundle
+        self.version = ""
+        self._assets: dict[str, Asset] = {}
+        self._stamps: dict[str, tuple] = {}
+        self._hashes: dict[str, tuple[tuple, bytes]] = {}
+        self._scanned_at = 0.0
+        self._lock = threading.RLock()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._warm, name="static-assets", daemon=True)
+        self._thread.start()
+
+    def _warm(self) -> None:
+        started = time.perf_counter()
+        self.scan()
+        for path in list(self._stamps):
+            self.get(path)
+        logger.info(
+            "Static assets ready: %d files, version %s, brotli %s (%.2fs)",
+            len(self._assets), self.version, "on" if brotli else "off", time.perf_counter() - started,
+        )
+
+    def _servable(self, rel: str) -> bool:
+        parts = rel.split("/")
+        return (
+            os.path.splitext(rel)[1] in EXTENSIONS
+            and not any(p.startswith(".") for p in parts)
+            and parts[0] not in _SKIP_DIRS
+            and "__pycache__" not in parts
+        )
+
+    def scan(self) -> None:
+        """Stat every servable file; recompute the version if anything was added, changed or removed."""
+        stamps = {}
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            rel_dir = os.path.relpath(dirpath, self.root).replace(os.sep, "/")
+            rel_dir = "" if rel_dir == "." else rel_dir + "/"
+            dirnames[:] = [d for d in dirnames if not d.startswith(".") and (rel_dir or d not in _SKIP_DIRS)]
+            for name in filenames:
+                rel = rel_dir + name
+                if self._servable(rel):
+                    try:
+                        st = os.stat(os.path.join(dirpath, name))
+                    except OSError:
+                        continue
+                    stamps[rel] = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            self._scanned_at = time.monotonic()
+            if stamps == self._stamps:
+                return
+            self._stamps = stamps
+            for cache in (self._assets, self._hashes):
+                for rel in list(cache):
+                    if rel not in stamps:
+                        del cache[rel]
+            digest = hashlib.blake2b(digest_size=6)
+            for rel, stamp in sorted(stamps.items()):
+                digest.update(rel.encode() + b"\0" + self._content_hash(rel, stamp))
+            self.version = digest.hexdigest()
+
+    def _content_hash(self, rel: str, stamp: tuple) -> bytes:
+        # Only files whose stamp changed since the last scan are read again.
+        cached = self._hashes.get(rel)
+        if cached is None or cached[0] != stamp:
+            try:
+                value = hashlib.blake2b(self._read(rel), digest_size=12).digest()
+            except OSError:
+                value = b""
+            cached = self._hashes[rel] = (stamp, value)
+        return cached[1]
+
+    def _read(self, rel: str) -> bytes:
+        with open(os.path.join(self.root, rel), "rb") as f:
+            return f.read()
+
+    def _render_page(self, rel: str, body: bytes) -> bytes:
+        # Point local script, stylesheet, image and module references at the versioned prefix.
+        base = posixpath.dirname(rel)
+
+        def replace(match):
+            ref = match.group(3)
+            if ":" in ref or ref.startswith(("/", "#")) or ref.endswith(".html"):
+                return match.group(0)
+            target = posixpath.normpath(posixpath.join(base, ref.split("?")[0]))
+            if target not in self._stamps:
+                return match.group(0)
+            return f"{match.group(1)}{match.group(2)}/{VERSIONED_PREFIX}/{self.version}/{target}{match.group(2)}"
+
+        return _REF_RE.sub(replace, body.decode("utf-8", "replace")).encode()
+
+    def _build(self, rel: str) -> Asset:
+        stamp = self._stamps[rel]
+        if rel.endswith(".html"):
+            return Asset(rel, self._render_page(rel, self._read(rel)), stamp, self.version)
+        if self.bundle and rel == BUNDLE_ENTRY:
+            try:
+                body = bundle_modules(rel, lambda p: self._read(p).decode())
+                return Asset(rel, body, stamp, self.version)
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning("Serving %s unbundled: %s", rel, e)
+        return Asset(rel, self._read(rel), stamp)
+
+    def get(self, rel: str) -> Asset | None:
+        """The asset at relative path `rel`, (re)built if it is new or changed; None if not servable."""
+        rel = posixpath.normpath(rel.lstrip("/"))
+        if rel.startswith("..") or not self._servable(rel):
+            return None
+        if rel.endswith(".html") and time.monotonic() - self._scanned_at > 1:
+            self.scan()
+        with self._lock:
+            if rel not in self._stamps:
+                return None
+            asset = self._assets.get(rel)
+            stale = asset is None or asset.stamp != self._stamps[rel]
+            if not stale and asset.version is not None and asset.version != self.version:
+                stale = True  # a page or the bundle rendered against an older tree
+            if stale:
+                try:
+                    asset = self._assets[rel] = self._build(rel)
+                except OSError:
+                    return None
+            return asset
+
+    def stats(self) -> dict:
+        with self._lock:
+            assets = list(self._assets.values())
+        return {
+            "root": self.root,
+            "version": self.version,
+            "bundle": self.bundle,
+            "brotli": brotli is not None,
+            "files": len(self._stamps),
+            "loaded": len(assets),
+            "bytes": sum(len(a.body) for a in assets),
+            "gzip_bytes": sum(len(a.gzip or a.body) for a in assets),
+            "br_bytes": sum(len(a.br or a.gzip or a.body) for a in assets) if brotli else None,
+        }
+
+
+static_assets = StaticAssets()
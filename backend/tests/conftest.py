@@ -0,0 +1,32 @@
+# Test setup. The backend's modules import each other by bare name (`from config import ...`),
+# so backend/ goes on sys.path. These tests cover pure logic and never talk to a hypervisor;
+# when libvirt-python is not installed, a minimal stand-in module (libvirtError plus VIR_*
+# constants) lets the modules that import it load.
+#
+#   cd backend && python -m pytest -q tests
+import itertools
+import os
+import sys
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import libvirt  # noqa: F401
+except ImportError:
+    _stub = types.ModuleType("libvirt")
+    _constants: dict[str, int] = {}
+    _next = itertools.count(1)
+
+    class libvirtError(Exception):
+        def get_error_code(self) -> int:
+            return 0
+
+    def _constant(name: str) -> int:
+        if not name.startswith("VIR_"):
+            raise AttributeError(name)
+        return _constants.setdefault(name, next(_next))
+
+    _stub.libvirtError = libvirtError
+    _stub.__getattr__ = _constant
+    sys.modules["libvirt"] = _stub
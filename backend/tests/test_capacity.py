@@ -0,0 +1,96 @@
+import pytest
+
+import capacity as capacity_module
+from capacity import CapacityError, CapacityLedger
+
+HOST = capacity_module.DEFAULT_HOST
+
+
+@pytest.fixture
+def ledger(monkeypatch):
+    # An 8-CPU, 9 GiB host with no overcommit and 1 GiB held back: 8 vCPUs and 8192 MB.
+    monkeypatch.setattr(capacity_module, "CPU_OVERCOMMIT_RATIO", 1.0)
+    monkeypatch.setattr(capacity_module, "MEMORY_OVERCOMMIT_RATIO", 1.0)
+    monkeypatch.setattr(capacity_module, "HOST_MEMORY_RESERVE_MB", 1024)
+    ledger = CapacityLedger(count_stopped=True)
+    ledger.host_size = lambda host: (8, 9216)
+    return ledger
+
+
+def _add(ledger, name, vcpus, memory_mb, status="Running"):
+    vm = {"name": name, "vcpus": vcpus, "memory_mb": memory_mb, "status": status, "host": HOST}
+    ledger._on_changes([{"op": "add", "vm": vm}])
+
+
+def test_limits_from_host_size_and_ratios(ledger):
+    assert ledger.limits(HOST) == (8, 8192)
+    assert ledger.headroom(HOST) == (8, 8192)
+
+
+def test_domains_from_inventory_changes(ledger):
+    _add(ledger, "a", 2, 2048)
+    _add(ledger, "b", 1, 1024, status="Shut off")
+    assert ledger.headroom(HOST) == (5, 5120)
+    ledger._on_changes([{"op": "remove", "name": "a"}])
+    assert ledger.headroom(HOST) == (7, 7168)
+
+
+def test_stopped_domains_not_counted_when_disabled(ledger):
+    ledger.count_stopped = False
+    _add(ledger, "a", 2, 2048, status="Shut off")
+    assert ledger.headroom(HOST) == (8, 8192)
+
+
+def test_admit_reserves_until_released(ledger):
+    ledger.admit("new", 4, 4096, host=HOST)
+    assert ledger.headroom(HOST) == (4, 4096)
+    with pytest.raises(CapacityError):
+        ledger.admit("other", 5, 1024, host=HOST)
+    ledger.release("new")
+    assert ledger.headroom(HOST) == (8, 8192)
+    assert ledger.snapshot()["reservations"] == {}
+
+
+def test_commit_makes_reservation_the_allocation(ledger):
+    ledger.admit("new", 2, 1024, host=HOST)
+    ledger.commit("new", active=True)
+    assert ledger.snapshot()["reservations"] == {}
+    assert ledger.headroom(HOST) == (6, 7168)
+    # A later release has nothing to drop.
+    ledger.release("new")
+    assert ledger.headroom(HOST) == (6, 7168)
+
+
+def test_admit_again_replaces_reservation(ledger):
+    ledger.admit("new", 2, 1024, host=HOST)
+    ledger.admit("new", 3, 2048, host=HOST)
+    assert ledger.headroom(HOST) == (5, 6144)
+
+
+def test_resize_counts_only_the_difference(ledger):
+    _add(ledger, "a", 6, 6144)
+    # Growing a to 8 vCPUs fits (6 are already its own); another 3-vCPU VM would not.
+    ledger.admit("a", 8, None)
+    assert ledger.headroom(HOST) == (0, 2048)
+    with pytest.raises(CapacityError):
+        ledger.admit("b", 1, 512, host=HOST)
+
+
+def test_shrinking_allowed_over_limit(ledger):
+    _add(ledger, "a", 10, 10240)
+    ledger.admit("a", 9, 9216)
+    assert ledger.headroom(HOST) == (-1, -1024)
+
+
+def test_check_does_not_reserve(ledger):
+    ledger.check("new", 8, 8192, host=HOST)
+    assert ledger.headroom(HOST) == (8, 8192)
+    with pytest.raises(CapacityError):
+        ledger.check("new", 9, 1024, host=HOST)
+
+
+def test_wait_admit_gives_up_when_told_to_stop(ledger):
+    _add(ledger, "a", 8, 1024)
+    with pytest.raises(CapacityError):
+        ledger.wait_admit("new", 1, 1024, lambda: True, host=HOST)
+    assert ledger.snapshot()["reservations"] == {}
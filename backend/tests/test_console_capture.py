@@ -0,0 +1,112 @@
+import os
+
+import pytest
+
+import console_capture
+from console_capture import DOWN, UP, CaptureReader, CaptureRefused, CaptureWriter, open_capture
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "a.spicecap")
+    writer = CaptureWriter(path, {"vm": "web-01"})
+    writer.record(UP, b"link")
+    writer.record(DOWN, b"")  # empty chunks are not recorded
+    writer.record(DOWN, memoryview(b"x" * 3_000_000))  # past the initial mapping
+    writer.close()
+    assert os.path.getsize(path) == writer.size
+
+    with CaptureReader(path) as reader:
+        records = [(d, bytes(p)) for d, _, p in reader]
+        summary = reader.summary()
+    assert records == [(UP, b"link"), (DOWN, b"x" * 3_000_000)]
+    assert reader.meta == {"vm": "web-01"}
+    assert (summary["records_up"], summary["records_down"]) == (1, 1)
+    assert (summary["bytes_up"], summary["bytes_down"]) == (4, 3_000_000)
+
+
+def test_limit_truncates(tmp_path):
+    writer = CaptureWriter(str(tmp_path / "a.spicecap"), {}, limit=200)
+    writer.record(UP, b"a" * 50)
+    writer.record(UP, b"b" * 200)
+    writer.record(UP, b"c")  # nothing more once truncated
+    writer.close()
+    assert writer.truncated and writer.records == 1
+
+
+def test_reader_stops_at_unwritten_tail(tmp_path):
+    # A writer that never closed leaves the zeroed rest of its mapping behind.
+    path = str(tmp_path / "a.spicecap")
+    writer = CaptureWriter(path, {})
+    writer.record(DOWN, b"data")
+    writer._map.flush()
+    with CaptureReader(path) as reader:
+        assert [bytes(p) for _, _, p in reader] == [b"data"]
+    writer.close()
+
+
+@pytest.mark.parametrize("data", [
+    b"\0" * 64,
+    b"VMUICAP1\0\0\0",  # shorter than the header
+    console_capture._HEADER.pack(console_capture.MAGIC, 0.0, 1000) + b"{}",  # metadata past the end
+    console_capture._HEADER.pack(console_capture.MAGIC, 0.0, 2) + b"{x",
+])
+def test_not_a_capture(tmp_path, data):
+    path = tmp_path / "a.spicecap"
+    path.write_bytes(data)
+    with pytest.raises(ValueError):
+        CaptureReader(str(path))
+
+
+def test_corrupt_records_end_the_capture(tmp_path):
+    path = str(tmp_path / "a.spicecap")
+    writer = CaptureWriter(path, {})
+    writer.record(UP, b"ok")
+    writer.close()
+    with open(path, "ab") as f:
+        f.write(console_capture._RECORD.pack(7, 0, 1) + b"x")  # unknown direction
+        f.write(console_capture._RECORD.pack(DOWN, 0, 100) + b"short")
+    with CaptureReader(path) as reader:
+        assert reader.summary()["records_up"] == 1
+        assert [bytes(p) for _, _, p in reader] == [b"ok"]
+
+
+def test_list_captures_skips_broken_files(capture_dir):
+    (capture_dir / "short.spicecap").write_bytes(b"VMUICAP1\0\0\0")
+    open_capture("vm", 1, {}).close()
+    assert [c["meta"] for c in console_capture.list_captures()] == [{}]
+
+
+@pytest.fixture
+def capture_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(console_capture, "CONSOLE_CAPTURE_ENABLED", True)
+    monkeypatch.setattr(console_capture, "CONSOLE_CAPTURE_DIR", str(tmp_path))
+    monkeypatch.setattr(console_capture, "CONSOLE_CAPTURE_MAX_BYTES", 4 * 1024 ** 2)
+    monkeypatch.setattr(console_capture, "CONSOLE_CAPTURE_MAX_TOTAL_BYTES", 10 * 1024 ** 2)
+    monkeypatch.setattr(console_capture, "CONSOLE_CAPTURE_MAX_FILES", 3)
+    monkeypatch.setattr(console_capture, "CONSOLE_CAPTURE_RETENTION_HOURS", 1)
+    return tmp_path
+
+
+def test_open_capture_disabled(capture_dir, monkeypatch):
+    monkeypatch.setattr(console_capture, "CONSOLE_CAPTURE_ENABLED", False)
+    with pytest.raises(CaptureRefused):
+        open_capture("vm", 1, {})
+
+
+def test_open_capture_byte_quota(capture_dir):
+    # Recording captures count at their full limit: 4 + 4 MiB, then 2 MiB left.
+    writers = [open_capture("vm", i, {}) for i in range(3)]
+    assert [w.limit for w in writers] == [4 * 1024 ** 2, 4 * 1024 ** 2, 2 * 1024 ** 2]
+    for w in writers:
+        w.close()
+
+
+def test_open_capture_file_quota_and_retention(capture_dir):
+    for i in range(3):
+        open_capture("vm", i, {}).close()
+    with pytest.raises(CaptureRefused):
+        open_capture("vm", 3, {})
+    old = sorted(capture_dir.iterdir())[0]
+    os.utime(old, (0, 0))
+    open_capture("vm", 4, {}).close()
+    assert not old.exists()
@@ -0,0 +1,99 @@
+import pytest
+
+from domain_xml import extract, memory_mib, summarize_xml
+
+DOMAIN = """
+<domain type='kvm'>
+  <name>web-01</name>
+  <memory unit='KiB'>2097152</memory>
+  <currentMemory unit='KiB'>1048576</currentMemory>
+  <vcpu placement='static'>4</vcpu>
+  <cputune>
+    <vcpupin vcpu='1' cpuset='3'/>
+    <vcpupin vcpu='0' cpuset='2'/>
+    <emulatorpin cpuset='0-1'/>
+  </cputune>
+  <numatune>
+    <memory mode='strict' nodeset='0'/>
+  </numatune>
+  <devices>
+    <disk type='file' device='disk'>
+      <source file='/var/lib/images/web-01.qcow2'/>
+    </disk>
+    <disk type='file' device='cdrom'>
+      <source file='/isos/install.iso'/>
+    </disk>
+    <disk type='block' device='disk'>
+      <source dev='/dev/sdb'/>
+    </disk>
+    <graphics type='vnc' port='5901'/>
+    <graphics type='spice' port='5902' autoport='yes'/>
+  </devices>
+  <seclabel type='dynamic'/>
+</domain>
+"""
+
+
+@pytest.mark.parametrize("value, unit, mib", [
+    (2097152, "KiB", 2048),
+    ("2097152", None, 2048),
+    (2, "GiB", 2048),
+    (2, "G", 2048),
+    (1, "GB", 953),
+    (512, "MiB", 512),
+    (1048576, "bytes", 1),
+    (1, "T", 1024 ** 2),
+])
+def test_memory_mib(value, unit, mib):
+    assert memory_mib(value, unit) == mib
+
+
+def test_memory_mib_unknown_unit():
+    with pytest.raises(ValueError):
+        memory_mib(1, "furlongs")
+
+
+def test_extract():
+    summary = extract(DOMAIN)
+    assert summary.memory_mb == 2048
+    assert summary.vcpus == 4
+    assert summary.port == 5902
+    assert summary.disks == ("/var/lib/images/web-01.qcow2", "/isos/install.iso")
+    assert summary.pinning() == {
+        "vcpus": {"0": "2", "1": "3"},
+        "emulator": "0-1",
+        "numa_mode": "strict",
+        "numa_nodes": "0",
+    }
+    assert summary.as_dict()["memory_mb"] == 2048
+
+
+def test_extract_accepts_bytes_and_unit_less_memory():
+    summary = extract(b"<domain><memory>1048576</memory><vcpu>1</vcpu><devices/></domain>")
+    assert (summary.memory_mb, summary.vcpus, summary.port, summary.disks) == (1024, 1, None, ())
+    assert summary.pinning() is None
+
+
+def test_extract_autoport_not_running():
+    xml = "<domain><devices><graphics type='spice' port='-1' autoport='yes'/></devices></domain>"
+    assert extract(xml).port is None
+
+
+def test_extract_stops_at_end_of_devices():
+    # Anything after </devices>, even malformed, is never read.
+    assert extract("<domain><vcpu>2</vcpu><devices></devices><broken").vcpus == 2
+
+
+def test_extract_ignores_nested_memory_elements():
+    xml = "<domain><memory>1048576</memory><cpu><numa><cell memory='4'/></numa></cpu><devices/></domain>"
+    assert extract(xml).memory_mb == 1024
+
+
+def test_extract_malformed():
+    with pytest.raises(ValueError):
+        extract("<domain><vcpu>2</domain>")
+
+
+def test_summarize_xml_memoizes():
+    assert summarize_xml(DOMAIN) is summarize_xml(DOMAIN)
+    assert summarize_xml(DOMAIN) == extract(DOMAIN)
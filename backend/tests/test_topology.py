@@ -0,0 +1,135 @@
+import xml.etree.ElementTree as ET
+from types import SimpleNamespace
+
+import pytest
+
+from domain_xml import extract
+from topology import (
+    PinningError,
+    PinningService,
+    _write_pinning_xml,
+    format_cpuset,
+    parse_cpuset,
+    plan_pinning,
+)
+
+
+def _topology(nodes: int = 2, cores: int = 4) -> dict:
+    """`nodes` NUMA nodes of `cores` two-thread cores; CPU n and n + 1 (n even) are siblings."""
+    topology = {"nodes": {}, "cpus": {}}
+    for node in range(nodes):
+        first = node * cores * 2
+        cpus = list(range(first, first + cores * 2))
+        topology["nodes"][node] = {"cpus": cpus, "memory_mb": 8192, "free_mb": 8192}
+        for cpu in cpus:
+            core = cpu // 2
+            topology["cpus"][cpu] = {"node": node, "socket": node, "core": core, "siblings": [core * 2, core * 2 + 1]}
+    return topology
+
+
+@pytest.mark.parametrize("spec, cpus", [
+    ("", set()),
+    ("3", {3}),
+    ("0-3", {0, 1, 2, 3}),
+    ("0-3,^2,8", {0, 1, 3, 8}),
+    (" 1, 5-6 ", {1, 5, 6}),
+])
+def test_parse_cpuset(spec, cpus):
+    assert parse_cpuset(spec) == cpus
+
+
+def test_parse_cpuset_rejects_garbage():
+    with pytest.raises(PinningError):
+        parse_cpuset("0-x")
+
+
+def test_format_cpuset_round_trip():
+    assert format_cpuset({0, 1, 2, 5, 7, 8}) == "0-2,5,7-8"
+    assert parse_cpuset(format_cpuset({0, 1, 2, 5, 7, 8})) == {0, 1, 2, 5, 7, 8}
+    assert format_cpuset([]) == ""
+
+
+def test_plan_prefers_whole_cores_on_one_node():
+    plan = plan_pinning(_topology(), used={1}, vcpus=4)
+    # Node 0 has a half-used core (0/1), so node 1 with all cores free wins.
+    assert plan["nodes"] == {1}
+    assert plan["vcpus"] == {0: {8}, 1: {9}, 2: {10}, 3: {11}}
+    assert plan["numa_mode"] == "strict"
+    assert plan["emulator"] == {8, 9, 10, 11}
+
+
+def test_plan_uses_free_cores_before_half_used_ones():
+    plan = plan_pinning(_topology(nodes=1), used={0}, vcpus=3)
+    assert [cpus for _, cpus in sorted(plan["vcpus"].items())] == [{2}, {3}, {4}]
+
+
+def test_plan_never_hands_out_used_or_reserved_cpus():
+    topology = _topology()
+    used, reserved = {0, 1, 2}, {8, 9}
+    plan = plan_pinning(topology, used, vcpus=6, reserved=reserved)
+    chosen = set().union(*plan["vcpus"].values())
+    assert not chosen & (used | reserved)
+    assert plan["emulator"] == reserved
+
+
+def test_plan_skips_node_without_enough_memory():
+    topology = _topology()
+    topology["nodes"][0]["free_mb"] = 512
+    assert plan_pinning(topology, set(), vcpus=2, memory_mb=1024)["nodes"] == {1}
+
+
+def test_plan_on_requested_node():
+    assert plan_pinning(_topology(), set(), vcpus=2, node=1)["nodes"] == {1}
+    with pytest.raises(PinningError, match="no NUMA node 5"):
+        plan_pinning(_topology(), set(), vcpus=2, node=5)
+
+
+def test_plan_spans_nodes_only_when_allowed():
+    with pytest.raises(PinningError):
+        plan_pinning(_topology(), set(), vcpus=10)
+    plan = plan_pinning(_topology(), set(), vcpus=10, allow_span=True)
+    assert plan["nodes"] == {0, 1}
+    assert plan["numa_mode"] == "interleave"
+    assert len(set().union(*plan["vcpus"].values())) == 10
+    with pytest.raises(PinningError):
+        plan_pinning(_topology(), set(), vcpus=17, allow_span=True)
+
+
+def _manual(vcpus=None, numa_node=None, emulator=None):
+    return SimpleNamespace(vcpus=vcpus, numa_node=numa_node, emulator=emulator)
+
+
+def test_manual_plan():
+    plan = PinningService("")._manual_plan(_topology(), {4}, 2, _manual({"0": "0", "1": "1"}, emulator="2"))
+    assert plan == {"vcpus": {0: {0}, 1: {1}}, "emulator": {2}, "nodes": {0}, "numa_mode": "strict"}
+
+
+@pytest.mark.parametrize("request_, message", [
+    (_manual(), "needs a cpuset"),
+    (_manual({"2": "0"}), "no vCPU 2"),
+    (_manual({"0": "99"}), "does not have"),
+    (_manual({"0": "4"}), "already pinned"),
+    (_manual({"0": "0"}, numa_node=7), "no NUMA node 7"),
+    (_manual({"0": "0"}, emulator="64"), "Emulator CPU list"),
+])
+def test_manual_plan_rejects(request_, message):
+    with pytest.raises(PinningError, match=message):
+        PinningService("")._manual_plan(_topology(), {4}, 2, request_)
+
+
+def test_pinning_xml_round_trip():
+    root = ET.fromstring("<domain><name>vm</name><vcpu>2</vcpu><devices><disk/></devices></domain>")
+    plan = plan_pinning(_topology(), set(), vcpus=2)
+    _write_pinning_xml(root, plan)
+    xml = ET.tostring(root, encoding="unicode")
+    assert xml.index("<cputune>") < xml.index("<devices>")
+    assert extract(xml).pinning() == {
+        "vcpus": {"0": "0", "1": "1"},
+        "emulator": "0-1",
+        "numa_mode": "strict",
+        "numa_nodes": "0",
+    }
+    _write_pinning_xml(root, None)
+    xml = ET.tostring(root, encoding="unicode")
+    assert "cputune" not in xml and "numatune" not in xml
+    assert extract(xml).pinning() is None
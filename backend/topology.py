@@ -0,0 +1,465 @@
+# Host CPU/NUMA topology and vCPU pinning: reads each host's topology (libvirt capabilities,
+# plus /sys/devices/system/node on the local machine), keeps a host-wide map of pinned CPUs
+# from the inventory, plans non-overlapping NUMA-local pinnings and applies them.
+import os
+import threading
+import xml.etree.ElementTree as ET
+from urllib.parse import urlparse
+
+import libvirt
+
+from config import LIBVIRT_HOSTS, PINNING_RESERVED_CPUS
+from domain_xml import memory_mib
+from inventory import inventory
+
+_NODE_DIR = "/sys/devices/system/node"
+_LIVE = libvirt.VIR_DOMAIN_AFFECT_LIVE
+
+
+class PinningError(Exception):
+    """Raised when a pinning cannot be planned or is invalid for the host."""
+
+
+def parse_cpuset(spec: str | None) -> set[int]:
+    """Parse a libvirt/kernel CPU list such as "0-3,^2,8" into a set of CPU ids."""
+    cpus: set[int] = set()
+    excluded: set[int] = set()
+    for part in (spec or "").replace(" ", "").split(","):
+        if not part:
+            continue
+        target = cpus
+        if part.startswith("^"):
+            target, part = excluded, part[1:]
+        try:
+            if "-" in part:
+                a, b = part.split("-", 1)
+                target.update(range(int(a), int(b) + 1))
+            else:
+                target.add(int(part))
+        except ValueError:
+            raise PinningError(f"Invalid CPU list '{spec}'")
+    return cpus - excluded
+
+
+def format_cpuset(cpus) -> str:
+    """Format CPU ids as a compact list, e.g. {0, 1, 2, 5} -> "0-2,5"."""
+    out = []
+    ordered = sorted(cpus)
+    i = 0
+    while i < len(ordered):
+        j = i
+        while j + 1 < len(ordered) and ordered[j + 1] == ordered[j] + 1:
+            j += 1
+        out.append(str(ordered[i]) if i == j else f"{ordered[i]}-{ordered[j]}")
+        i = j + 1
+    return ",".join(out)
+
+
+def _read(path: str) -> str | None:
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def read_sysfs_nodes(root: str = _NODE_DIR) -> dict[int, dict]:
+    """NUMA nodes of this machine from sysfs: {node: {"cpus": set, "memory_mb", "free_mb"}}."""
+    nodes = {}
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return nodes
+    for name in names:
+        if not (name.startswith("node") and name[4:].isdigit()):
+            continue
+        node = int(name[4:])
+        info = {"cpus": parse_cpuset((_read(f"{root}/{name}/cpulist") or "").strip()), "memory_mb": None, "free_mb": None}
+        for line in (_read(f"{root}/{name}/meminfo") or "").splitlines():
+            # "Node 0 MemTotal:       16314264 kB"
+            parts = line.split()
+            if len(parts) >= 4 and parts[2] in ("MemTotal:", "MemFree:"):
+                key = "memory_mb" if parts[2] == "MemTotal:" else "free_mb"
+                info[key] = int(parts[3]) // 1024
+        nodes[node] = info
+    return nodes
+
+
+def read_topology(conn, local: bool) -> dict:
+    """
+    {"nodes": {node: {"cpus": [...], "memory_mb", "free_mb"}}, "cpus": {cpu: {"node",
+    "socket", "core", "siblings": [...]}}} from the capabilities XML. On the local machine
+    sysfs fills in what capabilities leave out and gives free memory per node without an
+    RPC; remote hosts report free memory per node with getCellsFreeMemory.
+    """
+    root = ET.fromstring(conn.getCapabilities())
+    nodes: dict[int, dict] = {}
+    cpus: dict[int, dict] = {}
+    for cell in root.findall("./host/topology/cells/cell"):
+        node = int(cell.get("id"))
+        memory = cell.find("memory")
+        memory_mb = None
+        if memory is not None and memory.text:
+            memory_mb = memory_mib(memory.text, memory.get("unit", "KiB"))
+        node_cpus = []
+        for cpu in cell.findall("./cpus/cpu"):
+            cpu_id = int(cpu.get("id"))
+            node_cpus.append(cpu_id)
+            cpus[cpu_id] = {
+                "node": node,
+                "socket": int(cpu.get("socket_id", 0)),
+                "core": int(cpu.get("core_id", cpu_id)),
+                "siblings": sorted(parse_cpuset(cpu.get("siblings") or str(cpu_id))),
+            }
+        nodes[node] = {"cpus": sorted(node_cpus), "memory_mb": memory_mb, "free_mb": None}
+
+    if local:
+        for node, info in read_sysfs_nodes().items():
+            entry = nodes.setdefault(node, {"cpus": [], "memory_mb": None, "free_mb": None})
+            if not entry["cpus"]:
+                entry["cpus"] = sorted(info["cpus"])
+                for cpu_id in info["cpus"]:
+                    cpus.setdefault(cpu_id, {"node": node, "socket": 0, "core": cpu_id, "siblings": [cpu_id]})
+            entry["memory_mb"] = entry["memory_mb"] or info["memory_mb"]
+            entry["free_mb"] = info["free_mb"]
+    elif nodes:
+        try:
+            free = conn.getCellsFreeMemory(0, max(nodes) + 1)
+            for node, free_bytes in enumerate(free):
+                if node in nodes:
+                    nodes[node]["free_mb"] = int(free_bytes) // 1024 ** 2
+        except libvirt.libvirtError:
+            pass
+
+    if not nodes:
+        # No NUMA information at all: treat the host as one node.
+        count = conn.getInfo()[2]
+        nodes[0] = {"cpus": list(range(count)), "memory_mb": None, "free_mb": None}
+        for cpu_id in range(count):
+            cpus[cpu_id] = {"node": 0, "socket": 0, "core": cpu_id, "siblings": [cpu_id]}
+    return {"nodes": nodes, "cpus": cpus}
+
+
+def plan_pinning(
+    topology: dict,
+    used: set[int],
+    vcpus: int,
+    memory_mb: int | None = None,
+    node: int | None = None,
+    allow_span: bool = False,
+    reserved: set[int] = frozenset(),
+) -> dict:
+    """
+    Choose one dedicated host CPU per vCPU.
+
+    A single NUMA node is preferred: the one with the most free CPUs among those with
+    enough free memory, unless `node` is given. Within the node, whole free cores are used
+    first so consecutive vCPUs share a core's hyperthreads rather than competing with
+    another guest's vCPUs on the same core. With `allow_span`, a guest too large for any
+    node is spread over the fewest nodes. `used` and `reserved` CPUs are never handed out;
+    the emulator threads go to the reserved (housekeeping) CPUs when there are any.
+    """
+    nodes = topology["nodes"]
+    cpus = topology["cpus"]
+    if node is not None and node not in nodes:
+        raise PinningError(f"Host has no NUMA node {node}")
+
+    def free_cpus(n: int) -> list[int]:
+        return [c for c in nodes[n]["cpus"] if c not in used and c not in reserved]
+
+    def pick(candidates: list[int], count: int) -> list[int]:
+        # Order free CPUs core by core, fully free cores first.
+        by_core: dict[tuple, list[int]] = {}
+        for c in candidates:
+            info = cpus.get(c, {})
+            by_core.setdefault((info.get("socket", 0), info.get("core", c)), []).append(c)
+        def core_key(item):
+            key, members = item
+            siblings = cpus.get(members[0], {}).get("siblings", members)
+            return (len(members) < len(siblings), key)
+        ordered = [c for _, members in sorted(by_core.items(), key=core_key) for c in sorted(members)]
+        return ordered[:count]
+
+    candidates = [node] if node is not None else sorted(
+        nodes,
+        key=lambda n: (
+            memory_mb is not None and nodes[n]["free_mb"] is not None and nodes[n]["free_mb"] < memory_mb,
+            -len(free_cpus(n)),
+            n,
+        ),
+    )
+    chosen: list[int] = []
+    chosen_nodes: list[int] = []
+    for n in candidates:
+        if len(free_cpus(n)) >= vcpus:
+            chosen, chosen_nodes = pick(free_cpus(n), vcpus), [n]
+            break
+    if not chosen:
+        if not allow_span or node is not None:
+            where = f"NUMA node {node}" if node is not None else "any single NUMA node"
+            raise PinningError(f"Not enough free CPUs on {where} for {vcpus} vCPUs")
+        for n in sorted(nodes, key=lambda n: -len(free_cpus(n))):
+            take = pick(free_cpus(n), vcpus - len(chosen))
+            if take:
+                chosen += take
+                chosen_nodes.append(n)
+            if len(chosen) == vcpus:
+                break
+        if len(chosen) < vcpus:
+            raise PinningError(f"Not enough free CPUs on the host for {vcpus} vCPUs")
+
+    node_cpus = {c for n in chosen_nodes for c in nodes[n]["cpus"]}
+    emulator = (reserved & node_cpus) or set(reserved) or set(chosen)
+    return {
+        "vcpus": {vcpu: {cpu} for vcpu, cpu in enumerate(chosen)},
+        "emulator": emulator,
+        "nodes": set(chosen_nodes),
+        "numa_mode": "strict" if len(chosen_nodes) == 1 else "interleave",
+    }
+
+
+def _cpumap(cpus: set[int], size: int) -> tuple[bool, ...]:
+    return tuple(i in cpus for i in range(size))
+
+
+def _cpu_count(topology: dict) -> int:
+    # Length of the cpumaps passed to pinVcpuFlags/pinEmulator: highest CPU id + 1.
+    return max(topology["cpus"], default=-1) + 1
+
+
+def _insert_before_devices(root: ET.Element, tag: str) -> ET.Element:
+    # Where libvirt itself puts tuning elements; domain_xml.extract stops reading at </devices>.
+    elem = ET.Element(tag)
+    devices = root.find("devices")
+    root.insert(list(root).index(devices) if devices is not None else len(root), elem)
+    return elem
+
+
+def _write_pinning_xml(root: ET.Element, plan: dict | None) -> None:
+    """Replace <cputune> pins and the <numatune> memory policy in a domain document."""
+    cputune = root.find("cputune")
+    if cputune is not None:
+        for elem in cputune.findall("vcpupin") + cputune.findall("emulatorpin"):
+            cputune.remove(elem)
+    numatune = root.find("numatune")
+    if numatune is not None:
+        for elem in numatune.findall("memory"):
+            numatune.remove(elem)
+
+    if plan is None:
+        for elem in (cputune, numatune):
+            if elem is not None and len(elem) == 0:
+                root.remove(elem)
+        return
+
+    if cputune is None:
+        cputune = _insert_before_devices(root, "cputune")
+    for vcpu, cpuset in sorted(plan["vcpus"].items()):
+        ET.SubElement(cputune, "vcpupin", vcpu=str(vcpu), cpuset=format_cpuset(cpuset))
+    if plan.get("emulator"):
+        ET.SubElement(cputune, "emulatorpin", cpuset=format_cpuset(plan["emulator"]))
+    if plan.get("nodes"):
+        if numatune is None:
+            numatune = _insert_before_devices(root, "numatune")
+        ET.SubElement(numatune, "memory", mode=plan["numa_mode"], nodeset=format_cpuset(plan["nodes"]))
+
+
+def _describe(plan: dict | None) -> dict | None:
+    if plan is None:
+        return None
+    return {
+        "vcpus": {str(v): format_cpuset(c) for v, c in sorted(plan["vcpus"].items())},
+        "emulator": format_cpuset(plan["emulator"]) if plan.get("emulator") else None,
+        "numa_mode": plan.get("numa_mode") if plan.get("nodes") else None,
+        "numa_nodes": format_cpuset(plan["nodes"]) if plan.get("nodes") else None,
+    }
+
+
+class PinningService:
+    """
+    Topology per host and the host-wide pin map.
+
+    The pin map is derived from the inventory summaries, so reading it costs no libvirt
+    calls. Pinnings applied through this service are also held in an overlay until the
+    inventory has re-read the domain, and planning plus applying happens under a per-host
+    lock, so two concurrent automatic placements never pick the same CPUs.
+    """
+
+    def __init__(self, reserved: str = PINNING_RESERVED_CPUS):
+        self.reserved = parse_cpuset(reserved)
+        self._topologies: dict[str, dict] = {}
+        self._overlay: dict[str, dict[str, dict | None]] = {}
+        self._locks = {host: threading.Lock() for host in LIBVIRT_HOSTS}
+        self._lock = threading.Lock()
+
+    def topology(self, conn, host: str, refresh: bool = False) -> dict:
+        """The host's topology, read once and cached (`refresh` re-reads it)."""
+        with self._lock:
+            cached = self._topologies.get(host)
+        if cached is None or refresh:
+            local = urlparse(LIBVIRT_HOSTS[host]).hostname is None
+            cached = read_topology(conn, local)
+            with self._lock:
+                self._topologies[host] = cached
+        return cached
+
+    def pin_map(self, host: str) -> dict[str, dict]:
+        """{vm: {"vcpus": {vcpu: cpuset}, "emulator", "numa_mode", "numa_nodes"}} for pinned domains on `host`."""
+        pins = {}
+        for vm in inventory.listing():
+            if vm.get("host") == host and vm.get("cpu_pinning"):
+                pins[vm["name"]] = vm["cpu_pinning"]
+        with self._lock:
+            overlay = self._overlay.get(host, {})
+            for name, pinning in list(overlay.items()):
+                if pins.get(name) == pinning:
+                    # The inventory has caught up.
+                    del overlay[name]
+                elif pinning is None:
+                    pins.pop(name, None)
+                else:
+                    pins[name] = pinning
+        return pins
+
+    def used_cpus(self, host: str, exclude: str | None = None) -> dict[int, list[str]]:
+        """CPU id -> ["vm:vcpuN", ...] for every CPU a vCPU on `host` is pinned to."""
+        used: dict[int, list[str]] = {}
+        for name, pinning in self.pin_map(host).items():
+            if name == exclude:
+                continue
+            for vcpu, cpuset in pinning["vcpus"].items():
+                for cpu in parse_cpuset(cpuset):
+                    used.setdefault(cpu, []).append(f"{name}:vcpu{vcpu}")
+        return used
+
+    def host_view(self, conn, host: str, refresh: bool = False) -> dict:
+        topology = self.topology(conn, host, refresh)
+        used = self.used_cpus(host)
+        return {
+            "nodes": {
+                str(n): {
+                    **info,
+                    "cpus": format_cpuset(info["cpus"]),
+                    "free_cpus": format_cpuset(c for c in info["cpus"] if c not in used and c not in self.reserved),
+                }
+                for n, info in sorted(topology["nodes"].items())
+            },
+            "cpus": {str(c): info for c, info in sorted(topology["cpus"].items())},
+            "reserved_cpus": format_cpuset(self.reserved),
+            "cpu_map": {str(c): used[c] for c in sorted(used)},
+            "domains": self.pin_map(host),
+        }
+
+    def pin(self, conn, host: str, vm_name: str, request) -> dict:
+        """Plan (or validate a manual) pinning for `vm_name` and apply it live and persistently."""
+        try:
+            domain = conn.lookupByName(vm_name)
+        except libvirt.libvirtError:
+            raise LookupError(vm_name)
+        topology = self.topology(conn, host)
+        vm = inventory.get(vm_name) or {}
+        vcpus = int(vm.get("vcpus") or domain.vcpusFlags(libvirt.VIR_DOMAIN_VCPU_MAXIMUM))
+
+        with self._locks[host]:
+            used = set(self.used_cpus(host, exclude=vm_name))
+            if request.mode == "auto":
+                plan = plan_pinning(
+                    topology, used, vcpus, vm.get("memory_mb"), request.numa_node, request.allow_span, self.reserved
+                )
+            else:
+                plan = self._manual_plan(topology, used, vcpus, request)
+            try:
+                self._apply(conn, domain, plan, _cpu_count(topology))
+            finally:
+                inventory.invalidate(vm_name, host)
+            described = _describe(plan)
+            with self._lock:
+                self._overlay.setdefault(host, {})[vm_name] = described
+        return described
+
+    def unpin(self, conn, host: str, vm_name: str) -> None:
+        try:
+            domain = conn.lookupByName(vm_name)
+        except libvirt.libvirtError:
+            raise LookupError(vm_name)
+        topology = self.topology(conn, host)
+        with self._locks[host]:
+            self._apply(conn, domain, None, _cpu_count(topology))
+            with self._lock:
+                self._overlay.setdefault(host, {})[vm_name] = None
+        inventory.invalidate(vm_name, host)
+
+    def _manual_plan(self, topology: dict, used: set[int], vcpus: int, request) -> dict:
+        if not request.vcpus:
+            raise PinningError("Manual pinning needs a cpuset for each vCPU in 'vcpus'")
+        plan_vcpus = {}
+        for vcpu, spec in request.vcpus.items():
+            if not 0 <= int(vcpu) < vcpus:
+                raise PinningError(f"The VM has no vCPU {vcpu}")
+            cpus = parse_cpuset(spec)
+            unknown = cpus - set(topology["cpus"])
+            if not cpus or unknown:
+                raise PinningError(f"CPU list '{spec}' for vCPU {vcpu} names CPUs the host does not have")
+            overlap = cpus & used
+            if overlap:
+                raise PinningError(f"CPUs {format_cpuset(overlap)} are already pinned to other VMs")
+            plan_vcpus[int(vcpu)] = cpus
+        all_cpus = set().union(*plan_vcpus.values())
+        nodes = {topology["cpus"][c]["node"] for c in all_cpus}
+        if request.numa_node is not None:
+            if request.numa_node not in topology["nodes"]:
+                raise PinningError(f"Host has no NUMA node {request.numa_node}")
+            nodes = {request.numa_node}
+        if request.emulator:
+            emulator = parse_cpuset(request.emulator)
+            if not emulator or emulator - set(topology["cpus"]):
+                raise PinningError(f"Emulator CPU list '{request.emulator}' names CPUs the host does not have")
+        else:
+            emulator = self.reserved or all_cpus
+        return {
+            "vcpus": plan_vcpus,
+            "emulator": emulator,
+            "nodes": nodes,
+            "numa_mode": "strict" if len(nodes) == 1 else "interleave",
+        }
+
+    def _apply(self, conn, domain, plan: dict | None, cpu_count: int) -> None:
+        """
+        Write the pinning into the persistent definition with one defineXML, then pin a
+        running domain's vCPU and emulator threads live. libvirt validates the definition
+        first, so a rejected pinning changes nothing; if live pinning fails, the previous
+        live pins and definition are restored. The NUMA memory policy only takes effect from
+        the next boot, since guest memory is already allocated.
+        """
+        previous_xml = domain.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE)
+        root = ET.fromstring(previous_xml)
+        _write_pinning_xml(root, plan)
+        conn.defineXML(ET.tostring(root, encoding="unicode"))
+        if not domain.isActive():
+            return
+        previous_vcpus = domain.vcpuPinInfo(_LIVE)
+        previous_emulator = domain.emulatorPinInfo(_LIVE)
+        try:
+            everything = set(range(cpu_count))
+            if plan is None:
+                vcpus = domain.vcpusFlags(_LIVE)
+                for vcpu in range(vcpus):
+                    domain.pinVcpuFlags(vcpu, _cpumap(everything, cpu_count), _LIVE)
+                domain.pinEmulator(_cpumap(everything, cpu_count), _LIVE)
+            else:
+                for vcpu, cpus in plan["vcpus"].items():
+                    domain.pinVcpuFlags(vcpu, _cpumap(cpus, cpu_count), _LIVE)
+                if plan.get("emulator"):
+                    domain.pinEmulator(_cpumap(plan["emulator"], cpu_count), _LIVE)
+        except libvirt.libvirtError:
+            try:
+                for vcpu, cpumap in enumerate(previous_vcpus):
+                    domain.pinVcpuFlags(vcpu, cpumap, _LIVE)
+                domain.pinEmulator(previous_emulator, _LIVE)
+                conn.defineXML(previous_xml)
+            except libvirt.libvirtError:
+                pass
+            raise
+
+
+pinning = PinningService()
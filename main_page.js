@@ -7,16 +7,16 @@ async function stopVM(name) {
     }
 }
 
-function openViewer(name, port) {
+function openViewer(name) {
     const url = new URL('vmViewer.html', window.location.href);
     url.searchParams.set('name', name);
-    url.searchParams.set('port', port);
     window.location.href = url.toString();
 }
 
 function createVMElement(vm) {
     const container = document.createElement('div');
     container.className = 'vm-container';
+    container.dataset.vmName = vm.name;
 
     container.innerHTML = `
 <div class="vm-box">
@@ -44,7 +44,7 @@ function createVMElement(vm) {
     container.querySelector('.start-styling').onclick = () => startVM(vm.name);
     container.querySelector('.stop-styling').onclick = () => stopVM(vm.name);
     container.querySelector('.reboot').onclick = () => restartVM(vm.name);
-    container.querySelector('.enter-viewer').onclick = () => openViewer(vm.name, vm.port);
+    container.querySelector('.enter-viewer').onclick = () => openViewer(vm.name);
 
     // Attach handlers for extra buttons using the actual VM name
     const forceBtn = container.querySelector('.force-off');
@@ -124,19 +124,79 @@ async function killVM(name) {
     }
 }
 
-async function loadVMs() {
-    vmListDiv.textContent = 'Loading VMs...';
-    const vms = await fetchVMs();
+// Current VM list keyed by name, kept up to date by loadVMs() and the /vms/events stream.
+const vmState = new Map();
+
+function renderVMs() {
     vmListDiv.textContent = '';
 
-    if (vms.length === 0) {
+    if (vmState.size === 0) {
         vmListDiv.textContent = 'No VMs found.';
         return;
     }
 
-    vms.forEach(vm => {
+    vmState.forEach(vm => {
         vmListDiv.appendChild(createVMElement(vm));
     });
+    afterVMsRendered();
+}
+
+// Re-apply the status styling and hover handlers from vmDropDown.js to freshly built boxes.
+function afterVMsRendered() {
+    if (typeof updateVMStatuses === 'function') updateVMStatuses();
+    if (typeof attachHoverEvents === 'function') attachHoverEvents();
+}
+
+function applyVMSnapshot(vms) {
+    vmState.clear();
+    vms.forEach(vm => vmState.set(vm.name, vm));
+    renderVMs();
+}
+
+// Apply a batch of {op: 'add'|'remove'|'update'} changes. Updates only rebuild the affected
+// box; additions and removals re-render the list so ordering stays consistent.
+function applyVMChanges(changes) {
+    let structural = false;
+    changes.forEach(change => {
+        if (change.op === 'add') {
+            vmState.set(change.vm.name, change.vm);
+            structural = true;
+        } else if (change.op === 'remove') {
+            structural = vmState.delete(change.name) || structural;
+        } else if (change.op === 'update') {
+            const vm = vmState.get(change.name);
+            if (!vm) return;
+            Object.assign(vm, change.fields);
+            const old = vmListDiv.querySelector(`[data-vm-name="${CSS.escape(change.name)}"]`);
+            if (old) old.replaceWith(createVMElement(vm));
+            else structural = true;
+        }
+    });
+    if (structural) renderVMs();
+    else afterVMsRendered();
+}
+
+async function loadVMs() {
+    if (vmState.size === 0) vmListDiv.textContent = 'Loading VMs...';
+    applyVMSnapshot(await fetchVMs());
+}
+
+// Subscribe to the backend's Server-Sent Events stream (snapshot, then deltas).
+// Returns false when the browser has no EventSource so the caller can fall back to polling.
+function subscribeVMEvents() {
+    if (!window.EventSource) return false;
+    const source = new EventSource(`${window.API_BASE || API_BASE}/vms/events`);
+    source.addEventListener('snapshot', ev => applyVMSnapshot(JSON.parse(ev.data).vms || []));
+    source.addEventListener('delta', ev => applyVMChanges(JSON.parse(ev.data).changes || []));
+    source.onerror = () => {
+        // EventSource reconnects by itself and receives a fresh snapshot; only give up
+        // (and poll instead) if the browser closed the stream for good.
+        if (source.readyState === EventSource.CLOSED) {
+            console.warn('VM event stream closed, falling back to polling');
+            setInterval(loadVMs, 3000);
+        }
+    };
+    return true;
 }
 
 // Load on page load
@@ -157,7 +217,9 @@ window.addEventListener("load", () => {
     }
 });
 
-setInterval(fetchVMs, 3000);
+if (!subscribeVMEvents()) {
+    setInterval(loadVMs, 3000);
+}
 
 // Admin modal handlers
 (function() {
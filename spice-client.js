@@ -2,23 +2,58 @@ import * as SpiceHtml5 from './src/main.js';
 
 
 
-var host = null, port = null;
+var host = null;
 var sc;
 
+const params = new URLSearchParams(window.location.search);
+const vmName = params.get('name');
+
+// The backend relays each VM's SPICE display over a WebSocket at /vms/{name}/console.
+// `user` labels the session in the backend's /consoles listing. ?decode=server on the page
+// (remembered in localStorage) has the backend decode images for slow client machines;
+// ?capture=1 records this one session for backend/replay_console.py (when the backend has
+// CONSOLE_CAPTURE_ENABLED).
+function consoleUri(host, user) {
+    var base = window.API_BASE || ("http://" + host + ":8000");
+    var uri = base.replace(/^http/, "ws") + "/vms/" + encodeURIComponent(vmName) + "/console";
+    var params = new URLSearchParams();
+    if (user)
+        params.set("user", user);
+    var decode = new URLSearchParams(window.location.search).get("decode");
+    if (decode)
+        localStorage.setItem("consoleDecode", decode);
+    else
+        decode = localStorage.getItem("consoleDecode");
+    if (decode)
+        params.set("decode", decode);
+    if (new URLSearchParams(window.location.search).get("capture") === "1")
+        params.set("capture", "1");
+    var query = params.toString();
+    return query ? uri + "?" + query : uri;
+}
+
+async function consoleUser() {
+    try {
+        if (window.authInitPromise) await window.authInitPromise;
+        const profile = window.getUser ? await window.getUser() : null;
+        return profile ? (profile.email || profile.name || profile.sub) : null;
+    } catch (e) {
+        return null;
+    }
+}
+
 function spice_error(e)
 {
     disconnect();
 }
 
-function connect() {
+async function connect() {
     var host = document.getElementById("host").value;
-    var port = document.getElementById("port").value;
     var password = document.getElementById("password").value;
-    var scheme = "ws://";
     var uri;
 
-    if (!host || !port) {
-        console.log("must set host and port");
+    if (!host || !vmName) {
+        console.log("must set host and VM name");
         return;
     }
 
@@ -26,7 +61,7 @@ function connect() {
         sc.stop();
     }
 
-    uri = scheme + host + ":" + port;
+    uri = consoleUri(host, await consoleUser());
 
     const btn = document.getElementById('connectButton');
 
@@ -114,9 +149,4 @@ window.addEventListener('spice-port-event', function(event) {
 document.getElementById('connectButton').onclick = connect;
 document.getElementById('sendCtrlAltDel').addEventListener('click', function(){ SpiceHtml5.sendCtrlAltDel(sc); });
 
-const params = new URLSearchParams(window.location.search);
-
-const vmPort = params.get('port');
-document.getElementById("port").value = vmPort;
-
 connect()
\ No newline at end of file
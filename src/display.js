@@ -316,6 +316,23 @@ SpiceDisplayConn.prototype.process_channel_message = function(msg)
                       descriptor : draw_copy.data.src_bitmap.descriptor
                     });
             }
+            else if (draw_copy.data.src_bitmap.descriptor.type == Constants.VMUI_IMAGE_TYPE_RGBA)
+            {
+                // Decoded by the backend: the pixels are already in canvas order.
+                var rgba = draw_copy.data.src_bitmap.rgba;
+                var source_img = new ImageData(new Uint8ClampedArray(rgba.data),
+                                        draw_copy.data.src_bitmap.descriptor.width,
+                                        draw_copy.data.src_bitmap.descriptor.height);
+
+                return this.draw_copy_helper(
+                    { base: draw_copy.base,
+                      src_area: draw_copy.data.src_area,
+                      image_data: source_img,
+                      tag: "rgba." + rgba.has_alpha,
+                      has_alpha: rgba.has_alpha ? true : false,
+                      descriptor : draw_copy.data.src_bitmap.descriptor
+                    });
+            }
             else
             {
                 this.log_warn("FIXME: DrawCopy unhandled image type: " + draw_copy.data.src_bitmap.descriptor.type);
@@ -243,6 +243,8 @@ export var Constants = {
   SPICE_IMAGE_TYPE_FROM_CACHE_LOSSLESS : 106,
   SPICE_IMAGE_TYPE_ZLIB_GLZ_RGB   : 107,
   SPICE_IMAGE_TYPE_JPEG_ALPHA     : 108,
+  // Not SPICE protocol: LZ images decoded by the backend relay (backend/spice_decode.py).
+  VMUI_IMAGE_TYPE_RGBA            : 200,
 
   SPICE_IMAGE_FLAGS_CACHE_ME : (1 << 0),
   SPICE_IMAGE_FLAGS_HIGH_BITS_SET : (1 << 1),
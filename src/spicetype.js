@@ -219,6 +219,14 @@ SpiceImage.prototype =
             at = this.bitmap.from_dv(dv, at, mb);
         }
 
+        if (this.descriptor.type == Constants.VMUI_IMAGE_TYPE_RGBA)
+        {
+            this.rgba = new Object;
+            this.rgba.has_alpha = dv.getUint8(at, true); at++;
+            this.rgba.data = mb.slice(at, at + this.descriptor.width * this.descriptor.height * 4);
+            at += this.rgba.data.byteLength;
+        }
+
         if (this.descriptor.type == Constants.SPICE_IMAGE_TYPE_SURFACE)
         {
             this.surface_id = dv.getUint32(at, true); at += 4;
@@ -16,29 +16,20 @@ echo ""
 
 echo "Starting services..."
 
-# 1️⃣ Start SPICE websockify bridge
-echo "[1/3] Starting websockify on port 5959 → 5900"
-websockify 5959 localhost:5900 &
-sleep 1
-
-# 2️⃣ Start FastAPI backend
-echo "[2/3] Starting FastAPI backend on port 8000"
+# Start the FastAPI backend. It also serves the web UI from this directory (compressed,
+# cached) and relays SPICE consoles at ws://…:8000/vms/<name>/console; WebSocket support
+# needs uvicorn[standard] or the websockets package.
+echo "Starting FastAPI backend on port 8000 (serving $FRONTEND_DIR)"
 cd "$BACKEND_DIR"
-uvicorn main:app --host 0.0.0.0 --port 8000 --reload &
-sleep 1
-
-# 3️⃣ Start frontend server serving the entire parent directory
-echo "[3/3] Starting frontend server on port 3000"
-cd "$FRONTEND_DIR"
-python3 -m http.server 3000 &
+STATIC_DIR="$FRONTEND_DIR" uvicorn main:app --host 0.0.0.0 --port 8000 --reload &
 sleep 1
 
 
 echo ""
 echo "All services started."
-echo "Web UI:        http://localhost:3000/main_page.html"
+echo "Web UI:        http://localhost:8000/main_page.html"
 echo "API backend:   http://localhost:8000"
-echo "SPICE bridge:  ws://localhost:5959"
+echo "SPICE consoles: ws://localhost:8000/vms/<name>/console"
 echo ""
 
 # Wait for all background processes
@@ -180,6 +180,9 @@ function handleHoverLeave(e) {
 function attachHoverEvents() {
     const boxes = document.querySelectorAll(".vm-box");
     boxes.forEach(box => {
+        // main_page.js calls this after every render; only wire up boxes once.
+        if (box.dataset.hoverBound) return;
+        box.dataset.hoverBound = "1";
         box.addEventListener("mouseenter", handleHoverEnter);
         box.addEventListener("mouseleave", handleHoverLeave);
     });
@@ -194,5 +197,5 @@ async function restartVM(name) {
     }
 }
 
-setTimeout(attachHoverEvents, 1000);
-setInterval(updateVMStatuses, 1000);
+// main_page.js calls attachHoverEvents() and updateVMStatuses() whenever it renders VM boxes,
+// so no timers are needed here.